@@ -0,0 +1,103 @@
+"""
+Benchmark: importación masiva de órdenes
+
+Compara registrar órdenes de a una con POST /create (una transacción y un
+redirect por orden) con /api/ordenes: JSON de a INTAKE_MAX_BATCH órdenes y
+NDJSON en una sola solicitud, guardado en transacciones de
+INTAKE_BATCH_SIZE. Los trabajos de render quedan encolados sin procesar
+(JOB_WORKERS=0) para medir sólo la recepción.
+
+Uso:
+    python benchmarks/bench_bulk_intake.py [--orders 5000] [--batch-size 500]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+WORKDIR = tempfile.mkdtemp(prefix='bench_intake_')
+os.environ['DB_FILE'] = os.path.join(WORKDIR, 'bench.db')
+os.environ['UPLOADS_DIR'] = os.path.join(WORKDIR, 'uploads')
+os.environ['PDF_DIR'] = os.path.join(WORKDIR, 'pdfs')
+os.environ['JOB_WORKERS'] = '0'
+os.chdir(WORKDIR)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging  # noqa: E402
+import informe_tecnico_web_app as app_module  # noqa: E402
+
+logging.getLogger(app_module.__name__).setLevel(logging.WARNING)
+
+def order(i):
+    return {
+        'idempotency_key': str(uuid.uuid4()),
+        'institucion': f'Hospital Regional {i % 40}', 'fecha': '2024-05-10',
+        'encargado': 'María González', 'contacto': f'biomedica{i % 40}@example.com',
+        'equipo': 'Autoclave', 'marca_modelo': 'Tuttnauer 3870', 'numero_serie': f'SN-{i}',
+        'tecnico_nombre': 'Juan Pérez', 'problema_cliente': 'No alcanza la temperatura de esterilización',
+        'detalles_servicio': 'Se reemplaza resistencia y se calibra sensor de temperatura',
+        'servicio_mantenimiento': 'si', 'garantia': 'fuera_garantia',
+        'mantenimiento_limpieza_lubricacion': 'aplica', 'mantenimiento_calibracion_ejes': 'no_aplica',
+        'pieza_descripcion': ['Resistencia 2000W', 'Empaquetadura puerta', 'Filtro bacteriológico'],
+        'pieza_cantidad': ['1', '1', '2'],
+    }
+
+def report(label, results, elapsed):
+    created = sum(r['estado'] == 'created' for r in results)
+    print(f"{label:<34} {created:>6} creadas  {elapsed:7.2f}s  {created / elapsed:9.1f} órdenes/s")
+
+def run_create(client, orders):
+    results = []
+    started = time.perf_counter()
+    for o in orders:
+        response = client.post('/create', data={k: v for k, v in o.items() if k != 'idempotency_key'})
+        results.append({'estado': 'created' if response.status_code == 302 else 'error'})
+    report('antes: /create de a una', results, time.perf_counter() - started)
+
+def run_json(client, orders):
+    results = []
+    batch = app_module.config.INTAKE_MAX_BATCH
+    started = time.perf_counter()
+    for i in range(0, len(orders), batch):
+        results += client.post('/api/ordenes', json={'ordenes': orders[i:i + batch]}).json['resultados']
+    report(f'/api/ordenes JSON (lotes de {batch})', results, time.perf_counter() - started)
+
+def run_ndjson(client, orders, label='/api/ordenes NDJSON'):
+    body = ''.join(json.dumps(o) + '\n' for o in orders).encode('utf-8')
+    started = time.perf_counter()
+    response = client.post('/api/ordenes', data=body, content_type='application/x-ndjson')
+    # La respuesta llega por lotes: se mide hasta recibirla completa
+    data = response.data
+    elapsed = time.perf_counter() - started
+    results = [json.loads(line) for line in data.splitlines()]
+    report(label, results, elapsed)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--create-orders', type=int, default=500, help='órdenes para /create, que es más lento')
+    parser.add_argument('--batch-size', type=int, default=app_module.config.INTAKE_BATCH_SIZE)
+    args = parser.parse_args()
+    app_module.config.INTAKE_BATCH_SIZE = args.batch_size
+    
+    client = app_module.app.test_client()
+    print(f"{args.orders} órdenes, 3 piezas y 4 ítems de checklist cada una (directorio {WORKDIR})")
+    run_create(client, [order(i) for i in range(args.create_orders)])
+    run_json(client, [order(i) for i in range(args.orders)])
+    orders = [order(i) for i in range(args.orders)]
+    run_ndjson(client, orders, f'/api/ordenes NDJSON (tx de {args.batch_size})')
+    results = run_ndjson(client, orders, '  reenvío del mismo NDJSON')
+    print(f"  {sum(r['estado'] == 'duplicate' for r in results)} duplicadas")
+    
+    with app_module.db_connection() as conn:
+        informes = conn.execute('SELECT COUNT(*) FROM informes').fetchone()[0]
+    jobs = app_module.storage.queue_depth()[('jobs', 'queued')]
+    print(f"informes: {informes}, renders encolados: {jobs}")
+
+if __name__ == '__main__':
+    main()
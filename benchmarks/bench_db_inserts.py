@@ -0,0 +1,104 @@
+"""
+Benchmark: inserciones concurrentes de órdenes de trabajo
+
+Compara el acceso a BD original (una conexión nueva por operación, journal
+por defecto) con el pool de conexiones en modo WAL de db_connection().
+
+Uso:
+    python benchmarks/bench_db_inserts.py [--threads 8] [--orders 200]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+WORKDIR = tempfile.mkdtemp(prefix='bench_db_')
+os.environ['DB_FILE'] = os.path.join(WORKDIR, 'pool.db')
+os.environ['UPLOADS_DIR'] = os.path.join(WORKDIR, 'uploads')
+os.environ['PDF_DIR'] = os.path.join(WORKDIR, 'pdfs')
+os.chdir(WORKDIR)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging  # noqa: E402
+import informe_tecnico_web_app as app_module  # noqa: E402
+
+logging.getLogger(app_module.__name__).setLevel(logging.WARNING)
+
+INSERT_SQL = '''
+    INSERT INTO informes (institucion, encargado, contacto, fecha, equipo, numero_serie,
+                          problema_cliente, detalles_servicio, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+ENQUEUE_SQL = "INSERT INTO jobs (informe_id, tipo, estado, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)"
+
+def order_values(worker, i):
+    return (
+        f'Hospital {worker}', 'Encargado', 'contacto@example.com', '2024-01-01',
+        'Autoclave', f'SN-{worker}-{i}', 'No enciende', 'Se reemplaza fusible',
+        '2024-01-01T00:00:00'
+    )
+
+def insert_legacy(db_file, worker, i):
+    """Comportamiento original: sqlite3.connect + commit + close por operación"""
+    conn = sqlite3.connect(db_file)
+    try:
+        cursor = conn.execute(INSERT_SQL, order_values(worker, i))
+        now = datetime.now().isoformat()
+        conn.execute(ENQUEUE_SQL, (cursor.lastrowid, 'render', now, now))
+        conn.commit()
+    finally:
+        conn.close()
+
+def insert_pooled(worker, i):
+    with app_module.db_connection() as conn:
+        cursor = conn.execute(INSERT_SQL, order_values(worker, i))
+        # SQLiteStorage usa db_connection(): el INSERT en jobs va en esta misma transacción
+        app_module.enqueue_job(cursor.lastrowid, 'render')
+
+def run(label, insert, threads, orders):
+    errors = []
+    
+    def worker(n):
+        for i in range(orders):
+            try:
+                insert(n, i)
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+    
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+    
+    total = threads * orders - len(errors)
+    print(f"{label:<28} {total:>7} órdenes  {elapsed:7.2f}s  {total / elapsed:9.1f} órdenes/s  errores: {len(errors)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--orders', type=int, default=200, help='órdenes por hilo')
+    args = parser.parse_args()
+    
+    legacy_db = os.path.join(WORKDIR, 'legacy.db')
+    conn = sqlite3.connect(legacy_db)
+    for _, _, migrate in app_module.MIGRATIONS:
+        migrate(conn)
+    conn.commit()
+    conn.close()
+    
+    print(f"{args.threads} hilos x {args.orders} órdenes (directorio {WORKDIR})")
+    run('antes: conexión por operación', lambda n, i: insert_legacy(legacy_db, n, i), args.threads, args.orders)
+    run('después: pool + WAL', insert_pooled, args.threads, args.orders)
+    print(f"pool: {app_module.db_pool.stats()}")
+
+if __name__ == '__main__':
+    main()
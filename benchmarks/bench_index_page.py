@@ -0,0 +1,74 @@
+"""
+Benchmark: página principal
+
+Mide el tiempo de respuesta de / y de /ordenes (la lista sola) con una BD
+de órdenes de ejemplo, y el peso de lo que descarga el navegador: el HTML
+en cada visita y el CSS/JS (con y sin compresión) sólo la primera vez.
+
+Uso:
+    python benchmarks/bench_index_page.py [--requests 300] [--orders 60]
+"""
+
+import argparse
+import gzip
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='bench_index_')
+os.environ['DB_FILE'] = os.path.join(WORKDIR, 'bench.db')
+os.environ['UPLOADS_DIR'] = os.path.join(WORKDIR, 'uploads')
+os.environ['PDF_DIR'] = os.path.join(WORKDIR, 'pdfs')
+os.chdir(WORKDIR)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging  # noqa: E402
+import informe_tecnico_web_app as app_module  # noqa: E402
+
+logging.getLogger(app_module.__name__).setLevel(logging.WARNING)
+
+def seed_orders(n):
+    for i in range(n):
+        app_module.storage.insert_informe({
+            'institucion': f'Hospital Regional {i}', 'fecha': '2024-05-10',
+            'equipo': 'Autoclave', 'tecnico_nombre': 'Juan Pérez',
+            'pdf_path': '', 'created_at': '2024-05-10T10:00:00',
+        })
+
+def measure(client, url, requests):
+    client.get(url)  # calentamiento
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    print(f"{url}")
+    print(f"  media:   {statistics.mean(timings) * 1000:7.2f} ms")
+    print(f"  p95:     {timings[int(len(timings) * 0.95) - 1] * 1000:7.2f} ms")
+    print(f"  HTML:    {len(response.data) / 1024:7.1f} KB ({len(gzip.compress(response.data)) / 1024:.1f} KB gzip)")
+    return response
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--orders', type=int, default=60)
+    args = parser.parse_args()
+    
+    seed_orders(args.orders)
+    client = app_module.app.test_client()
+    page = measure(client, '/', args.requests)
+    measure(client, '/ordenes', args.requests)
+    
+    for url in re.findall(r'/assets/[^"]+', page.data.decode('utf-8')):
+        sizes = []
+        for encoding in ('identity', 'gzip', 'br'):
+            response = client.get(url, headers={'Accept-Encoding': encoding})
+            sizes.append(f"{response.headers.get('Content-Encoding', 'identity')} {len(response.data) / 1024:.1f} KB")
+        print(f"{url}: {', '.join(sizes)} ({response.headers['Cache-Control']})")
+
+if __name__ == '__main__':
+    main()
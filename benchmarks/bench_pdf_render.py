@@ -0,0 +1,129 @@
+"""
+Benchmark: tiempo de generación de PDF por orden de trabajo
+
+Renderiza repetidamente una orden representativa con generate_pdf() y
+reporta el tiempo por PDF y el tamaño del archivo generado.
+
+Uso:
+    python benchmarks/bench_pdf_render.py [--renders 200] [--long] [--firmas [vector|png]]
+"""
+
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='bench_pdf_')
+os.environ['DB_FILE'] = os.path.join(WORKDIR, 'bench.db')
+os.environ['UPLOADS_DIR'] = os.path.join(WORKDIR, 'uploads')
+os.environ['PDF_DIR'] = os.path.join(WORKDIR, 'pdfs')
+os.chdir(WORKDIR)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging  # noqa: E402
+import informe_tecnico_web_app as app_module  # noqa: E402
+
+logging.getLogger(app_module.__name__).setLevel(logging.WARNING)
+
+def sample_order(long_text=False):
+    texto = 'Equipo presenta falla intermitente en el sistema de calefacción y alarma de presión. '
+    data = {
+        'id': 1234, 'institucion': 'Hospital Clínico Regional', 'encargado': 'María González',
+        'contacto': 'mgonzalez@example.com', 'comuna': 'Providencia', 'ciudad': 'Santiago',
+        'fecha': '2024-05-10', 'equipo': 'Autoclave', 'marca_modelo': 'Tuttnauer 3870EA',
+        'numero_serie': 'SN-88231', 'tecnico_nombre': 'Juan Pérez',
+        'servicio_mantenimiento': 'si', 'servicio_correctivo': 'si',
+        'garantia_fuera_garantia': 'si',
+        'problema_cliente': texto * (20 if long_text else 2),
+        'inspeccion_visual': 'Sin daños visibles en carcasa. Conexiones en buen estado.',
+        'mediciones_parametros': 'Tensión 220V, Temperatura 134°C, Presión 2.1 bar',
+        'piezas': [('Fusible 10A', '2'), ('Empaquetadura puerta', '1')],
+        'detalles_servicio': texto * (30 if long_text else 3),
+        'resolucion_operativo': 'si',
+        'mantenimiento_otros': 'aplica', 'mantenimiento_otros_especificar': 'Ajuste de bisagras',
+    }
+    for i, item in enumerate(app_module.CHECKLIST_BY_GROUP['mantenimiento']):
+        data.setdefault(item.key, 'aplica' if i % 3 else 'no_aplica')
+    return data
+
+def signature_strokes(seed):
+    """Trazos de una firma en coordenadas de un canvas de 560x150"""
+    zigzag = [(40 + i * 12, 75 + ((i * 37 + seed * 11) % 120) / 2 - 30) for i in range(30)]
+    underline = [(60, 110), (300 + seed * 40, 100)]
+    return [zigzag, underline]
+
+def sample_signature(seed):
+    """Firma como la enviaban los clientes anteriores: PNG opaco de 560x150 con trazos de 3 px"""
+    from io import BytesIO
+    from PIL import Image, ImageDraw
+    # Se dibuja al doble y se reduce para tener bordes suavizados como el navegador
+    img = Image.new('RGB', (1120, 300), 'white')
+    draw = ImageDraw.Draw(img)
+    for stroke in signature_strokes(seed):
+        draw.line([(x * 2, y * 2) for x, y in stroke], fill='black', width=6, joint='curve')
+    out = BytesIO()
+    img.resize((560, 150), Image.LANCZOS).save(out, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(out.getvalue()).decode()
+
+def sample_signature_strokes(seed):
+    """Firma como la envía el formulario: trazos con un punto cada ~3 px, codificados en diferencias"""
+    encoded = []
+    for stroke in signature_strokes(seed):
+        points = [stroke[0]]
+        for (x0, y0), (x1, y1) in zip(stroke, stroke[1:]):
+            steps = max(1, int(max(abs(x1 - x0), abs(y1 - y0)) / 3))
+            points += [(x0 + (x1 - x0) * k / steps, y0 + (y1 - y0) * k / steps) for k in range(1, steps + 1)]
+        points = [(round(x), round(y)) for x, y in points]
+        deltas = list(points[0])
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            deltas += [x1 - x0, y1 - y0]
+        encoded.append(deltas)
+    return json.dumps({'w': 560, 'h': 150, 's': encoded}, separators=(',', ':'))
+
+def add_signatures(data, kind):
+    sizes = []
+    for key, seed in (('tech_sig', 1), ('client_sig', 2)):
+        if kind == 'vector':
+            field = sample_signature_strokes(seed)
+            data[key] = app_module.signature_store.put_strokes(field)
+        else:
+            field = sample_signature(seed)
+            data[key] = app_module.signature_store.put(base64.b64decode(field.split(',', 1)[1]))
+        sizes.append(len(field))
+    app_module.signature_store.flush()
+    stored = sum(os.path.getsize(data[key]) for key in ('tech_sig', 'client_sig'))
+    print(f"firmas ({kind}): {sum(sizes) / 1024:.1f} KB en el formulario, {stored / 1024:.1f} KB almacenadas")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--renders', type=int, default=200)
+    parser.add_argument('--long', action='store_true', help='textos largos (varias páginas)')
+    parser.add_argument('--firmas', nargs='?', const='vector', choices=('vector', 'png'),
+                        help='incluir firma del técnico y del cliente (trazos o PNG)')
+    args = parser.parse_args()
+    
+    data = sample_order(args.long)
+    if args.firmas:
+        add_signatures(data, args.firmas)
+    path = os.path.join(WORKDIR, 'bench.pdf')
+    app_module.generate_pdf(path, data)  # calentamiento
+    
+    timings = []
+    for _ in range(args.renders):
+        started = time.perf_counter()
+        app_module.generate_pdf(path, data)
+        timings.append(time.perf_counter() - started)
+    
+    timings.sort()
+    print(f"{args.renders} PDFs{' (texto largo)' if args.long else ''}")
+    print(f"  media:   {statistics.mean(timings) * 1000:7.2f} ms/PDF")
+    print(f"  mediana: {statistics.median(timings) * 1000:7.2f} ms/PDF")
+    print(f"  p95:     {timings[int(len(timings) * 0.95) - 1] * 1000:7.2f} ms/PDF")
+    print(f"  tamaño:  {os.path.getsize(path) / 1024:7.1f} KB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+"""
+Hooks de gunicorn (se carga solo desde el directorio de trabajo)
+
+Cada worker arranca la cola de trabajos y la bandeja de salida en cuanto
+carga la app, sin esperar su primera petición, y al salir guarda las
+firmas que aún estén en memoria. La app se importa dentro de los hooks:
+importarla aquí la cargaría en el proceso maestro, antes del fork.
+"""
+
+def post_worker_init(worker):
+    import informe_tecnico_web_app
+    informe_tecnico_web_app.start_background_workers()
+
+def worker_exit(server, worker):
+    import informe_tecnico_web_app
+    informe_tecnico_web_app.stop_background_workers()
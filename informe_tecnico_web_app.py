@@ -10,40 +10,128 @@ import re
 import secrets
 import traceback
 import logging
-from io import BytesIO
+import threading
+import time
+import queue
+import zlib
+import unicodedata
+import copy
+import hashlib
+import json
+import csv
+import zipfile
+import gzip
+import argparse
+import signal
+import tempfile
+import mimetypes
+import bisect
+import random
+import atexit
+import contextvars
+import urllib.request
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import itertools
+from io import BytesIO, StringIO
 from datetime import datetime
 from contextlib import contextmanager
 from dataclasses import dataclass
-from flask import Flask, request, redirect, url_for, send_from_directory, render_template_string, flash
+from flask import Flask, Response, request, redirect, url_for, send_file, render_template, flash, g, stream_with_context
+from jinja2 import DictLoader
+from werkzeug.exceptions import HTTPException
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas as rcanvas
+from reportlab.pdfbase import pdfdoc
+from reportlab.lib.rl_accel import fp_str
 from PIL import Image
 import smtplib
 from email.message import EmailMessage
 
-import os
-# Usar PostgreSQL en producción, SQLite en desarrollo
-if os.environ.get('RENDER'):
-    import psycopg2
-    # Configuración para PostgreSQL
-    DATABASE_URL = os.environ.get('DATABASE_URL')
-else:
-    # SQLite para desarrollo
-    DATABASE_URL = 'sqlite:///informes.db'
-
 # --- Configuración Mejorada ---
 @dataclass
 class Config:
     SECRET_KEY: str = os.environ.get('SECRET_KEY', secrets.token_hex(16))
     DB_FILE: str = os.environ.get('DB_FILE', 'informes.db')
+    # postgresql://... usa PostgreSQL para los informes; vacío usa SQLite (DB_FILE)
+    DATABASE_URL: str = os.environ.get('DATABASE_URL', '')
+    PG_POOL_MIN: int = int(os.environ.get('PG_POOL_MIN', '1'))
+    PG_POOL_MAX: int = int(os.environ.get('PG_POOL_MAX', '10'))
     UPLOADS_DIR: str = os.environ.get('UPLOADS_DIR', 'uploads')
+    # Firmas direccionadas por contenido (un archivo por firma distinta)
+    SIGNATURES_DIR: str = os.environ.get('SIGNATURES_DIR', os.path.join(os.environ.get('UPLOADS_DIR', 'uploads'), 'firmas'))
+    SIGNATURE_CACHE_SIZE: int = int(os.environ.get('SIGNATURE_CACHE_SIZE', '64'))
+    SIGNATURE_WRITE_WAIT: float = float(os.environ.get('SIGNATURE_WRITE_WAIT', '2'))
+    # Reintentos del hilo escritor de firmas (backoff exponencial desde SIGNATURE_RETRY_BASE s)
+    SIGNATURE_WRITE_RETRIES: int = int(os.environ.get('SIGNATURE_WRITE_RETRIES', '5'))
+    SIGNATURE_RETRY_BASE: float = float(os.environ.get('SIGNATURE_RETRY_BASE', '0.5'))
+    # Resolución de la firma dentro de su caja en el PDF; 1 bit en vez de grises
+    SIGNATURE_DPI: int = int(os.environ.get('SIGNATURE_DPI', '150'))
+    SIGNATURE_BILEVEL: bool = os.environ.get('SIGNATURE_BILEVEL', 'false').lower() in ('1', 'true', 'yes')
     PDF_DIR: str = os.environ.get('PDF_DIR', 'pdfs')
+    # s3://bucket/prefijo guarda PDF y firmas en S3 (o MinIO con S3_ENDPOINT_URL);
+    # vacío usa PDF_DIR y SIGNATURES_DIR. Credenciales: AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY
+    STORAGE_URL: str = os.environ.get('STORAGE_URL', '')
+    S3_ENDPOINT_URL: str = os.environ.get('S3_ENDPOINT_URL', '')
+    S3_REGION: str = os.environ.get('S3_REGION', '')
+    S3_PRESIGN_EXPIRES: int = int(os.environ.get('S3_PRESIGN_EXPIRES', '300'))
+    S3_MULTIPART_MB: int = int(os.environ.get('S3_MULTIPART_MB', '8'))
+    # PDF bajo demanda: sólo se renderiza al crear si hay que enviarlo por email;
+    # /download lo genera desde la fila y lo guarda en una caché LRU acotada
+    PDF_LAZY: bool = os.environ.get('PDF_LAZY', 'false').lower() in ('1', 'true', 'yes')
+    PDF_CACHE_DIR: str = os.environ.get('PDF_CACHE_DIR', os.path.join(os.environ.get('PDF_DIR', 'pdfs'), 'cache'))
+    PDF_CACHE_MAX_MB: int = int(os.environ.get('PDF_CACHE_MAX_MB', '256'))
+    # Vida en caché del navegador de /download?v=<hash> (el contenido de esa URL no cambia)
+    DOWNLOAD_MAX_AGE: int = int(os.environ.get('DOWNLOAD_MAX_AGE', str(365 * 24 * 3600)))
+    # '' envía el archivo desde Flask; x-sendfile (Apache/lighttpd) o x-accel-redirect (nginx)
+    # delegan el envío al proxy. DOWNLOAD_ACCEL_PREFIX es la location internal que apunta a PDF_DIR
+    DOWNLOAD_ACCEL: str = os.environ.get('DOWNLOAD_ACCEL', '').lower()
+    DOWNLOAD_ACCEL_PREFIX: str = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/pdfs-internos/')
     SMTP_HOST: str = os.environ.get('SMTP_HOST', '')
     SMTP_PORT: int = int(os.environ.get('SMTP_PORT', '587'))
     SMTP_USER: str = os.environ.get('SMTP_USER', '')
     SMTP_PASS: str = os.environ.get('SMTP_PASS', '')
     EMAIL_SENDER: str = os.environ.get('EMAIL_SENDER', '')
     MAX_SIGNATURE_SIZE: int = int(os.environ.get('MAX_SIGNATURE_SIZE', '500000'))
+    JOB_WORKERS: int = int(os.environ.get('JOB_WORKERS', '2'))
+    JOB_POLL_INTERVAL: float = float(os.environ.get('JOB_POLL_INTERVAL', '2'))
+    # Un trabajo 'running' sin latido durante JOB_TIMEOUT se da por abandonado
+    JOB_TIMEOUT: int = int(os.environ.get('JOB_TIMEOUT', '300'))
+    JOB_MAX_ATTEMPTS: int = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+    JOB_RETRY_BASE: float = float(os.environ.get('JOB_RETRY_BASE', '30'))
+    JOB_RETRY_MAX_DELAY: float = float(os.environ.get('JOB_RETRY_MAX_DELAY', '3600'))
+    PAGE_SIZE: int = int(os.environ.get('PAGE_SIZE', '25'))
+    MAX_PAGE_SIZE: int = int(os.environ.get('MAX_PAGE_SIZE', '200'))
+    EXPORT_BATCH_SIZE: int = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+    # Órdenes por solicitud en /api/ordenes (p. ej. las que un técnico acumuló sin conexión)
+    INTAKE_MAX_BATCH: int = int(os.environ.get('INTAKE_MAX_BATCH', '100'))
+    # Órdenes por transacción al importar NDJSON en /api/ordenes
+    INTAKE_BATCH_SIZE: int = int(os.environ.get('INTAKE_BATCH_SIZE', '500'))
+    # La búsqueda ordena por relevancia sólo entre las N coincidencias más recientes
+    SEARCH_CANDIDATES: int = int(os.environ.get('SEARCH_CANDIDATES', '2000'))
+    DB_POOL_SIZE: int = int(os.environ.get('DB_POOL_SIZE', '8'))
+    DB_BUSY_TIMEOUT_MS: int = int(os.environ.get('DB_BUSY_TIMEOUT_MS', '10000'))
+    DB_CACHE_SIZE_KB: int = int(os.environ.get('DB_CACHE_SIZE_KB', '16384'))
+    DB_MMAP_SIZE: int = int(os.environ.get('DB_MMAP_SIZE', str(128 * 1024 * 1024)))
+    DB_STATEMENT_CACHE: int = int(os.environ.get('DB_STATEMENT_CACHE', '256'))
+    SMTP_USE_TLS: bool = os.environ.get('SMTP_USE_TLS', 'true').lower() in ('1', 'true', 'yes')
+    SMTP_TIMEOUT: int = int(os.environ.get('SMTP_TIMEOUT', '30'))
+    SMTP_POOL_SIZE: int = int(os.environ.get('SMTP_POOL_SIZE', '2'))
+    SMTP_IDLE_TIMEOUT: int = int(os.environ.get('SMTP_IDLE_TIMEOUT', '120'))
+    SMTP_BATCH_SIZE: int = int(os.environ.get('SMTP_BATCH_SIZE', '20'))
+    SMTP_MAX_RETRIES: int = int(os.environ.get('SMTP_MAX_RETRIES', '5'))
+    SMTP_RETRY_BASE: float = float(os.environ.get('SMTP_RETRY_BASE', '30'))
+    SMTP_RETRY_MAX_DELAY: float = float(os.environ.get('SMTP_RETRY_MAX_DELAY', '3600'))
+    # Trazas: archivo OTLP/JSON (p. ej. trazas.jsonl) o URL de un collector
+    # (http://localhost:4318/v1/traces); vacío las desactiva
+    TRACE_EXPORTER: str = os.environ.get('TRACE_EXPORTER', '')
+    # Fracción de las trazas nuevas que se registran; las que llegan con un
+    # traceparent muestreado se registran siempre
+    TRACE_SAMPLE_RATE: float = float(os.environ.get('TRACE_SAMPLE_RATE', '0.1'))
+    TRACE_SERVICE_NAME: str = os.environ.get('TRACE_SERVICE_NAME', 'novamedical-ot')
+    TRACE_EXPORT_INTERVAL: float = float(os.environ.get('TRACE_EXPORT_INTERVAL', '5'))
+    TRACE_MAX_QUEUE: int = int(os.environ.get('TRACE_MAX_QUEUE', '2048'))
 
 config = Config()
 os.makedirs(config.UPLOADS_DIR, exist_ok=True)
@@ -61,650 +149,2642 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = config.SECRET_KEY
+app.config['USE_X_SENDFILE'] = config.DOWNLOAD_ACCEL == 'x-sendfile'
+
+# --- Métricas (formato de texto de Prometheus) ---
+# Contadores e histogramas en memoria del proceso, expuestos en /metrics.
+# Registrar una medición es tomar un lock y sumar en una lista, así que se
+# pueden dejar puestos en el camino de cada orden. Con varios workers
+# gunicorn cada uno lleva los suyos: Prometheus ve el que atiende el scrape.
+def _metric_labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+def _metric_value(value):
+    # repr y no :g, que redondea a 6 cifras los contadores grandes
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+class Metric:
+    kind = 'untyped'
+    
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+    
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+    
+    def samples(self):
+        """[(sufijo, nombres de etiquetas, valores, valor)] para exponer"""
+        with self._lock:
+            return [('', self.labels, key, value) for key, value in self._values.items()]
+    
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, names, values, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_metric_labels(names, values)} {_metric_value(value)}')
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Histogram(Metric):
+    kind = 'histogram'
+    # Segundos: de un INSERT (ms) a un PDF con firmas o un envío SMTP (s)
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Una cuenta por bucket (no acumulada), +Inf, suma
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+    
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+    
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        samples = []
+        names = self.labels + ('le',)
+        for key, counts in items:
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                samples.append(('_bucket', names, key + (le,), total))
+            samples.append(('_sum', self.labels, key, counts[-1]))
+            samples.append(('_count', self.labels, key, total))
+        return samples
+
+class CallbackMetric(Metric):
+    """Valores leídos al exponer: fn() -> {(valores de etiquetas): valor}"""
+    
+    def __init__(self, name, help, kind, fn, labels=()):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.fn = fn
+    
+    def samples(self):
+        return [('', self.labels, key, value) for key, value in self.fn().items()]
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+    
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+    
+    def histogram(self, name, help, labels=(), **kwargs):
+        return self.register(Histogram(name, help, labels, **kwargs))
+    
+    def callback(self, name, help, fn, kind='gauge', labels=()):
+        return self.register(CallbackMetric(name, help, kind, fn, labels))
+    
+    def expose(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.expose())
+            except Exception as e:
+                logger.error(f"Error leyendo métrica {metric.name}: {str(e)}")
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'novamedical_http_request_duration_seconds', 'Duración de las peticiones por ruta',
+    ('method', 'route', 'status'),
+)
+STAGE_SECONDS = metrics.histogram(
+    'novamedical_stage_duration_seconds', 'Duración de cada etapa del registro y envío de una orden',
+    ('stage',),
+)
+ORDERS_CREATED = metrics.counter('novamedical_orders_created_total', 'Órdenes registradas', ('via',))
+PDFS_RENDERED = metrics.counter('novamedical_pdfs_rendered_total', 'PDF generados', ('result',))
+
+def timed_stage(stage):
+    """Decorador: duración de cada llamada en STAGE_SECONDS{stage=...}"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+        return wrapper
+    return decorator
+
+@app.before_request
+def _metrics_start():
+    g.metrics_started = time.perf_counter()
+
+@app.after_request
+def _metrics_observe(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        # La regla (/download/<int:id>) y no la URL, para no crear una serie por orden
+        route = request.url_rule.rule if request.url_rule else 'sin_ruta'
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started, method=request.method, route=route, status=response.status_code
+        )
+    return response
+
+# --- Trazas (modelo de OpenTelemetry, exportadas como OTLP/JSON) ---
+# Un span por petición y uno por etapa (validación, firmas, conexiones a la
+# BD, INSERT, PDF, SMTP), con ids de traza y span, padre, atributos y
+# estado como en OpenTelemetry. El contexto viaja como W3C traceparent: una
+# petición que lo trae continúa esa traza, y el trabajo de render lo guarda
+# en la cola para seguir la traza del /create que lo encoló.
+#
+# Sólo se registra TRACE_SAMPLE_RATE de las trazas nuevas; fuera de la
+# muestra no se crea ningún span. Los terminados se exportan por lotes en
+# un hilo: a un archivo (una línea OTLP/JSON por lote, lo que lee el
+# receptor otlpjsonfile del collector) o por HTTP a /v1/traces.
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, SPAN_KIND_CLIENT, SPAN_KIND_CONSUMER = 1, 2, 3, 5
+SPAN_STATUS_OK, SPAN_STATUS_ERROR = 1, 2
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+def _otlp_attributes(attributes):
+    def value(v):
+        if isinstance(v, bool):
+            return {'boolValue': v}
+        if isinstance(v, int):
+            return {'intValue': str(v)}
+        if isinstance(v, float):
+            return {'doubleValue': v}
+        return {'stringValue': str(v)}
+    return [{'key': k, 'value': value(v)} for k, v in attributes.items()]
+
+class Span:
+    recording = True
+    
+    def __init__(self, name, trace_id, parent_id=None, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+    
+    @property
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.span_id}-01'
+    
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+    
+    def set_error(self, message):
+        self.status = (SPAN_STATUS_ERROR, message)
+    
+    def record_exception(self, e):
+        self.set_error(str(e))
+        self.events.append(('exception', time.time_ns(), {
+            'exception.type': type(e).__name__, 'exception.message': str(e),
+        }))
+    
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': _otlp_attributes(self.attributes),
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.events:
+            span['events'] = [
+                {'name': name, 'timeUnixNano': str(ts), 'attributes': _otlp_attributes(attrs)}
+                for name, ts, attrs in self.events
+            ]
+        if self.status:
+            span['status'] = {'code': self.status[0], 'message': self.status[1]}
+        return span
+
+class NonRecordingSpan:
+    """Lo que devuelve el tracer fuera de la muestra: acepta todo y no guarda nada"""
+    recording = False
+    traceparent = None
+    
+    def set_attribute(self, key, value):
+        pass
+    
+    def set_error(self, message):
+        pass
+    
+    def record_exception(self, e):
+        pass
+
+NO_SPAN = NonRecordingSpan()
+
+def parse_traceparent(header):
+    """(trace_id, span_id padre, muestreado) de un encabezado W3C traceparent, o None"""
+    parts = (header or '').strip().split('-')
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[0] == 'ff' or parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+class FileSpanExporter:
+    """Una línea OTLP/JSON (ExportTraceServiceRequest) por lote, al final del archivo"""
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def export(self, body):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(body + '\n')
+
+class HttpSpanExporter:
+    """POST OTLP/JSON a un collector (http://host:4318/v1/traces)"""
+    
+    def __init__(self, url):
+        self.url = url
+    
+    def export(self, body):
+        req = urllib.request.Request(
+            self.url, data=body.encode('utf-8'), headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        with urllib.request.urlopen(req, timeout=10) as response:
+            response.read()
+
+def create_span_exporter(target):
+    if not target:
+        return None
+    if target.startswith(('http://', 'https://')):
+        return HttpSpanExporter(target)
+    return FileSpanExporter(target)
+
+TRACE_SPANS = metrics.counter('novamedical_trace_spans_total', 'Spans exportados, descartados o con error al exportar', ('result',))
+
+class Tracer:
+    def __init__(self, exporter, sample_rate, service_name, export_interval, max_queue):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.service_name = service_name
+        self.export_interval = export_interval
+        self.max_queue = max_queue
+        self._finished = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+    
+    def current(self):
+        return _current_span.get() or NO_SPAN
+    
+    def start_trace(self, name, traceparent=None, kind=SPAN_KIND_SERVER, attributes=None):
+        """Span raíz de una petición o trabajo, o None si la traza queda fuera de la muestra"""
+        if self.exporter is None:
+            return None
+        parent = parse_traceparent(traceparent)
+        if parent:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = secrets.token_hex(16), None
+            sampled = random.random() < self.sample_rate
+        if not sampled:
+            return None
+        return Span(name, trace_id, parent_id, kind, attributes)
+    
+    @contextmanager
+    def activate(self, span):
+        """Hacer de span el actual mientras dura el bloque y terminarlo al salir"""
+        if span is None:
+            yield NO_SPAN
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end(span)
+    
+    def trace(self, name, traceparent=None, kind=SPAN_KIND_SERVER, attributes=None):
+        """Context manager con el span raíz de start_trace"""
+        return self.activate(self.start_trace(name, traceparent, kind, attributes))
+    
+    def span(self, name, kind=SPAN_KIND_INTERNAL, attributes=None):
+        """Context manager con un span hijo del actual; sin traza activa no hace nada"""
+        parent = _current_span.get()
+        if parent is None:
+            return self.activate(None)
+        return self.activate(Span(name, parent.trace_id, parent.span_id, kind, attributes))
+    
+    def end(self, span):
+        span.end_ns = time.time_ns()
+        with self._lock:
+            if len(self._finished) >= self.max_queue:
+                TRACE_SPANS.inc(result='dropped')
+                return
+            self._finished.append(span)
+            full = len(self._finished) >= self.max_queue // 2
+        self._ensure_started()
+        if full:
+            self._wakeup.set()
+    
+    def flush(self):
+        """Exportar ya los spans terminados"""
+        with self._lock:
+            spans, self._finished = self._finished, []
+        if not spans or self.exporter is None:
+            return
+        body = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({
+                'service.name': self.service_name, 'process.pid': os.getpid(),
+            })},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [span.to_otlp() for span in spans]}],
+        }]}, ensure_ascii=False)
+        try:
+            self.exporter.export(body)
+            TRACE_SPANS.inc(len(spans), result='exported')
+        except Exception as e:
+            TRACE_SPANS.inc(len(spans), result='error')
+            logger.warning(f"No se pudieron exportar {len(spans)} spans: {str(e)}")
+    
+    def _ensure_started(self):
+        # Un hilo por proceso, como la cola de trabajos (seguro tras fork)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='trace-exporter', daemon=True).start()
+            self._pid = os.getpid()
+    
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.export_interval)
+            self._wakeup.clear()
+            self.flush()
+
+tracer = Tracer(
+    create_span_exporter(config.TRACE_EXPORTER), config.TRACE_SAMPLE_RATE, config.TRACE_SERVICE_NAME,
+    config.TRACE_EXPORT_INTERVAL, config.TRACE_MAX_QUEUE,
+)
+atexit.register(tracer.flush)
+
+def traced(name, kind=SPAN_KIND_INTERNAL):
+    """Decorador: cada llamada es un span hijo del actual (sin traza activa, una llamada directa)"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return fn(*args, **kwargs)
+            with tracer.span(name, kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@app.before_request
+def _trace_start():
+    route = request.url_rule.rule if request.url_rule else 'sin_ruta'
+    span = tracer.start_trace(f'{request.method} {route}', request.headers.get('traceparent'), attributes={
+        'http.request.method': request.method,
+        'http.route': route,
+        'url.path': request.path,
+    })
+    if span is not None:
+        g.trace_span = span
+        g.trace_token = _current_span.set(span)
+
+@app.after_request
+def _trace_status(response):
+    span = g.get('trace_span')
+    if span is not None:
+        span.set_attribute('http.response.status_code', response.status_code)
+        if response.status_code >= 500:
+            span.set_error(f'HTTP {response.status_code}')
+    return response
+
+@app.teardown_request
+def _trace_end(exc):
+    span = g.pop('trace_span', None)
+    if span is None:
+        return
+    if exc is not None:
+        span.record_exception(exc)
+    try:
+        _current_span.reset(g.pop('trace_token'))
+    except ValueError:
+        # Respuesta en streaming terminada en otro contexto
+        _current_span.set(None)
+    tracer.end(span)
 
 # --- Database Mejorada ---
-def init_db():
-    """Inicializar la base de datos con tabla mejorada"""
-    with db_connection() as conn:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS informes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                institucion TEXT NOT NULL,
-                encargado TEXT,
-                contacto TEXT,
-                comuna TEXT,        
-                ciudad TEXT, 
-                fecha TEXT NOT NULL,
-                equipo TEXT,
-                marca_modelo TEXT,
-                numero_serie TEXT,
-                
-                -- Tipo de servicio checkboxes
-                servicio_instalacion TEXT,
-                servicio_mantenimiento TEXT,
-                servicio_correctivo TEXT,
-                servicio_visita TEXT,
-                servicio_comercial TEXT,
-                servicio_otro TEXT,
-                servicio_otro_especificar TEXT,
-                
-                -- Tipo de garantía
-                garantia_en_garantia TEXT,
-                garantia_fuera_garantia TEXT,
-                garantia_en_convenio TEXT,
-                
-                -- Problema e inspección
-                problema_cliente TEXT,
-                inspeccion_visual TEXT,
-                
-                -- Descripción mantenimiento (Aplica/No Aplica)
-                mantenimiento_prueba_funcionamiento TEXT,
-                mantenimiento_apertura_mecanismos TEXT,
-                mantenimiento_desinfeccion TEXT,
-                mantenimiento_limpieza_lubricacion TEXT,
-                mantenimiento_lubricacion_motores TEXT,
-                mantenimiento_calibracion_ejes TEXT,
-                mantenimiento_calibracion_software TEXT,
-                mantenimiento_verificacion_seguridad TEXT,
-                mantenimiento_verificacion_filtraciones TEXT,
-                mantenimiento_limpieza_cpu TEXT,
-                mantenimiento_cambio_filtro TEXT,
-                mantenimiento_reteste_pernos TEXT,
-                mantenimiento_reseteo_contadores TEXT,
-                mantenimiento_otros TEXT,
-                mantenimiento_otros_especificar TEXT,
-                
-                -- Mediciones
-                mediciones_parametros TEXT,
-                
-                -- Piezas de reemplazo
-                piezas_descripcion1 TEXT,
-                piezas_cantidad1 TEXT,
-                piezas_descripcion2 TEXT,
-                piezas_cantidad2 TEXT,
-                piezas_descripcion3 TEXT,
-                piezas_cantidad3 TEXT,
-                piezas_descripcion4 TEXT,
-                piezas_cantidad4 TEXT,
-                
-                -- Detalles y resolución
-                detalles_servicio TEXT,
-                resolucion_operativo TEXT,
-                resolucion_no_operativo TEXT,
-                resolucion_requiere_visita TEXT,
-                
-                -- Encuesta de servicio
-                encuesta_presentacion TEXT,
-                encuesta_reparacion TEXT,
-                encuesta_preparacion TEXT,
-                encuesta_plazos TEXT,
-                encuesta_nota TEXT,
-                encuesta_recomendacion TEXT,
-                
-                -- Firmas
-                tecnico_nombre TEXT,
-                cliente_firma TEXT,
-                tecnico_firma TEXT,
-                pdf_path TEXT,
-                created_at TEXT
-            )
-        ''')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_informes_fecha ON informes(fecha)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_informes_institucion ON informes(institucion)')
+# Migraciones versionadas, sólo hacia adelante. Cada una se aplica una única
+# vez y queda registrada en schema_version. Para cambiar el esquema se agrega
+# una nueva función al final de MIGRATIONS; nunca se editan las existentes.
+def _column_exists(conn, table, column):
+    return any(col[1] == column for col in conn.execute(f"PRAGMA table_info({table})"))
 
-def recreate_database():
-    """Recrear completamente la base de datos con la nueva estructura"""
-    db_path = config.DB_FILE
+def _add_column(conn, table, column, decl):
+    """ALTER TABLE tolerante a bases creadas antes del control de versiones"""
+    if not _column_exists(conn, table, column):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+# Tabla principal; compartida por las migraciones de SQLite y PostgreSQL
+INFORMES_DDL = '''
+    CREATE TABLE IF NOT EXISTS informes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        institucion TEXT NOT NULL,
+        encargado TEXT,
+        contacto TEXT,
+        comuna TEXT,        
+        ciudad TEXT, 
+        fecha TEXT NOT NULL,
+        equipo TEXT,
+        marca_modelo TEXT,
+        numero_serie TEXT,
+
+        -- Tipo de servicio checkboxes
+        servicio_instalacion TEXT,
+        servicio_mantenimiento TEXT,
+        servicio_correctivo TEXT,
+        servicio_visita TEXT,
+        servicio_comercial TEXT,
+        servicio_otro TEXT,
+        servicio_otro_especificar TEXT,
+
+        -- Tipo de garantía
+        garantia_en_garantia TEXT,
+        garantia_fuera_garantia TEXT,
+        garantia_en_convenio TEXT,
+
+        -- Problema e inspección
+        problema_cliente TEXT,
+        inspeccion_visual TEXT,
+
+        -- Descripción mantenimiento (Aplica/No Aplica)
+        mantenimiento_prueba_funcionamiento TEXT,
+        mantenimiento_apertura_mecanismos TEXT,
+        mantenimiento_desinfeccion TEXT,
+        mantenimiento_limpieza_lubricacion TEXT,
+        mantenimiento_lubricacion_motores TEXT,
+        mantenimiento_calibracion_ejes TEXT,
+        mantenimiento_calibracion_software TEXT,
+        mantenimiento_verificacion_seguridad TEXT,
+        mantenimiento_verificacion_filtraciones TEXT,
+        mantenimiento_limpieza_cpu TEXT,
+        mantenimiento_cambio_filtro TEXT,
+        mantenimiento_reteste_pernos TEXT,
+        mantenimiento_reseteo_contadores TEXT,
+        mantenimiento_otros TEXT,
+        mantenimiento_otros_especificar TEXT,
+
+        -- Mediciones
+        mediciones_parametros TEXT,
+
+        -- Piezas de reemplazo
+        piezas_descripcion1 TEXT,
+        piezas_cantidad1 TEXT,
+        piezas_descripcion2 TEXT,
+        piezas_cantidad2 TEXT,
+        piezas_descripcion3 TEXT,
+        piezas_cantidad3 TEXT,
+        piezas_descripcion4 TEXT,
+        piezas_cantidad4 TEXT,
+
+        -- Detalles y resolución
+        detalles_servicio TEXT,
+        resolucion_operativo TEXT,
+        resolucion_no_operativo TEXT,
+        resolucion_requiere_visita TEXT,
+
+        -- Encuesta de servicio
+        encuesta_presentacion TEXT,
+        encuesta_reparacion TEXT,
+        encuesta_preparacion TEXT,
+        encuesta_plazos TEXT,
+        encuesta_nota TEXT,
+        encuesta_recomendacion TEXT,
+
+        -- Firmas
+        tecnico_nombre TEXT,
+        cliente_firma TEXT,
+        tecnico_firma TEXT,
+        pdf_path TEXT,
+        created_at TEXT
+    )
+'''
+
+def _migration_001_informes(conn):
+    conn.execute(INFORMES_DDL)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_informes_fecha ON informes(fecha)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_informes_institucion ON informes(institucion)')
+
+def _migration_002_jobs(conn):
+    # Estado del procesamiento: pending, rendered, sent, failed
+    _add_column(conn, 'informes', 'estado', "TEXT NOT NULL DEFAULT 'pending'")
+    conn.execute("UPDATE informes SET estado = 'rendered' WHERE pdf_path IS NOT NULL AND pdf_path != ''")
+    
+    # Cola persistente de trabajos (render PDF)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            informe_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'queued',
+            intentos INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TEXT,
+            updated_at TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_estado ON jobs(estado, id)')
+
+def _migration_003_outbox(conn):
+    # Bandeja de salida persistente para el envío de correos
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            informe_id INTEGER,
+            destinatario TEXT NOT NULL,
+            asunto TEXT NOT NULL,
+            cuerpo TEXT,
+            adjunto_path TEXT,
+            estado TEXT NOT NULL DEFAULT 'queued',
+            intentos INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            sent_at TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_estado ON outbox(estado, next_attempt_at)')
+
+# Columnas indexadas para búsqueda y su peso en el ranking bm25
+SEARCH_COLUMNS = (
+    ('institucion', 10.0),
+    ('equipo', 4.0),
+    ('marca_modelo', 4.0),
+    ('numero_serie', 8.0),
+    ('tecnico_nombre', 3.0),
+    ('problema_cliente', 1.0),
+    ('detalles_servicio', 1.0),
+)
+
+def _migration_004_busqueda(conn):
+    # Índice FTS5 de contenido externo: no duplica el texto, lo leen los triggers
+    columns = ', '.join(name for name, _ in SEARCH_COLUMNS)
+    new_values = ', '.join(f'new.{name}' for name, _ in SEARCH_COLUMNS)
+    old_values = ', '.join(f'old.{name}' for name, _ in SEARCH_COLUMNS)
+    weights = ', '.join(str(weight) for _, weight in SEARCH_COLUMNS)
     
-    # Si la base de datos existe, eliminarla para recrearla
-    if os.path.exists(db_path):
-        logger.info("Eliminando base de datos antigua para recrear con nueva estructura...")
-        os.remove(db_path)
-        logger.info("Base de datos antigua eliminada")
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS informes_fts USING fts5(
+            {columns},
+            content='informes', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3 4'
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS informes_fts_ai AFTER INSERT ON informes BEGIN
+            INSERT INTO informes_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS informes_fts_ad AFTER DELETE ON informes BEGIN
+            INSERT INTO informes_fts (informes_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS informes_fts_au AFTER UPDATE OF {columns} ON informes BEGIN
+            INSERT INTO informes_fts (informes_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO informes_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    ''')
+    conn.execute("INSERT INTO informes_fts (informes_fts) VALUES ('rebuild')")
+    conn.execute(f"INSERT INTO informes_fts (informes_fts, rank) VALUES ('rank', 'bm25({weights})')")
+
+def _migration_005_exportacion(conn):
+    # Filtro por técnico de la exportación (institución y fecha ya tienen índice)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_informes_tecnico ON informes(tecnico_nombre)')
+
+def _migration_006_descargas(conn):
+    # Hash del PDF publicado: ETag de /download y versión en su URL
+    _add_column(conn, 'informes', 'pdf_sha256', 'TEXT')
+
+# Checklist y piezas en tablas hijas (ver CHECKLIST_ITEMS). Las columnas
+# originales quedan en informes para poder volver atrás, pero ya no se escriben.
+CHECKLIST_DDL = '''
+    CREATE TABLE IF NOT EXISTS informe_checklist (
+        informe_id INTEGER NOT NULL REFERENCES informes(id) ON DELETE CASCADE,
+        item SMALLINT NOT NULL,
+        valor SMALLINT NOT NULL,
+        PRIMARY KEY (informe_id, item)
+    )
+'''
+
+PIEZAS_DDL = '''
+    CREATE TABLE IF NOT EXISTS informe_piezas (
+        informe_id INTEGER NOT NULL REFERENCES informes(id) ON DELETE CASCADE,
+        orden SMALLINT NOT NULL,
+        descripcion TEXT NOT NULL,
+        cantidad TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (informe_id, orden)
+    )
+'''
+
+CHECKLIST_PIEZAS_INDEXES = (
+    # "¿Cuántas calibraciones por modelo?": del ítem a las órdenes sin leer la tabla
+    'CREATE INDEX IF NOT EXISTS idx_checklist_item ON informe_checklist(item, valor, informe_id)',
+    'CREATE INDEX IF NOT EXISTS idx_piezas_descripcion ON informe_piezas(descripcion, informe_id)',
+    'CREATE INDEX IF NOT EXISTS idx_informes_modelo ON informes(marca_modelo, fecha)',
+)
+
+# Columna original -> código de ítem. Congelado: es lo que había al migrar
+_LEGACY_CHECKLIST = (
+    (1, 'servicio_instalacion'), (2, 'servicio_mantenimiento'), (3, 'servicio_correctivo'),
+    (4, 'servicio_visita'), (5, 'servicio_comercial'), (6, 'servicio_otro'),
+    (7, 'garantia_en_garantia'), (8, 'garantia_fuera_garantia'), (9, 'garantia_en_convenio'),
+    (10, 'mantenimiento_prueba_funcionamiento'), (11, 'mantenimiento_apertura_mecanismos'),
+    (12, 'mantenimiento_desinfeccion'), (13, 'mantenimiento_limpieza_lubricacion'),
+    (14, 'mantenimiento_lubricacion_motores'), (15, 'mantenimiento_calibracion_ejes'),
+    (16, 'mantenimiento_calibracion_software'), (17, 'mantenimiento_verificacion_seguridad'),
+    (18, 'mantenimiento_verificacion_filtraciones'), (19, 'mantenimiento_limpieza_cpu'),
+    (20, 'mantenimiento_cambio_filtro'), (21, 'mantenimiento_reteste_pernos'),
+    (22, 'mantenimiento_reseteo_contadores'), (23, 'mantenimiento_otros'),
+    (24, 'resolucion_operativo'), (25, 'resolucion_no_operativo'), (26, 'resolucion_requiere_visita'),
+)
+
+def _legacy_checklist_selects():
+    """SELECT (informe_id, item, valor) desde las columnas originales: 'si'/'aplica' = 1, 'no_aplica' = 0"""
+    return [
+        f"SELECT id, {code}, CASE {column} WHEN 'no_aplica' THEN 0 ELSE 1 END FROM informes "
+        f"WHERE {column} IN ('si', 'aplica', 'no_aplica')"
+        for code, column in _LEGACY_CHECKLIST
+    ]
+
+def _legacy_piezas_selects():
+    return [
+        f"SELECT id, {n}, piezas_descripcion{n}, COALESCE(piezas_cantidad{n}, '') FROM informes "
+        f"WHERE COALESCE(piezas_descripcion{n}, '') != ''"
+        for n in range(1, 5)
+    ]
+
+def _migration_007_checklist_piezas(conn):
+    conn.execute(CHECKLIST_DDL + ' WITHOUT ROWID')
+    conn.execute(PIEZAS_DDL + ' WITHOUT ROWID')
+    for statement in CHECKLIST_PIEZAS_INDEXES:
+        conn.execute(statement)
+    for select in _legacy_checklist_selects():
+        conn.execute(f'INSERT OR IGNORE INTO informe_checklist (informe_id, item, valor) {select}')
+    for select in _legacy_piezas_selects():
+        conn.execute(f'INSERT OR IGNORE INTO informe_piezas (informe_id, orden, descripcion, cantidad) {select}')
+
+def _migration_008_idempotencia(conn):
+    # Clave que genera el cliente por orden: reenviarla no crea otra
+    _add_column(conn, 'informes', 'idempotency_key', 'TEXT')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_informes_idempotency ON informes(idempotency_key)')
+
+def _migration_009_traceparent(conn):
+    # traceparent de la petición que encoló el trabajo, para continuar su traza
+    _add_column(conn, 'jobs', 'traceparent', 'TEXT')
+
+def _migration_010_job_backoff(conn):
+    # Momento (epoch) desde el que un trabajo reintentado puede volver a tomarse
+    _add_column(conn, 'jobs', 'next_attempt_at', 'REAL NOT NULL DEFAULT 0')
+
+def _migration_011_outbox_traceparent(conn):
+    # traceparent del trabajo que encoló el correo, para que el envío siga su traza
+    _add_column(conn, 'outbox', 'traceparent', 'TEXT')
+
+MIGRATIONS = [
+    (1, 'tabla informes', _migration_001_informes),
+    (2, 'estado de orden y cola de trabajos', _migration_002_jobs),
+    (3, 'bandeja de salida de correo', _migration_003_outbox),
+    (4, 'búsqueda de texto completo', _migration_004_busqueda),
+    (5, 'índice por técnico para exportación', _migration_005_exportacion),
+    (6, 'hash del PDF para descargas', _migration_006_descargas),
+    (7, 'checklist y piezas en tablas hijas', _migration_007_checklist_piezas),
+    (8, 'clave de idempotencia de órdenes', _migration_008_idempotencia),
+    (9, 'contexto de traza de los trabajos', _migration_009_traceparent),
+    (10, 'reintentos con espera de los trabajos', _migration_010_job_backoff),
+    (11, 'contexto de traza de los correos', _migration_011_outbox_traceparent),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_schema_lock = threading.Lock()
+
+def get_schema_version(conn):
+    """Versión actual del esquema (0 si la base está vacía)"""
+    try:
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+def init_db():
+    """Aplicar las migraciones pendientes.
     
-    # Recrear la base de datos llamando a init_db()
-    init_db()
-    logger.info("Base de datos recreada con nueva estructura")
+    Es un no-op barato cuando el esquema ya está al día. Si hay migraciones
+    pendientes se toma el lock de escritura de SQLite (BEGIN IMMEDIATE), de
+    modo que entre varios workers gunicorn sólo uno las aplica y el resto
+    espera y encuentra la versión actualizada.
+    """
+    with _schema_lock:
+        with db_connection() as conn:
+            if get_schema_version(conn) >= SCHEMA_VERSION:
+                return
+            
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    nombre TEXT NOT NULL,
+                    applied_at TEXT NOT NULL
+                )
+            ''')
+            current = get_schema_version(conn)
+            for version, nombre, migrate in MIGRATIONS:
+                if version <= current:
+                    continue
+                migrate(conn)
+                conn.execute(
+                    'INSERT INTO schema_version (version, nombre, applied_at) VALUES (?, ?, ?)',
+                    (version, nombre, datetime.now().isoformat())
+                )
+                logger.info(f"Migración {version:03d} aplicada: {nombre}")
 
 def verify_database_structure():
-    """Verificar que la estructura de la base de datos sea correcta"""
+    """Verificar que el esquema esté en la versión esperada"""
     with db_connection() as conn:
-        # Obtener información de las columnas
-        columns = conn.execute("PRAGMA table_info(informes)").fetchall()
-        column_names = [col[1] for col in columns]
-        
-        logger.info("=== ESTRUCTURA DE LA BASE DE DATOS ===")
-        logger.info(f"Total de columnas: {len(column_names)}")
-        
-        # Mostrar todas las columnas
-        for i, col in enumerate(columns, 1):
-            logger.info(f"{i:2d}. {col[1]} ({col[2]})")
-        
-        # Verificar columnas críticas
-        critical_columns = ['comuna', 'ciudad']
-        for col in critical_columns:
-            if col in column_names:
-                logger.info(f"✅ Columna '{col}' encontrada")
+        version = get_schema_version(conn)
+    
+    if version < SCHEMA_VERSION:
+        logger.error(f"❌ Esquema de BD en versión {version}, se esperaba {SCHEMA_VERSION}")
+    else:
+        logger.info(f"✅ Esquema de BD en versión {version}")
+    return version
+
+class ConnectionPool:
+    """Pool de conexiones SQLite reutilizables.
+    
+    Cada conexión se configura una sola vez (WAL, busy_timeout, caché de
+    páginas, mmap) y conserva su caché de sentencias preparadas entre
+    peticiones. Un hilo que anida db_connection() recibe la misma conexión
+    y transacción: sólo el bloque más externo hace commit/rollback, y cada
+    bloque interno es un SAVEPOINT que un error deshace sin tocar el resto.
+    """
+    
+    def __init__(self, size):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.in_use = 0
+    
+    def _open(self):
+        conn = sqlite3.connect(
+            config.DB_FILE,
+            timeout=config.DB_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=config.DB_STATEMENT_CACHE,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={config.DB_BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA cache_size=-{config.DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={config.DB_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        with self._lock:
+            self.opened += 1
+        return conn
+    
+    def _reset_after_fork(self):
+        # Las conexiones heredadas de otro proceso no se pueden usar
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle = queue.LifoQueue()
+                self._local = threading.local()
+                self._pid = os.getpid()
+                self.in_use = 0
+    
+    def acquire(self):
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.reused += 1
+        except queue.Empty:
+            conn = self._open()
+        with self._lock:
+            self.in_use += 1
+        return conn
+    
+    def release(self, conn, discard=False):
+        with self._lock:
+            self.in_use -= 1
+        if discard or self._idle.qsize() >= self.size:
+            conn.close()
+        else:
+            self._idle.put(conn)
+    
+    @contextmanager
+    def connection(self):
+        local = self._local
+        if getattr(local, 'conn', None) is not None:
+            # Uso anidado en el mismo hilo: compartir conexión y transacción
+            conn = local.conn
+            local.depth += 1
+            savepoint = f'anidado_{local.depth}'
+            if not conn.in_transaction:
+                # Sin transacción abierta, RELEASE del SAVEPOINT haría commit
+                conn.execute('BEGIN')
+            conn.execute(f'SAVEPOINT {savepoint}')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute(f'ROLLBACK TO {savepoint}')
+                conn.execute(f'RELEASE {savepoint}')
+                raise
             else:
-                logger.error(f"❌ Columna '{col}' NO encontrada")
-        
-        # Contar columnas para verificar
-        logger.info(f"=== VERIFICACIÓN DE COLUMNAS ===")
-        logger.info(f"Columnas en tabla: {len(column_names)}")
+                conn.execute(f'RELEASE {savepoint}')
+            finally:
+                local.depth -= 1
+            return
         
-        return column_names
+        conn = self.acquire()
+        local.conn, local.depth = conn, 0
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException as e:
+            # También KeyboardInterrupt, SystemExit o un timeout: la conexión
+            # nunca vuelve al pool con una transacción abierta
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+            logger.error(f"Error en transacción BD: {str(e)}")
+            raise
+        finally:
+            local.conn = None
+            self.release(conn, discard=broken)
+    
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'opened': self.opened,
+                'reused': self.reused,
+                'in_use': self.in_use,
+                'idle': self._idle.qsize(),
+            }
+
+db_pool = ConnectionPool(config.DB_POOL_SIZE)
 
 @contextmanager
 def db_connection():
     """Context manager para manejo automático de conexiones a BD"""
-    conn = sqlite3.connect(config.DB_FILE)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Error en transacción BD: {str(e)}")
-        raise
-    finally:
-        conn.close()
+    with tracer.span('db_connection', SPAN_KIND_CLIENT, {'db.system': 'sqlite'}):
+        with db_pool.connection() as conn:
+            yield conn
 
-# Inicializar base de datos
-recreate_database()
-verify_database_structure()
+# --- Almacenamiento de informes (SQLite / PostgreSQL) ---
+# Campos de texto del formulario. Cada uno es una columna de informes y de
+# aquí salen el control HTML, la validación, las columnas del INSERT y su
+# lugar en el PDF: agregar un campo es agregar una línea (y su migración).
+def _validar_fecha(value):
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return "La fecha debe tener el formato AAAA-MM-DD"
+    return None
 
-# --- Validaciones ---
-def es_email_valido(email):
-    """Validar formato de email"""
-    if not email:
-        return False
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email.strip()) is not None
+SI_NO = (('si', 'Sí'), ('no', 'No'))
 
-def validar_formulario(form):
-    """Validar datos del formulario"""
-    errors = []
+@dataclass(frozen=True)
+class FormField:
+    name: str
+    label: str
+    section: str              # sección del formulario (ver FORM_SECTIONS)
+    row: int = 0              # fila dentro de la sección, hasta dos campos por fila
+    kind: str = 'text'        # text | date | textarea | select
+    placeholder: str = ''
+    required: bool = False
+    max_length: int = 200
+    choices: tuple = ()       # select: ((valor, texto), ...)
+    validator: object = None  # valor -> mensaje de error, o None
+    pdf: tuple = ()           # bloque de datos del PDF: (bloque, fila, columna, etiqueta, dx, largo máx.)
+    pdf_title: str = ''       # textarea: título de su sección en el PDF
+    
+    def clean(self, form):
+        return (form.get(self.name) or '').strip()
     
-    if not form.get('institucion') or len(form['institucion'].strip()) == 0:
-        errors.append("El campo Institución/Cliente es requerido")
+    def validate(self, value):
+        """Mensaje de error para el valor ya limpio, o None"""
+        if not value:
+            return f"El campo {self.label} es requerido" if self.required else None
+        if len(value) > self.max_length:
+            return f"El campo {self.label} admite hasta {self.max_length} caracteres"
+        if self.choices and value not in {v for v, _ in self.choices}:
+            return f"Valor no válido en {self.label}"
+        return self.validator(value) if self.validator else None
+
+_TEXTO_LARGO = 10000
+
+FORM_FIELDS = (
+    FormField('institucion', 'Institución/Cliente', 'cliente', 0, placeholder='Nombre de la institución o cliente',
+              required=True, pdf=('cliente', 0, 0, 'Institución:', 50, 40)),
+    FormField('fecha', 'Fecha', 'cliente', 0, kind='date', required=True, max_length=10, validator=_validar_fecha),
+    FormField('encargado', 'Encargado/Responsable', 'cliente', 1, placeholder='Nombre del encargado',
+              pdf=('cliente', 0, 1, 'Encargado: ', 48, 25)),
+    FormField('contacto', 'Contacto', 'cliente', 1, placeholder='Email o teléfono de contacto',
+              pdf=('cliente', 1, 0, 'Contacto:', 45, 30)),
+    FormField('comuna', 'Comuna', 'cliente', 2, placeholder='Comuna', pdf=('cliente', 1, 1, 'Comuna:', 40, 20)),
+    FormField('ciudad', 'Ciudad', 'cliente', 2, placeholder='Ciudad', pdf=('cliente', 2, 0, 'Ciudad:', 35, 20)),
+    FormField('equipo', 'Equipo', 'equipo', 0, placeholder='Tipo de equipo médico',
+              pdf=('equipo', 0, 0, 'Equipo:', 35, 25)),
+    FormField('marca_modelo', 'Marca/Modelo', 'equipo', 0, placeholder='Marca y modelo del equipo',
+              pdf=('equipo', 0, 1, 'Marca/Modelo: ', 60, 25)),
+    FormField('numero_serie', 'Número de Serie', 'equipo', 1, placeholder='Número de serie del equipo',
+              pdf=('equipo', 1, 0, 'N° Serie:', 40, 20)),
+    FormField('tecnico_nombre', 'Técnico Responsable', 'equipo', 1, placeholder='Nombre del técnico',
+              pdf=('equipo', 1, 1, 'Ingeniero:', 40, 25)),
+    FormField('servicio_otro_especificar', 'Especificar "Otro":', 'servicio', placeholder='Especificar otro motivo'),
+    FormField('problema_cliente', 'Problema reportado por el cliente', 'problema', kind='textarea',
+              placeholder='Describa el problema reportado...', max_length=_TEXTO_LARGO, pdf_title='PROBLEMA REPORTADO'),
+    FormField('inspeccion_visual', 'Inspección Visual Inicial del equipamiento', 'problema', kind='textarea',
+              placeholder='Describa la inspección visual...', max_length=_TEXTO_LARGO, pdf_title='INSPECCIÓN VISUAL'),
+    # Va dentro de la fila "Otros" del checklist de mantenimiento
+    FormField('mantenimiento_otros_especificar', 'Otros (Especificar)', 'mantenimiento',
+              placeholder='Especificar otros trabajos...'),
+    FormField('mediciones_parametros', 'Parámetros de medición realizados', 'mediciones', kind='textarea',
+              placeholder='Describa las mediciones realizadas...', max_length=_TEXTO_LARGO,
+              pdf_title='MEDICIONES REALIZADAS'),
+    FormField('detalles_servicio', 'Detalles del servicio', 'detalles', kind='textarea',
+              placeholder='Describa detalles adicionales del servicio...', max_length=_TEXTO_LARGO,
+              pdf_title='DETALLES Y OBSERVACIONES'),
+    FormField('encuesta_presentacion', '¿Técnico se presentó correctamente en el servicio?', 'encuesta', 0,
+              kind='select', placeholder='Seleccionar', choices=SI_NO),
+    FormField('encuesta_reparacion', '¿Se realiza la reparación del equipamiento?', 'encuesta', 0,
+              kind='select', placeholder='Seleccionar', choices=SI_NO),
+    FormField('encuesta_preparacion', '¿Técnico se encontraba preparado para la visita?', 'encuesta', 1,
+              kind='select', placeholder='Seleccionar', choices=SI_NO),
+    FormField('encuesta_plazos', '¿La visita técnica fue realizada en los plazos estipulados?', 'encuesta', 1,
+              kind='select', placeholder='Seleccionar', choices=SI_NO),
+    FormField('encuesta_nota', '¿Qué nota le colocaría al servicio realizado? (de 1 a 10)', 'encuesta', 2,
+              kind='select', placeholder='Seleccionar nota', choices=tuple((str(n), str(n)) for n in range(1, 11))),
+    FormField('encuesta_recomendacion', '¿Usted recomendaría nuestro servicio técnico?', 'encuesta', 2,
+              kind='select', placeholder='Seleccionar', choices=SI_NO),
+)
+FORM_FIELDS_BY_NAME = {field.name: field for field in FORM_FIELDS}
+
+def _form_sections(fields):
+    """{sección: [[campos de la fila 0], [fila 1], ...]} para dibujar el formulario"""
+    sections = {}
+    for field in fields:
+        rows = sections.setdefault(field.section, [])
+        while len(rows) <= field.row:
+            rows.append([])
+        rows[field.row].append(field)
+    return sections
+
+FORM_SECTIONS = _form_sections(FORM_FIELDS)
+
+def datos_del_formulario(form):
+    """{columna: valor} con los campos de texto ya limpios; create() agrega firmas y fechas
+    y storage.insert_informe arma el INSERT con estas mismas columnas"""
+    return {field.name: field.clean(form) for field in FORM_FIELDS}
+
+# Checklist: cada respuesta es una fila (informe_id, ítem, valor) en
+# informe_checklist. El código del ítem es permanente: uno nuevo toma el
+# siguiente número libre y uno retirado no se reutiliza. Agregar un ítem es
+# agregar una línea aquí; el formulario, la BD y el PDF la toman solos.
+CHECK_NO_APLICA = 0
+CHECK_SI = 1  # casilla marcada o "Aplica"
+
+# Cómo se responde cada grupo en el formulario
+CHECKLIST_GROUPS = {
+    'servicio': 'checkbox',     # name=<clave> value=si
+    'garantia': 'radio',        # name=garantia value=<clave sin el grupo>
+    'mantenimiento': 'aplica',  # name=<clave> value=aplica|no_aplica
+    'resolucion': 'checkbox',
+}
+
+@dataclass(frozen=True)
+class ChecklistItem:
+    code: int
+    group: str
+    key: str
+    label: str      # texto en el formulario
+    pdf_label: str  # texto en el PDF
     
-    if not form.get('fecha'):
-        errors.append("La fecha es requerida")
+    @property
+    def kind(self):
+        return CHECKLIST_GROUPS[self.group]
     
-    # Validar firmas (tamaño)
-    if form.get('sig_tech') and len(form['sig_tech']) > config.MAX_SIGNATURE_SIZE:
-        errors.append("La firma del técnico es demasiado grande")
+    @property
+    def option(self):
+        return self.key[len(self.group) + 1:]
     
-    if form.get('sig_client') and len(form['sig_client']) > config.MAX_SIGNATURE_SIZE:
-        errors.append("La firma del cliente es demasiado grande")
+    def encode(self, form):
+        """Valor compacto de la respuesta del formulario, o None si no se respondió"""
+        if self.kind == 'radio':
+            answer = 'si' if form.get(self.group) == self.option else None
+        else:
+            answer = form.get(self.key)
+        if self.kind == 'aplica':
+            return {'aplica': CHECK_SI, 'no_aplica': CHECK_NO_APLICA}.get(answer)
+        return CHECK_SI if answer == 'si' else None
     
-    return errors
+    def decode(self, value):
+        """Valor con el texto del formulario ('si', 'aplica'...), el que usa el PDF"""
+        if self.kind == 'aplica':
+            return {CHECK_SI: 'aplica', CHECK_NO_APLICA: 'no_aplica'}.get(value, '')
+        return 'si' if value == CHECK_SI else 'no'
 
-# --- Template HTML COMPLETO (se mantiene igual) ---
-INDEX_HTML = '''
-<!doctype html>
-<html lang="es">
-<head>
-  <meta charset="utf-8" />
-  <meta name="viewport" content="width=device-width, initial-scale=1" />
-  <title>Novamedical - Orden de Trabajo</title>
-  <style>
-    body {
-        font-family: Arial, sans-serif;
-        max-width: 1200px;
-        margin: 20px auto;
-        padding: 20px;
-        background: #f5f5f5;
-    }
-    .container {
-        background: white;
-        padding: 30px;
-        border-radius: 10px;
-        box-shadow: 0 2px10px rgba(0,0,0,0.1);
-    }
-    h2 {
-        color: #2c3e50;
-        border-bottom: 2px solid #3498db;
-        padding-bottom: 10px;
-        text-align: center;
-    }
-    .section {
-        margin-bottom: 25px;
-        padding: 20px;
-        border: 1px solid #ddd;
-        border-radius: 5px;
-        background: #fafafa;
-    }
-    .section-title {
-        font-weight: bold;
-        color: #2c3e50;
-        margin-bottom: 15px;
-        font-size: 1.1em;
-        border-bottom: 1px solid #bdc3c7;
-        padding-bottom: 5px;
-    }
-    label {
-        display: block;
-        margin-top: 12px;
-        font-weight: bold;
-        color: #34495e;
-    }
-    input, textarea, select {
-        width: 100%;
-        padding: 10px;
-        border: 1px solid #bdc3c7;
-        border-radius: 5px;
-        font-size: 14px;
-        box-sizing: border-box;
-    }
-    textarea {
-        min-height: 80px;
-        resize: vertical;
-    }
-    .sig {
-        border: 2px solid #7f8c8d;
-        height: 150px;
-        background: white;
-        cursor: crosshair;
-        border-radius: 5px;
-        margin-top: 5px;
-    }
-    .row {
-        display: flex;
-        gap: 20px;
-        margin-bottom: 15px;
-    }
-    .col {
-        flex: 1;
-    }
-    .col-2 { flex: 2; }
-    .col-3 { flex: 3; }
-    
-    button {
-        padding: 12px 25px;
-        margin-top: 15px;
-        background: #3498db;
-        color: white;
-        border: none;
-        border-radius: 5px;
-        cursor: pointer;
-        font-size: 16px;
-        font-weight: bold;
-        transition: background 0.3s;
-    }
-    button:hover {
-        background: #2980b9;
-    }
-    .btn-clear {
-        background: #e74c3c;
-        padding: 8px 15px;
-        font-size: 14px;
-    }
-    .btn-clear:hover {
-        background: #c0392b;
-    }
+CHECKLIST_ITEMS = (
+    ChecklistItem(1, 'servicio', 'servicio_instalacion', 'Instalación/Puesta en marcha/Capacit.', 'Instalación/Puesta en marcha'),
+    ChecklistItem(2, 'servicio', 'servicio_mantenimiento', 'Mantenimiento preventivo', 'Mantenimiento preventivo'),
+    ChecklistItem(3, 'servicio', 'servicio_correctivo', 'Mantenimiento correctivo', 'Mantenimiento correctivo'),
+    ChecklistItem(4, 'servicio', 'servicio_visita', 'Visita técnica/Diagnóstico', 'Visita técnica/Diagnóstico'),
+    ChecklistItem(5, 'servicio', 'servicio_comercial', 'Solicitud comercial', 'Solicitud comercial'),
+    ChecklistItem(6, 'servicio', 'servicio_otro', 'Otro/demo', 'Otro: {servicio_otro_especificar}'),
+    ChecklistItem(7, 'garantia', 'garantia_en_garantia', 'En garantía', 'En garantía'),
+    ChecklistItem(8, 'garantia', 'garantia_fuera_garantia', 'Fuera de garantía', 'Fuera de garantía'),
+    ChecklistItem(9, 'garantia', 'garantia_en_convenio', 'En convenio', 'En convenio'),
+    ChecklistItem(10, 'mantenimiento', 'mantenimiento_prueba_funcionamiento', 'Prueba de funcionamiento inicial general del equipo.', 'Prueba funcionamiento'),
+    ChecklistItem(11, 'mantenimiento', 'mantenimiento_apertura_mecanismos', 'Apertura de todos los mecanismos y ejes de movimiento.', 'Apertura mecanismos'),
+    ChecklistItem(12, 'mantenimiento', 'mantenimiento_desinfeccion', 'Desinfección de equipo completo.', 'Desinfección equipo'),
+    ChecklistItem(13, 'mantenimiento', 'mantenimiento_limpieza_lubricacion', 'Limpieza y lubricación de todo punto móvil del equipo.', 'Limpieza/lubricación'),
+    ChecklistItem(14, 'mantenimiento', 'mantenimiento_lubricacion_motores', 'Lubricación de motores y otros. (solo si aplica)', 'Lubricación motores'),
+    ChecklistItem(15, 'mantenimiento', 'mantenimiento_calibracion_ejes', 'Calibración de los ejes axiales y motores. (solo si aplica)', 'Calibración ejes'),
+    ChecklistItem(16, 'mantenimiento', 'mantenimiento_calibracion_software', 'Calibración de software. (solo si aplica)', 'Calibración software'),
+    ChecklistItem(17, 'mantenimiento', 'mantenimiento_verificacion_seguridad', 'Verificación de sistemas de seguridad. (solo si aplica)', 'Verificación seguridad'),
+    ChecklistItem(18, 'mantenimiento', 'mantenimiento_verificacion_filtraciones', 'Verificación por filtraciones varias. (solo si aplica)', 'Verificación filtraciones'),
+    ChecklistItem(19, 'mantenimiento', 'mantenimiento_limpieza_cpu', 'Limpieza de unidad CPU. (solo si aplica)', 'Limpieza CPU'),
+    ChecklistItem(20, 'mantenimiento', 'mantenimiento_cambio_filtro', 'Cambio de Kit de Filtro. (solo si aplica)', 'Cambio filtro'),
+    ChecklistItem(21, 'mantenimiento', 'mantenimiento_reteste_pernos', 'Reteste de pernos, pasadores de motor, etc.', 'Reteste pernos'),
+    ChecklistItem(22, 'mantenimiento', 'mantenimiento_reseteo_contadores', 'Reseteo de contadores internos. (solo si aplica)', 'Reseteo contadores'),
+    ChecklistItem(23, 'mantenimiento', 'mantenimiento_otros', 'Otros (Especificar)', 'Otros'),
+    ChecklistItem(24, 'resolucion', 'resolucion_operativo', 'Equipo operativo', 'Equipo operativo'),
+    ChecklistItem(25, 'resolucion', 'resolucion_no_operativo', 'Equipo no operativo', 'Equipo no operativo'),
+    ChecklistItem(26, 'resolucion', 'resolucion_requiere_visita', 'Requiere nueva visita técnica', 'Requiere nueva visita'),
+)
+CHECKLIST_BY_KEY = {item.key: item for item in CHECKLIST_ITEMS}
+CHECKLIST_BY_GROUP = {
+    group: [item for item in CHECKLIST_ITEMS if item.group == group] for group in CHECKLIST_GROUPS
+}
+
+# Piezas de reemplazo: sin tope fijo, sólo un límite contra envíos abusivos
+PIEZAS_MAX = 200
+
+def checklist_del_formulario(form):
+    """[(ítem, valor)] con las respuestas del formulario"""
+    respuestas = []
+    for item in CHECKLIST_ITEMS:
+        valor = item.encode(form)
+        if valor is not None:
+            respuestas.append((item.code, valor))
+    return respuestas
+
+def piezas_del_formulario(form):
+    """[(descripción, cantidad)] en orden; acepta los nombres numerados del formulario anterior"""
+    descripciones = form.getlist('pieza_descripcion')
+    cantidades = form.getlist('pieza_cantidad')
+    n = 1
+    while f'piezas_descripcion{n}' in form:
+        descripciones.append(form.get(f'piezas_descripcion{n}'))
+        cantidades.append(form.get(f'piezas_cantidad{n}', ''))
+        n += 1
+    return [
+        (descripcion.strip(), (cantidad or '').strip())
+        for descripcion, cantidad in itertools.zip_longest(descripciones, cantidades, fillvalue='')
+        if descripcion and descripcion.strip()
+    ]
+
+LIST_COLUMNS = 'id, institucion, fecha, pdf_path, pdf_sha256, estado'
+EXPORT_COLUMNS = 'id, institucion, fecha, tecnico_nombre, pdf_path, estado'
+# Parámetro de /export -> condición (el valor se agrega como parámetro)
+EXPORT_FILTERS = {
+    'institucion': 'institucion =',
+    'tecnico': 'tecnico_nombre =',
+    'desde': 'fecha >=',
+    'hasta': 'fecha <=',
+}
+
+# Estados activos de la cola y la bandeja de salida (los cubren sus índices por estado)
+QUEUE_ESTADOS = (('jobs', ('queued', 'running')), ('outbox', ('queued', 'sending')))
+
+class StorageBackend(ABC):
+    """Operaciones sobre la tabla informes que usan las rutas y los trabajos"""
     
-    /* Estilos para tablas y checkboxes */
-    .checkbox-grid {
-        display: grid;
-        grid-template-columns: 1fr 1fr;
-        gap: 15px;
-        margin-top: 10px;
-    }
-    .checkbox-item {
-        display: flex;
-        align-items: center;
-        gap: 8px;
-    }
-    .checkbox-group {
-        display: flex;
-        gap: 15px;
-        margin-top: 10px;
-    }
-    .aplica-group {
-        display: flex;
-        gap: 10px;
-        align-items: center;
-    }
-    .table-grid {
-        display: grid;
-        grid-template-columns: 2fr 1fr 2fr 1fr;
-        gap: 10px;
-        margin-top: 10px;
-    }
-    .table-header {
-        font-weight: bold;
-        background: #ecf0f1;
-        padding: 8px;
-        border-radius: 3px;
-    }
+    @abstractmethod
+    def migrate(self):
+        ...
     
-    .error {
-        color: #e74c3c;
-        font-size: 0.9em;
-        margin-top: 5px;
-    }
-    .success {
-        color: #27ae60;
-        font-size: 0.9em;
-        margin-top: 5px;
-    }
-    .required:after {
-        content: " *";
-        color: #e74c3c;
-    }
-    .informes-list {
-        margin-top: 30px;
-    }
-    .informes-list li {
-        padding: 10px;
-        border-bottom: 1px solid #ecf0f1;
-        display: flex;
-        justify-content: space-between;
-        align-items: center;
-    }
-    .informes-list a {
-        color: #3498db;
-        text-decoration: none;
-        font-weight: bold;
-    }
-    .informes-list a:hover {
-        text-decoration: underline;
-    }
-  </style>
-</head>
-<body>
-  <div class="container">
-    <h2>📋 Novamedical - Orden de Trabajo de Servicio Técnico</h2>
+    @abstractmethod
+    def insert_informe(self, values, checklist=(), piezas=()):
+        """Insertar una orden (dict columna -> valor) con sus respuestas de
+        checklist [(ítem, valor)] y piezas [(descripción, cantidad)]; devuelve su id"""
     
-    {% with messages = get_flashed_messages(with_categories=true) %}
-      {% if messages %}
-        <div class="messages">
-          {% for category, message in messages %}
-            <div class="{{ 'error' if category == 'error' else 'success' }}">{{ message }}</div>
-          {% endfor %}
-        </div>
-      {% endif %}
-    {% endwith %}
+    @abstractmethod
+    def insert_informes(self, ordenes):
+        """insert_informe para un lote [(values, checklist, piezas)] con las mismas
+        columnas, en una sola transacción; devuelve los ids en el mismo orden"""
     
-    <form method="post" action="/create" onsubmit="return prepareSignatures()">
-      
-      <!-- Sección: Información del Cliente -->
-      <div class="section">
-        <div class="section-title">🏢 Información del Cliente</div>
-        <div class="row">
-          <div class="col">
-            <label class="required">Institución/Cliente</label>
-            <input name="institucion" value="{{ form_data.institucion or '' }}" required placeholder="Nombre de la institución o cliente">
-          </div>
-          <div class="col">
-            <label class="required">Fecha</label>
-            <input name="fecha" type="date" value="{{ form_data.fecha or today }}" required>
-          </div>
-        </div>
-        <div class="row">
-          <div class="col">
-            <label>Encargado/Responsable</label>
-            <input name="encargado" value="{{ form_data.encargado or '' }}" placeholder="Nombre del encargado">
-          </div>
-          <div class="col">
-            <label>Contacto</label>
-            <input name="contacto" value="{{ form_data.contacto or '' }}" placeholder="Email o teléfono de contacto">
-          </div>
-        </div>
-        <div class="row">
-            <div class="col">
-                <label>Comuna</label>
-                <input name="comuna" value="{{ form_data.comuna or '' }}" placeholder="Comuna">
-            </div>
-            <div class="col">
-                <label>Ciudad</label>
-                <input name="ciudad" value="{{ form_data.ciudad or '' }}" placeholder="Ciudad">
-            </div>
-        </div>
-    </div>
-
-      <!-- Sección: Datos del Equipamiento -->
-      <div class="section">
-        <div class="section-title">🔧 Datos del Equipamiento</div>
-        <div class="row">
-          <div class="col">
-            <label>Equipo</label>
-            <input name="equipo" value="{{ form_data.equipo or '' }}" placeholder="Tipo de equipo médico">
-          </div>
-          <div class="col">
-            <label>Marca/Modelo</label>
-            <input name="marca_modelo" value="{{ form_data.marca_modelo or '' }}" placeholder="Marca y modelo del equipo">
-          </div>
-        </div>
-        <div class="row">
-          <div class="col">
-            <label>Número de Serie</label>
-            <input name="numero_serie" value="{{ form_data.numero_serie or '' }}" placeholder="Número de serie del equipo">
-          </div>
-          <div class="col">
-            <label>Técnico Responsable</label>
-            <input name="tecnico_nombre" value="{{ form_data.tecnico_nombre or '' }}" placeholder="Nombre del técnico">
-          </div>
-        </div>
-      </div>
+    @abstractmethod
+    def get_detalles(self, ids):
+        """{id: {'checklist': {ítem: valor}, 'piezas': [(descripción, cantidad)]}} para un lote de órdenes"""
+    
+    @abstractmethod
+    def ids_por_idempotency_key(self, keys):
+        """{clave: id} de las órdenes ya recibidas con esas claves de idempotencia"""
+    
+    def with_detalles(self, rows):
+        """Filas como dict con su checklist y piezas, en dos consultas por lote"""
+        rows = [dict(row) for row in rows]
+        detalles = self.get_detalles([row['id'] for row in rows]) if rows else {}
+        for row in rows:
+            row.update(detalles[row['id']])
+        return rows
+    
+    @abstractmethod
+    def conteo_checklist(self, item, valor=CHECK_SI):
+        """[(marca_modelo, órdenes)] con el ítem respondido así, p. ej. calibraciones por modelo"""
+    
+    @abstractmethod
+    def list_informes(self, before_id=None, limit=25):
+        """Órdenes más recientes primero, paginadas por cursor sobre id (keyset)"""
+    
+    @abstractmethod
+    def search_informes(self, terms, limit=25, offset=0):
+        """Órdenes que contienen todos los términos (como prefijo), por relevancia.
+        
+        Para acotar el costo de consultas muy generales, el ranking se calcula
+        sobre las SEARCH_CANDIDATES coincidencias más recientes.
+        """
+    
+    @abstractmethod
+    def export_informes(self, filters, after_id=0, limit=500, columns=EXPORT_COLUMNS):
+        """Órdenes que cumplen los filtros de EXPORT_FILTERS, por id ascendente
+        desde after_id (keyset), para recorrer exportaciones grandes por lotes"""
+    
+    @abstractmethod
+    def count_informes(self, filters, after_id=0):
+        """Cantidad de órdenes que recorrería export_informes"""
+    
+    @abstractmethod
+    def get_informe(self, informe_id):
+        """Fila completa como dict con checklist y piezas, o None"""
+    
+    @abstractmethod
+    def update_informe(self, informe_id, **fields):
+        ...
+    
+    @abstractmethod
+    def transaction(self, immediate=False):
+        """Context manager: las operaciones del bloque en este hilo comparten una
+        transacción (p. ej. INSERT de la orden + encolar su render); un bloque
+        anidado es un SAVEPOINT. immediate toma el lock de escritura al empezar"""
+    
+    # Cola de trabajos y bandeja de salida: en la misma base que informes, para
+    # que encolar entre en la misma transacción que la escritura de la orden
+    @abstractmethod
+    def enqueue_jobs(self, informe_ids, tipo, traceparent=None):
+        """Registrar un trabajo 'queued' por orden"""
+    
+    @abstractmethod
+    def jobs_abandonados(self, stale):
+        """[{id, informe_id, tipo, intentos}] 'running' sin latido desde stale (ISO)"""
+    
+    @abstractmethod
+    def claim_job(self):
+        """Marcar 'running' el siguiente trabajo vencido y devolverlo (intentos ya
+        incrementado) o None; dos workers nunca toman el mismo"""
+    
+    @abstractmethod
+    def touch_jobs(self, ids):
+        """Renovar updated_at de trabajos en curso (latido)"""
+    
+    @abstractmethod
+    def update_job(self, job_id, **fields):
+        ...
+    
+    @abstractmethod
+    def enqueue_email(self, informe_id, destinatario, asunto, cuerpo, adjunto_path, traceparent=None):
+        """Registrar un correo 'queued' en la bandeja de salida"""
+    
+    @abstractmethod
+    def claim_emails(self, stale, limit):
+        """Marcar 'sending' hasta limit correos vencidos y devolverlos (intentos ya
+        incrementado); antes devuelve a la cola los 'sending' sin cambios desde stale"""
+    
+    @abstractmethod
+    def update_email(self, email_id, **fields):
+        ...
+    
+    @abstractmethod
+    def release_emails(self, ids):
+        """Devolver correos a la cola sin contar el intento"""
+    
+    @abstractmethod
+    def queue_depth(self):
+        """{(tabla, estado): cantidad} de trabajos y correos pendientes o en curso"""
+    
+    @abstractmethod
+    def ping(self):
+        ...
 
-      <!-- Sección: Motivo/Razón de la visita -->
-      <div class="section">
-        <div class="section-title">🎯 Motivo/Razón de la Visita</div>
-        <div class="checkbox-grid">
-          <div class="checkbox-item">
-            <input type="checkbox" name="servicio_instalacion" value="si" {{ 'checked' if 'servicio_instalacion' in form_data and form_data.servicio_instalacion == 'si' else '' }}>
-            <label>Instalación/Puesta en marcha/Capacit.</label>
-          </div>
-          <div class="checkbox-item">
-            <input type="checkbox" name="servicio_mantenimiento" value="si" {{ 'checked' if 'servicio_mantenimiento' in form_data and form_data.servicio_mantenimiento == 'si' else '' }}>
-            <label>Mantenimiento preventivo</label>
-          </div>
-          <div class="checkbox-item">
-            <input type="checkbox" name="servicio_correctivo" value="si" {{ 'checked' if 'servicio_correctivo' in form_data and form_data.servicio_correctivo == 'si' else '' }}>
-            <label>Mantenimiento correctivo</label>
-          </div>
-          <div class="checkbox-item">
-            <input type="checkbox" name="servicio_visita" value="si" {{ 'checked' if 'servicio_visita' in form_data and form_data.servicio_visita == 'si' else '' }}>
-            <label>Visita técnica/Diagnóstico</label>
-          </div>
-          <div class="checkbox-item">
-            <input type="checkbox" name="servicio_comercial" value="si" {{ 'checked' if 'servicio_comercial' in form_data and form_data.servicio_comercial == 'si' else '' }}>
-            <label>Solicitud comercial</label>
-          </div>
-          <div class="checkbox-item">
-            <input type="checkbox" name="servicio_otro" value="si" {{ 'checked' if 'servicio_otro' in form_data and form_data.servicio_otro == 'si' else '' }}>
-            <label>Otro/demo</label>
-          </div>
-        </div>
-        <div class="row">
-          <div class="col">
-            <label>Especificar "Otro":</label>
-            <input name="servicio_otro_especificar" value="{{ form_data.servicio_otro_especificar or '' }}" placeholder="Especificar otro motivo">
-          </div>
-        </div>
-      </div>
+class SQLiteStorage(StorageBackend):
+    """Informes en el mismo archivo SQLite que la cola de trabajos.
+    
+    Usa db_connection(), por lo que dentro de un bloque db_connection() del
+    llamador comparte su transacción (p. ej. INSERT + encolar el render).
+    """
+    
+    def migrate(self):
+        init_db()
+    
+    def insert_informe(self, values, checklist=(), piezas=()):
+        return self.insert_informes([(values, checklist, piezas)])[0]
+    
+    @timed_stage('db_insert')
+    @traced('INSERT informes', SPAN_KIND_CLIENT)
+    def insert_informes(self, ordenes):
+        columns = list(ordenes[0][0])
+        sql = f"INSERT INTO informes ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        ids, checklist_rows, piezas_rows = [], [], []
+        with db_connection() as conn:
+            # executemany no devuelve los ids: un execute por orden (la sentencia
+            # queda en la caché de sqlite3) y las tablas hijas de todo el lote juntas
+            for values, checklist, piezas in ordenes:
+                informe_id = conn.execute(sql, [values[c] for c in columns]).lastrowid
+                ids.append(informe_id)
+                checklist_rows.extend((informe_id, item, valor) for item, valor in checklist)
+                piezas_rows.extend((informe_id, orden, *pieza) for orden, pieza in enumerate(piezas, 1))
+            if checklist_rows:
+                conn.executemany(
+                    'INSERT INTO informe_checklist (informe_id, item, valor) VALUES (?, ?, ?)', checklist_rows
+                )
+            if piezas_rows:
+                conn.executemany(
+                    'INSERT INTO informe_piezas (informe_id, orden, descripcion, cantidad) VALUES (?, ?, ?, ?)',
+                    piezas_rows
+                )
+        return ids
+    
+    def list_informes(self, before_id=None, limit=25):
+        with db_connection() as conn:
+            if before_id is None:
+                return conn.execute(
+                    f'SELECT {LIST_COLUMNS} FROM informes ORDER BY id DESC LIMIT ?', (limit,)
+                ).fetchall()
+            return conn.execute(
+                f'SELECT {LIST_COLUMNS} FROM informes WHERE id < ? ORDER BY id DESC LIMIT ?',
+                (before_id, limit)
+            ).fetchall()
+    
+    def search_informes(self, terms, limit=25, offset=0):
+        query = ' '.join(f'"{term}"*' for term in terms)
+        with db_connection() as conn:
+            return conn.execute(
+                '''WITH candidatos AS (
+                       SELECT rowid AS rid, rank FROM informes_fts
+                       WHERE informes_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+                   )
+                   SELECT i.id, i.institucion, i.fecha, i.pdf_path, i.pdf_sha256, i.estado,
+                          i.problema_cliente, i.detalles_servicio
+                   FROM candidatos JOIN informes i ON i.id = candidatos.rid
+                   ORDER BY candidatos.rank
+                   LIMIT ? OFFSET ?''',
+                (query, config.SEARCH_CANDIDATES, limit, offset)
+            ).fetchall()
+    
+    def export_informes(self, filters, after_id=0, limit=500, columns=EXPORT_COLUMNS):
+        where = ''.join(f' AND {EXPORT_FILTERS[name]} ?' for name in filters)
+        with db_connection() as conn:
+            return conn.execute(
+                f'SELECT {columns} FROM informes WHERE id > ?{where} ORDER BY id LIMIT ?',
+                [after_id, *filters.values(), limit]
+            ).fetchall()
+    
+    def count_informes(self, filters, after_id=0):
+        where = ''.join(f' AND {EXPORT_FILTERS[name]} ?' for name in filters)
+        with db_connection() as conn:
+            return conn.execute(
+                f'SELECT COUNT(*) FROM informes WHERE id > ?{where}', [after_id, *filters.values()]
+            ).fetchone()[0]
+    
+    def get_informe(self, informe_id):
+        with db_connection() as conn:
+            row = conn.execute('SELECT * FROM informes WHERE id = ?', (informe_id,)).fetchone()
+        return self.with_detalles([row])[0] if row else None
+    
+    def ids_por_idempotency_key(self, keys):
+        marks = ', '.join('?' * len(keys))
+        with db_connection() as conn:
+            return dict(conn.execute(
+                f'SELECT idempotency_key, id FROM informes WHERE idempotency_key IN ({marks})', list(keys)
+            ).fetchall())
+    
+    def get_detalles(self, ids):
+        detalles = {informe_id: {'checklist': {}, 'piezas': []} for informe_id in ids}
+        marks = ', '.join('?' * len(ids))
+        with db_connection() as conn:
+            for informe_id, item, valor in conn.execute(
+                f'SELECT informe_id, item, valor FROM informe_checklist WHERE informe_id IN ({marks})', list(ids)
+            ):
+                detalles[informe_id]['checklist'][item] = valor
+            for informe_id, descripcion, cantidad in conn.execute(
+                f'SELECT informe_id, descripcion, cantidad FROM informe_piezas '
+                f'WHERE informe_id IN ({marks}) ORDER BY informe_id, orden', list(ids)
+            ):
+                detalles[informe_id]['piezas'].append((descripcion, cantidad))
+        return detalles
+    
+    def conteo_checklist(self, item, valor=CHECK_SI):
+        with db_connection() as conn:
+            return [tuple(row) for row in conn.execute(
+                '''SELECT i.marca_modelo, COUNT(*) AS ordenes
+                   FROM informe_checklist c JOIN informes i ON i.id = c.informe_id
+                   WHERE c.item = ? AND c.valor = ?
+                   GROUP BY i.marca_modelo
+                   ORDER BY ordenes DESC''',
+                (item, valor)
+            )]
+    
+    def update_informe(self, informe_id, **fields):
+        self._update('informes', informe_id, fields)
+    
+    def _update(self, table, row_id, fields):
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with db_connection() as conn:
+            conn.execute(
+                f'UPDATE {table} SET {assignments} WHERE id = ?',
+                [*fields.values(), row_id]
+            )
+    
+    @contextmanager
+    def transaction(self, immediate=False):
+        with db_connection() as conn:
+            if immediate and not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            yield conn
+    
+    def enqueue_jobs(self, informe_ids, tipo, traceparent=None):
+        now = datetime.now().isoformat()
+        with db_connection() as conn:
+            conn.executemany(
+                'INSERT INTO jobs (informe_id, tipo, estado, created_at, updated_at, traceparent) VALUES (?, ?, ?, ?, ?, ?)',
+                [(informe_id, tipo, 'queued', now, now, traceparent) for informe_id in informe_ids]
+            )
+    
+    def jobs_abandonados(self, stale):
+        with db_connection() as conn:
+            return [dict(row) for row in conn.execute(
+                "SELECT id, informe_id, tipo, intentos FROM jobs WHERE estado = 'running' AND updated_at < ?",
+                (stale,)
+            )]
+    
+    def claim_job(self):
+        with self.transaction(immediate=True) as conn:
+            job = conn.execute(
+                "SELECT id, informe_id, tipo, intentos, traceparent FROM jobs "
+                "WHERE estado = 'queued' AND next_attempt_at <= ? ORDER BY id LIMIT 1",
+                (time.time(),)
+            ).fetchone()
+            if job:
+                conn.execute(
+                    "UPDATE jobs SET estado = 'running', intentos = intentos + 1, updated_at = ? WHERE id = ?",
+                    (datetime.now().isoformat(), job['id'])
+                )
+        return dict(job, intentos=job['intentos'] + 1) if job else None
+    
+    def touch_jobs(self, ids):
+        with db_connection() as conn:
+            conn.execute(
+                f"UPDATE jobs SET updated_at = ? WHERE estado = 'running' AND id IN ({', '.join('?' * len(ids))})",
+                [datetime.now().isoformat(), *ids]
+            )
+    
+    def update_job(self, job_id, **fields):
+        self._update('jobs', job_id, fields)
+    
+    def enqueue_email(self, informe_id, destinatario, asunto, cuerpo, adjunto_path, traceparent=None):
+        now = datetime.now().isoformat()
+        with db_connection() as conn:
+            conn.execute(
+                '''INSERT INTO outbox (informe_id, destinatario, asunto, cuerpo, adjunto_path, estado,
+                                        next_attempt_at, created_at, updated_at, traceparent)
+                   VALUES (?, ?, ?, ?, ?, 'queued', 0, ?, ?, ?)''',
+                (informe_id, destinatario, asunto, cuerpo, adjunto_path, now, now, traceparent)
+            )
+    
+    def claim_emails(self, stale, limit):
+        now = datetime.now().isoformat()
+        with self.transaction(immediate=True) as conn:
+            conn.execute(
+                "UPDATE outbox SET estado = 'queued' WHERE estado = 'sending' AND updated_at < ?",
+                (stale,)
+            )
+            rows = conn.execute(
+                "SELECT * FROM outbox WHERE estado = 'queued' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE outbox SET estado = 'sending', intentos = intentos + 1, updated_at = ? WHERE id = ?",
+                    [(now, r['id']) for r in rows]
+                )
+        return [dict(r, intentos=r['intentos'] + 1) for r in rows]
+    
+    def update_email(self, email_id, **fields):
+        self._update('outbox', email_id, fields)
+    
+    def release_emails(self, ids):
+        with db_connection() as conn:
+            conn.executemany(
+                "UPDATE outbox SET estado = 'queued', intentos = intentos - 1 WHERE id = ?",
+                [(email_id,) for email_id in ids]
+            )
+    
+    def queue_depth(self):
+        depth = {(table, estado): 0 for table, estados in QUEUE_ESTADOS for estado in estados}
+        with db_connection() as conn:
+            for table, estados in QUEUE_ESTADOS:
+                for estado, count in conn.execute(
+                    f'SELECT estado, COUNT(*) FROM {table} WHERE estado IN (?, ?) GROUP BY estado', estados
+                ):
+                    depth[(table, estado)] = count
+        return depth
+    
+    def ping(self):
+        with db_connection() as conn:
+            conn.execute('SELECT 1').fetchone()
 
-      <!-- Sección: Tipo de garantía -->
-      <div class="section">
-        <div class="section-title">📄 Tipo de Garantía</div>
-        <div class="checkbox-group">
-          <div class="checkbox-item">
-            <input type="radio" name="garantia" value="en_garantia" {{ 'checked' if form_data.get('garantia') == 'en_garantia' else '' }}>
-            <label>En garantía</label>
-          </div>
-          <div class="checkbox-item">
-            <input type="radio" name="garantia" value="fuera_garantia" {{ 'checked' if form_data.get('garantia') == 'fuera_garantia' else '' }}>
-            <label>Fuera de garantía</label>
-          </div>
-          <div class="checkbox-item">
-            <input type="radio" name="garantia" value="en_convenio" {{ 'checked' if form_data.get('garantia') == 'en_convenio' else '' }}>
-            <label>En convenio</label>
-          </div>
-        </div>
-      </div>
+# PostgreSQL no trae unaccent como función IMMUTABLE; translate() sí lo es
+PG_ACCENTS_FROM = 'áàäâéèëêíìïîóòöôúùüûñç'
+PG_ACCENTS_TO = 'aaaaeeeeiiiioooouuuunc'
+PG_SEARCH_WEIGHTS = {
+    'institucion': 'A', 'numero_serie': 'A', 'equipo': 'B', 'marca_modelo': 'B',
+    'tecnico_nombre': 'C', 'problema_cliente': 'D', 'detalles_servicio': 'D',
+}
 
-      <!-- Sección: Problema reportado e inspección -->
-      <div class="section">
-        <div class="section-title">🔍 Problema Reportado e Inspección</div>
-        <div class="row">
-          <div class="col">
-            <label>Problema reportado por el cliente</label>
-            <textarea name="problema_cliente" placeholder="Describa el problema reportado...">{{ form_data.problema_cliente or '' }}</textarea>
-          </div>
-          <div class="col">
-            <label>Inspección Visual Inicial del equipamiento</label>
-            <textarea name="inspeccion_visual" placeholder="Describa la inspección visual...">{{ form_data.inspeccion_visual or '' }}</textarea>
-          </div>
-        </div>
-      </div>
+# Migraciones de PostgreSQL: informes y, desde la 8, la cola de trabajos y la
+# bandeja de salida (antes en el SQLite local de cada instancia)
+PG_MIGRATIONS = [
+    (1, 'tabla informes', [
+        INFORMES_DDL.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'BIGSERIAL PRIMARY KEY'),
+        'CREATE INDEX IF NOT EXISTS idx_informes_fecha ON informes(fecha)',
+        'CREATE INDEX IF NOT EXISTS idx_informes_institucion ON informes(institucion)',
+    ]),
+    (2, 'estado de orden', [
+        "ALTER TABLE informes ADD COLUMN IF NOT EXISTS estado TEXT NOT NULL DEFAULT 'pending'",
+    ]),
+    (3, 'búsqueda de texto completo', [
+        # Columna generada (se mantiene sola) con los mismos pesos que FTS5 en SQLite
+        'ALTER TABLE informes ADD COLUMN IF NOT EXISTS busqueda tsvector GENERATED ALWAYS AS ('
+        + ' || '.join(
+            f"setweight(to_tsvector('simple', translate(lower(coalesce({name}, '')), "
+            f"'{PG_ACCENTS_FROM}', '{PG_ACCENTS_TO}')), '{PG_SEARCH_WEIGHTS[name]}')"
+            for name, _ in SEARCH_COLUMNS
+        )
+        + ') STORED',
+        'CREATE INDEX IF NOT EXISTS idx_informes_busqueda ON informes USING GIN (busqueda)',
+    ]),
+    (4, 'índice por técnico para exportación', [
+        'CREATE INDEX IF NOT EXISTS idx_informes_tecnico ON informes(tecnico_nombre)',
+    ]),
+    (5, 'hash del PDF para descargas', [
+        'ALTER TABLE informes ADD COLUMN IF NOT EXISTS pdf_sha256 TEXT',
+    ]),
+    (6, 'checklist y piezas en tablas hijas', [
+        CHECKLIST_DDL.replace('INTEGER NOT NULL REFERENCES', 'BIGINT NOT NULL REFERENCES'),
+        PIEZAS_DDL.replace('INTEGER NOT NULL REFERENCES', 'BIGINT NOT NULL REFERENCES'),
+        *CHECKLIST_PIEZAS_INDEXES,
+        *(f'INSERT INTO informe_checklist (informe_id, item, valor) {select} ON CONFLICT DO NOTHING'
+          for select in _legacy_checklist_selects()),
+        *(f'INSERT INTO informe_piezas (informe_id, orden, descripcion, cantidad) {select} ON CONFLICT DO NOTHING'
+          for select in _legacy_piezas_selects()),
+    ]),
+    (7, 'clave de idempotencia de órdenes', [
+        'ALTER TABLE informes ADD COLUMN IF NOT EXISTS idempotency_key TEXT',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_informes_idempotency ON informes(idempotency_key)',
+    ]),
+    (8, 'cola de trabajos y bandeja de salida', [
+        '''CREATE TABLE IF NOT EXISTS jobs (
+            id BIGSERIAL PRIMARY KEY,
+            informe_id BIGINT NOT NULL,
+            tipo TEXT NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'queued',
+            intentos INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            traceparent TEXT,
+            next_attempt_at DOUBLE PRECISION NOT NULL DEFAULT 0
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_estado ON jobs(estado, id)',
+        '''CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            informe_id BIGINT,
+            destinatario TEXT NOT NULL,
+            asunto TEXT NOT NULL,
+            cuerpo TEXT,
+            adjunto_path TEXT,
+            estado TEXT NOT NULL DEFAULT 'queued',
+            intentos INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at DOUBLE PRECISION NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            sent_at TEXT,
+            traceparent TEXT
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_estado ON outbox(estado, next_attempt_at)',
+    ]),
+]
+PG_MIGRATION_LOCK = 7240031
 
-      <!-- Sección: Descripción del Mantenimiento -->
-      <div class="section">
-        <div class="section-title">🛠️ Descripción del Mantenimiento</div>
-        
-        <div class="row">
-          <div class="col-2"><strong>Actividad</strong></div>
-          <div class="col"><strong>Aplica/No Aplica</strong></div>
-        </div>
-        
-        <!-- Filas de mantenimiento (se mantienen igual) -->
-        <div class="row">
-          <div class="col-2">Prueba de funcionamiento inicial general del equipo.</div>
-          <div class="col">
-            <div class="aplica-group">
-              <input type="radio" name="mantenimiento_prueba_funcionamiento" value="aplica" {{ 'checked' if form_data.mantenimiento_prueba_funcionamiento == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_prueba_funcionamiento" value="no_aplica" {{ 'checked' if form_data.mantenimiento_prueba_funcionamiento == 'no_aplica' else '' }}> No Aplica
-            </div>
-          </div>
-        </div>
-        
-        <div class="row">
-          <div class="col-2">Apertura de todos los mecanismos y ejes de movimiento.</div>
-          <div class="col">
-            <div class="aplica-group">
-              <input type="radio" name="mantenimiento_apertura_mecanismos" value="aplica" {{ 'checked' if form_data.mantenimiento_apertura_mecanismos == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_apertura_mecanismos" value="no_aplica" {{ 'checked' if form_data.mantenimiento_apertura_mecanismos == 'no_aplica' else '' }}> No Aplica
-            </div>
-          </div>
-        </div>
+class PostgresStorage(StorageBackend):
+    """Informes en PostgreSQL con pool de conexiones y sentencias preparadas.
+    
+    Cada conexión del pool prepara en el servidor (PREPARE) cada sentencia la
+    primera vez que la usa y después sólo envía EXECUTE con los parámetros.
+    Como en ConnectionPool, un hilo que anida connection() recibe la misma
+    conexión y cada bloque interno es un SAVEPOINT.
+    """
+    
+    def __init__(self, dsn, minconn, maxconn):
+        import psycopg2
+        import psycopg2.extras
+        import psycopg2.pool
         
-        <div class="row">
-          <div class="col-2">Desinfección de equipo completo.</div>
-          <div class="col">
-            <div class="aplica-group">
-              <input type="radio" name="mantenimiento_desinfeccion" value="aplica" {{ 'checked' if form_data.mantenimiento_desinfeccion == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_desinfeccion" value="no_aplica" {{ 'checked' if form_data.mantenimiento_desinfeccion == 'no_aplica' else '' }}> No Aplica
-            </div>
-          </div>
-        </div>
+        class PreparedConnection(psycopg2.extensions.connection):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.prepared = set()
         
-        <div class="row">
-          <div class="col-2">Limpieza y lubricación de todo punto móvil del equipo.</div>
-          <div class="col">
-            <div class="aplica-group">
-              <input type="radio" name="mantenimiento_limpieza_lubricacion" value="aplica" {{ 'checked' if form_data.mantenimiento_limpieza_lubricacion == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_limpieza_lubricacion" value="no_aplica" {{ 'checked' if form_data.mantenimiento_limpieza_lubricacion == 'no_aplica' else '' }}> No Aplica
-            </div>
-          </div>
-        </div>
+        self._psycopg2 = psycopg2
+        self._dict_cursor = psycopg2.extras.RealDictCursor
+        self._execute_batch = psycopg2.extras.execute_batch
+        self._execute_values = psycopg2.extras.execute_values
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn, maxconn, dsn, connection_factory=PreparedConnection
+        )
+        # ThreadedConnectionPool falla en vez de esperar cuando se agota
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._local = threading.local()
+    
+    @contextmanager
+    def connection(self):
+        local = self._local
+        if getattr(local, 'conn', None) is not None:
+            # Uso anidado en el mismo hilo: compartir conexión y transacción
+            conn = local.conn
+            local.depth += 1
+            savepoint = f'anidado_{local.depth}'
+            with conn.cursor() as cur:
+                cur.execute(f'SAVEPOINT {savepoint}')
+            try:
+                yield conn
+            except BaseException:
+                if not conn.closed:
+                    with conn.cursor() as cur:
+                        cur.execute(f'ROLLBACK TO SAVEPOINT {savepoint}')
+                        cur.execute(f'RELEASE SAVEPOINT {savepoint}')
+                raise
+            else:
+                with conn.cursor() as cur:
+                    cur.execute(f'RELEASE SAVEPOINT {savepoint}')
+            finally:
+                local.depth -= 1
+            return
         
-        <div class="row">
-          <div class="col-2">Lubricación de motores y otros. (solo si aplica)</div>
-          <div class="col">
-            <div class="aplica-group">
-              <input type="radio" name="mantenimiento_lubricacion_motores" value="aplica" {{ 'checked' if form_data.mantenimiento_lubricacion_motores == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_lubricacion_motores" value="no_aplica" {{ 'checked' if form_data.mantenimiento_lubricacion_motores == 'no_aplica' else '' }}> No Aplica
-            </div>
-          </div>
-        </div>
+        with tracer.span('db_connection', SPAN_KIND_CLIENT, {'db.system': 'postgresql'}):
+            self._slots.acquire()
+            conn = self._pool.getconn()
+            local.conn, local.depth = conn, 0
+            try:
+                yield conn
+                conn.commit()
+            except BaseException as e:
+                # Como en ConnectionPool.connection: nunca devolver una transacción abierta
+                if not conn.closed:
+                    conn.rollback()
+                logger.error(f"Error en transacción PostgreSQL: {str(e)}")
+                raise
+            finally:
+                local.conn = None
+                self._pool.putconn(conn, close=bool(conn.closed))
+                self._slots.release()
+    
+    def _execute(self, cursor, name, sql, params=()):
+        """EXECUTE de una sentencia preparada; sql usa $1, $2... como parámetros"""
+        conn = cursor.connection
+        if name not in conn.prepared:
+            cursor.execute(f'PREPARE {name} AS {sql}')
+            conn.prepared.add(name)
+        if params:
+            cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", list(params))
+        else:
+            cursor.execute(f'EXECUTE {name}')
+    
+    def _execute_many(self, cursor, name, sql, rows):
+        """_execute para muchas filas: execute_batch agrupa los EXECUTE en pocos viajes al servidor"""
+        conn = cursor.connection
+        if name not in conn.prepared:
+            cursor.execute(f'PREPARE {name} AS {sql}')
+            conn.prepared.add(name)
+        self._execute_batch(cursor, f"EXECUTE {name} ({', '.join(['%s'] * len(rows[0]))})", rows)
+    
+    @staticmethod
+    def _statement_name(prefix, columns):
+        return f"{prefix}_{zlib.crc32(','.join(columns).encode()):08x}"
+    
+    def migrate(self):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (PG_MIGRATION_LOCK,))
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    nombre TEXT NOT NULL,
+                    applied_at TEXT NOT NULL
+                )
+            ''')
+            cur.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+            current = cur.fetchone()[0]
+            for version, nombre, statements in PG_MIGRATIONS:
+                if version <= current:
+                    continue
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute(
+                    'INSERT INTO schema_version (version, nombre, applied_at) VALUES (%s, %s, %s)',
+                    (version, nombre, datetime.now().isoformat())
+                )
+                logger.info(f"Migración PostgreSQL {version:03d} aplicada: {nombre}")
+    
+    @timed_stage('db_insert')
+    @traced('INSERT informes', SPAN_KIND_CLIENT)
+    def insert_informe(self, values, checklist=(), piezas=()):
+        columns = list(values)
+        placeholders = ', '.join(f'${i}' for i in range(1, len(columns) + 1))
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute(
+                cur,
+                self._statement_name('informes_insert', columns),
+                f"INSERT INTO informes ({', '.join(columns)}) VALUES ({placeholders}) RETURNING id",
+                [values[c] for c in columns]
+            )
+            informe_id = cur.fetchone()[0]
+            if checklist:
+                self._execute_many(
+                    cur, 'checklist_insert',
+                    'INSERT INTO informe_checklist (informe_id, item, valor) VALUES ($1, $2, $3)',
+                    [(informe_id, item, valor) for item, valor in checklist]
+                )
+            if piezas:
+                self._execute_many(
+                    cur, 'piezas_insert',
+                    'INSERT INTO informe_piezas (informe_id, orden, descripcion, cantidad) VALUES ($1, $2, $3, $4)',
+                    [(informe_id, orden, *pieza) for orden, pieza in enumerate(piezas, 1)]
+                )
+            return informe_id
+    
+    @timed_stage('db_insert')
+    @traced('INSERT informes', SPAN_KIND_CLIENT)
+    def insert_informes(self, ordenes):
+        columns = list(ordenes[0][0])
+        with self.connection() as conn, conn.cursor() as cur:
+            # Los ids se reservan antes: RETURNING de un INSERT de muchas filas
+            # no garantiza el orden, y así cada tabla va en un solo INSERT por página
+            self._execute(
+                cur, 'informes_reservar_ids',
+                "SELECT nextval(pg_get_serial_sequence('informes', 'id')) FROM generate_series(1, $1)",
+                (len(ordenes),)
+            )
+            ids = [row[0] for row in cur.fetchall()]
+            self._execute_values(
+                cur, f"INSERT INTO informes (id, {', '.join(columns)}) VALUES %s",
+                [(informe_id, *(values[c] for c in columns)) for informe_id, (values, _, _) in zip(ids, ordenes)],
+                page_size=1000
+            )
+            checklist_rows = [
+                (informe_id, item, valor)
+                for informe_id, (_, checklist, _) in zip(ids, ordenes) for item, valor in checklist
+            ]
+            if checklist_rows:
+                self._execute_values(
+                    cur, 'INSERT INTO informe_checklist (informe_id, item, valor) VALUES %s',
+                    checklist_rows, page_size=1000
+                )
+            piezas_rows = [
+                (informe_id, orden, *pieza)
+                for informe_id, (_, _, piezas) in zip(ids, ordenes) for orden, pieza in enumerate(piezas, 1)
+            ]
+            if piezas_rows:
+                self._execute_values(
+                    cur, 'INSERT INTO informe_piezas (informe_id, orden, descripcion, cantidad) VALUES %s',
+                    piezas_rows, page_size=1000
+                )
+            return ids
+    
+    def list_informes(self, before_id=None, limit=25):
+        with self.connection() as conn, conn.cursor(cursor_factory=self._dict_cursor) as cur:
+            # Dos sentencias separadas para que ambas usen el índice de la PK
+            if before_id is None:
+                self._execute(
+                    cur, 'informes_list_first',
+                    f'SELECT {LIST_COLUMNS} FROM informes ORDER BY id DESC LIMIT $1', (limit,)
+                )
+            else:
+                self._execute(
+                    cur, 'informes_list_before',
+                    f'SELECT {LIST_COLUMNS} FROM informes WHERE id < $1 ORDER BY id DESC LIMIT $2',
+                    (before_id, limit)
+                )
+            return cur.fetchall()
+    
+    def get_informe(self, informe_id):
+        with self.connection() as conn, conn.cursor(cursor_factory=self._dict_cursor) as cur:
+            self._execute(cur, 'informes_get', 'SELECT * FROM informes WHERE id = $1', (informe_id,))
+            row = cur.fetchone()
+        return self.with_detalles([row])[0] if row else None
+    
+    def ids_por_idempotency_key(self, keys):
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute(
+                cur, 'informes_por_idempotency_key',
+                'SELECT idempotency_key, id FROM informes WHERE idempotency_key = ANY($1::text[])',
+                (list(keys),)
+            )
+            return dict(cur.fetchall())
+    
+    def get_detalles(self, ids):
+        detalles = {informe_id: {'checklist': {}, 'piezas': []} for informe_id in ids}
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute(
+                cur, 'checklist_get',
+                'SELECT informe_id, item, valor FROM informe_checklist WHERE informe_id = ANY($1::bigint[])',
+                (list(ids),)
+            )
+            for informe_id, item, valor in cur.fetchall():
+                detalles[informe_id]['checklist'][item] = valor
+            self._execute(
+                cur, 'piezas_get',
+                'SELECT informe_id, descripcion, cantidad FROM informe_piezas '
+                'WHERE informe_id = ANY($1::bigint[]) ORDER BY informe_id, orden',
+                (list(ids),)
+            )
+            for informe_id, descripcion, cantidad in cur.fetchall():
+                detalles[informe_id]['piezas'].append((descripcion, cantidad))
+        return detalles
+    
+    def conteo_checklist(self, item, valor=CHECK_SI):
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute(
+                cur, 'checklist_conteo',
+                '''SELECT i.marca_modelo, COUNT(*) AS ordenes
+                   FROM informe_checklist c JOIN informes i ON i.id = c.informe_id
+                   WHERE c.item = $1 AND c.valor = $2
+                   GROUP BY i.marca_modelo
+                   ORDER BY ordenes DESC''',
+                (item, valor)
+            )
+            return cur.fetchall()
+    
+    def export_informes(self, filters, after_id=0, limit=500, columns=EXPORT_COLUMNS):
+        names = list(filters)
+        where = ''.join(f' AND {EXPORT_FILTERS[name]} ${i}' for i, name in enumerate(names, 2))
+        with self.connection() as conn, conn.cursor(cursor_factory=self._dict_cursor) as cur:
+            self._execute(
+                cur,
+                self._statement_name('informes_export', [columns, *names]),
+                f'SELECT {columns} FROM informes WHERE id > $1{where} ORDER BY id LIMIT ${len(names) + 2}',
+                [after_id, *filters.values(), limit]
+            )
+            return cur.fetchall()
+    
+    def count_informes(self, filters, after_id=0):
+        names = list(filters)
+        where = ''.join(f' AND {EXPORT_FILTERS[name]} ${i}' for i, name in enumerate(names, 2))
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute(
+                cur,
+                self._statement_name('informes_count', names),
+                f'SELECT COUNT(*) FROM informes WHERE id > $1{where}',
+                [after_id, *filters.values()]
+            )
+            return cur.fetchone()[0]
+    
+    def search_informes(self, terms, limit=25, offset=0):
+        query = ' & '.join(f'{term}:*' for term in terms)
+        with self.connection() as conn, conn.cursor(cursor_factory=self._dict_cursor) as cur:
+            self._execute(
+                cur, 'informes_search',
+                f'''WITH candidatos AS (
+                       SELECT id, ts_rank_cd(busqueda, q) AS rank
+                       FROM informes, to_tsquery('simple', $1) AS q
+                       WHERE busqueda @@ q
+                       ORDER BY id DESC LIMIT $2
+                   )
+                   SELECT {', '.join('i.' + c.strip() for c in LIST_COLUMNS.split(','))},
+                          i.problema_cliente, i.detalles_servicio
+                   FROM candidatos JOIN informes i ON i.id = candidatos.id
+                   ORDER BY candidatos.rank DESC, i.id DESC
+                   LIMIT $3 OFFSET $4''',
+                (query, config.SEARCH_CANDIDATES, limit, offset)
+            )
+            return cur.fetchall()
+    
+    def update_informe(self, informe_id, **fields):
+        self._update('informes', informe_id, fields)
+    
+    def _update(self, table, row_id, fields):
+        columns = list(fields)
+        assignments = ', '.join(f'{name} = ${i}' for i, name in enumerate(columns, 1))
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute(
+                cur,
+                self._statement_name(f'{table}_update', columns),
+                f'UPDATE {table} SET {assignments} WHERE id = ${len(columns) + 1}',
+                [*fields.values(), row_id]
+            )
+    
+    @contextmanager
+    def transaction(self, immediate=False):
+        # Los claim bloquean sólo sus filas (FOR UPDATE SKIP LOCKED): immediate no hace falta
+        with self.connection() as conn:
+            yield conn
+    
+    def enqueue_jobs(self, informe_ids, tipo, traceparent=None):
+        if not informe_ids:
+            return
+        now = datetime.now().isoformat()
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute_values(
+                cur, 'INSERT INTO jobs (informe_id, tipo, estado, created_at, updated_at, traceparent) VALUES %s',
+                [(informe_id, tipo, 'queued', now, now, traceparent) for informe_id in informe_ids],
+                page_size=1000
+            )
+    
+    def jobs_abandonados(self, stale):
+        with self.connection() as conn, conn.cursor(cursor_factory=self._dict_cursor) as cur:
+            self._execute(
+                cur, 'jobs_abandonados',
+                "SELECT id, informe_id, tipo, intentos FROM jobs WHERE estado = 'running' AND updated_at < $1 "
+                "FOR UPDATE SKIP LOCKED",
+                (stale,)
+            )
+            return cur.fetchall()
+    
+    def claim_job(self):
+        with self.connection() as conn, conn.cursor(cursor_factory=self._dict_cursor) as cur:
+            self._execute(
+                cur, 'jobs_claim',
+                '''UPDATE jobs SET estado = 'running', intentos = intentos + 1, updated_at = $1
+                   WHERE id = (
+                       SELECT id FROM jobs WHERE estado = 'queued' AND next_attempt_at <= $2
+                       ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED
+                   )
+                   RETURNING id, informe_id, tipo, intentos, traceparent''',
+                (datetime.now().isoformat(), time.time())
+            )
+            return cur.fetchone()
+    
+    def touch_jobs(self, ids):
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute(
+                cur, 'jobs_touch',
+                "UPDATE jobs SET updated_at = $1 WHERE estado = 'running' AND id = ANY($2::bigint[])",
+                (datetime.now().isoformat(), list(ids))
+            )
+    
+    def update_job(self, job_id, **fields):
+        self._update('jobs', job_id, fields)
+    
+    def enqueue_email(self, informe_id, destinatario, asunto, cuerpo, adjunto_path, traceparent=None):
+        now = datetime.now().isoformat()
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute(
+                cur, 'outbox_insert',
+                '''INSERT INTO outbox (informe_id, destinatario, asunto, cuerpo, adjunto_path, estado,
+                                        next_attempt_at, created_at, updated_at, traceparent)
+                   VALUES ($1, $2, $3, $4, $5, 'queued', 0, $6, $6, $7)''',
+                (informe_id, destinatario, asunto, cuerpo, adjunto_path, now, traceparent)
+            )
+    
+    def claim_emails(self, stale, limit):
+        with self.connection() as conn, conn.cursor(cursor_factory=self._dict_cursor) as cur:
+            self._execute(
+                cur, 'outbox_recuperar',
+                "UPDATE outbox SET estado = 'queued' WHERE estado = 'sending' AND updated_at < $1",
+                (stale,)
+            )
+            self._execute(
+                cur, 'outbox_claim',
+                '''UPDATE outbox SET estado = 'sending', intentos = intentos + 1, updated_at = $1
+                   WHERE id IN (
+                       SELECT id FROM outbox WHERE estado = 'queued' AND next_attempt_at <= $2
+                       ORDER BY id LIMIT $3 FOR UPDATE SKIP LOCKED
+                   )
+                   RETURNING *''',
+                (datetime.now().isoformat(), time.time(), limit)
+            )
+            return sorted(cur.fetchall(), key=lambda row: row['id'])
+    
+    def update_email(self, email_id, **fields):
+        self._update('outbox', email_id, fields)
+    
+    def release_emails(self, ids):
+        with self.connection() as conn, conn.cursor() as cur:
+            self._execute(
+                cur, 'outbox_release',
+                "UPDATE outbox SET estado = 'queued', intentos = intentos - 1 WHERE id = ANY($1::bigint[])",
+                (list(ids),)
+            )
+    
+    def queue_depth(self):
+        depth = {(table, estado): 0 for table, estados in QUEUE_ESTADOS for estado in estados}
+        with self.connection() as conn, conn.cursor() as cur:
+            for table, estados in QUEUE_ESTADOS:
+                self._execute(
+                    cur, f'{table}_depth',
+                    f'SELECT estado, COUNT(*) FROM {table} WHERE estado = ANY($1::text[]) GROUP BY estado',
+                    (list(estados),)
+                )
+                for estado, count in cur.fetchall():
+                    depth[(table, estado)] = count
+        return depth
+    
+    def ping(self):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute('SELECT 1')
+            cur.fetchone()
+
+def pagina_informes(before_id=None, page_size=None):
+    """Una página del listado y el cursor de la siguiente (None si no hay más)"""
+    page_size = min(max(page_size or config.PAGE_SIZE, 1), config.MAX_PAGE_SIZE)
+    rows = storage.list_informes(before_id, page_size + 1)
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, rows[-1]['id']
+    return rows, None
+
+def terminos_busqueda(texto, max_terms=8):
+    """Normalizar la consulta: minúsculas, sin tildes, sólo palabras"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(ch for ch in texto if not unicodedata.combining(ch)).lower()
+    return re.findall(r'\w+', texto)[:max_terms]
+
+def fragmento_busqueda(row, terms, window=6):
+    """Extracto del texto libre alrededor de la primera coincidencia, con [marcas]"""
+    words = f"{row['problema_cliente'] or ''} {row['detalles_servicio'] or ''}".split()
+    hits = [i for i, word in enumerate(words) if any(t.startswith(term) for t in terminos_busqueda(word) for term in terms)]
+    if not hits:
+        return ''
+    start = max(hits[0] - window, 0)
+    excerpt = [f'[{w}]' if i in hits else w for i, w in enumerate(words[start:hits[0] + window], start)]
+    return ('… ' if start else '') + ' '.join(excerpt) + (' …' if hits[0] + window < len(words) else '')
+
+def create_storage(database_url):
+    """Elegir el backend según DATABASE_URL"""
+    if database_url.startswith(('postgres://', 'postgresql://')):
+        logger.info("🗄️ Informes en PostgreSQL")
+        return PostgresStorage(database_url, config.PG_POOL_MIN, config.PG_POOL_MAX)
+    return SQLiteStorage()
+
+# Inicializar base de datos
+init_db()
+storage = create_storage(config.DATABASE_URL)
+storage.migrate()
+
+# --- Archivos: disco local o almacenamiento de objetos S3 ---
+class BlobStore(ABC):
+    """PDF y firmas por clave, con la misma interfaz en disco o en S3.
+    
+    En la BD se guarda la referencia que devuelve ref(key): en disco es la
+    ruta del archivo (como hasta ahora), en S3 es s3://bucket/clave.
+    """
+    
+    @abstractmethod
+    def ref(self, key):
+        ...
+    
+    @abstractmethod
+    def put(self, key, data):
+        """Guardar bytes bajo key y devolver su referencia"""
+    
+    @abstractmethod
+    def staged(self, key):
+        """Context manager con una ruta local donde escribir; al salir sin error se publica en key"""
+    
+    @abstractmethod
+    def stat(self, ref):
+        """(tamaño, mtime) o None si no existe"""
+    
+    def exists(self, ref):
+        return bool(ref) and self.stat(ref) is not None
+    
+    @abstractmethod
+    def read(self, ref, start=0, end=None):
+        """Bytes [start, end) del archivo; FileNotFoundError si no existe"""
+    
+    @abstractmethod
+    def iter_chunks(self, ref, chunk_size):
+        ...
+    
+    def download_url(self, ref, filename):
+        """URL firmada para descargar directo del almacén; None si no aplica"""
+        return None
+    
+    def ping(self):
+        pass
+
+def iter_file(path, chunk_size):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    for chunk in iter_file(path, 64 * 1024):
+        h.update(chunk)
+    return h.hexdigest()
+
+def write_atomic(path, data):
+    """Escribir a un temporal y renombrar: un lector nunca ve el archivo a medias"""
+    tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class LocalBlobStore(BlobStore):
+    """Archivos bajo un directorio local; la referencia es la ruta"""
+    
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+    
+    def ref(self, key):
+        return os.path.join(self.root, key)
+    
+    def put(self, key, data):
+        path = self.ref(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, data)
+        return path
+    
+    @contextmanager
+    def staged(self, key):
+        path = self.ref(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
+        try:
+            yield tmp_path
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def stat(self, ref):
+        try:
+            st = os.stat(ref)
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime
+    
+    def read(self, ref, start=0, end=None):
+        with open(ref, 'rb') as f:
+            f.seek(start)
+            return f.read() if end is None else f.read(end - start)
+    
+    def iter_chunks(self, ref, chunk_size):
+        return iter_file(ref, chunk_size)
+
+class S3BlobStore(BlobStore):
+    """Objetos en un bucket S3 compatible (AWS, MinIO, R2...) bajo un prefijo.
+    
+    Los archivos se suben en streaming desde disco, en partes (multipart) de
+    S3_MULTIPART_MB cuando lo superan, y /download redirige a una URL firmada
+    en vez de pasar el PDF por la aplicación. Una referencia antigua con ruta
+    local se traduce a la misma clave relativa a local_root, así que basta
+    copiar los archivos existentes al bucket (aws s3 sync).
+    """
+    
+    def __init__(self, bucket, prefix, local_root):
+        import boto3
+        import botocore.config
+        import botocore.exceptions
+        from boto3.s3.transfer import TransferConfig
         
-        <div class="row">
-          <div class="col-2">Calibración de los ejes axiales y motores. (solo si aplica)</div>
-          <div class="col">
-            <div class="aplica-group">
-              <input type="radio" name="mantenimiento_calibracion_ejes" value="aplica" {{ 'checked' if form_data.mantenimiento_calibracion_ejes == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_calibracion_ejes" value="no_aplica" {{ 'checked' if form_data.mantenimiento_calibracion_ejes == 'no_aplica' else '' }}> No Aplica
-            </div>
-          </div>
-        </div>
+        self.bucket = bucket
+        self.prefix = prefix
+        self.local_root = local_root
+        self._boto3 = boto3
+        self._client_error = botocore.exceptions.ClientError
+        # MinIO y similares sirven los buckets por ruta, no por subdominio
+        self._client_config = botocore.config.Config(
+            signature_version='s3v4',
+            s3={'addressing_style': 'path' if config.S3_ENDPOINT_URL else 'auto'},
+        )
+        part_size = config.S3_MULTIPART_MB * 1024 * 1024
+        self._transfer = TransferConfig(
+            multipart_threshold=part_size, multipart_chunksize=part_size, use_threads=False
+        )
+        self._client = None
+        self._pid = None
+    
+    @property
+    def client(self):
+        # Un cliente por proceso: no se comparte a través de fork (gunicorn, CLI)
+        if self._pid != os.getpid():
+            self._client = self._boto3.session.Session().client(
+                's3',
+                endpoint_url=config.S3_ENDPOINT_URL or None,
+                region_name=config.S3_REGION or None,
+                config=self._client_config,
+            )
+            self._pid = os.getpid()
+        return self._client
+    
+    def ref(self, key):
+        return f's3://{self.bucket}/{self.prefix}{key}'
+    
+    def object_key(self, ref):
+        if ref.startswith('s3://'):
+            return ref.split('/', 3)[3]
+        relative = os.path.relpath(ref, self.local_root)
+        if relative.startswith('..'):
+            relative = os.path.basename(ref)
+        return self.prefix + relative.replace(os.sep, '/')
+    
+    @staticmethod
+    def _content_type(key):
+        return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+    
+    def _missing(self, error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+    
+    def put(self, key, data):
+        self.client.put_object(
+            Bucket=self.bucket, Key=self.prefix + key, Body=data, ContentType=self._content_type(key)
+        )
+        return self.ref(key)
+    
+    @contextmanager
+    def staged(self, key):
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            yield tmp_path
+            with open(tmp_path, 'rb') as f:
+                self.client.upload_fileobj(
+                    f, self.bucket, self.prefix + key,
+                    ExtraArgs={'ContentType': self._content_type(key)},
+                    Config=self._transfer,
+                )
+        finally:
+            os.remove(tmp_path)
+    
+    def stat(self, ref):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.object_key(ref))
+        except self._client_error as e:
+            if self._missing(e):
+                return None
+            raise
+        return head['ContentLength'], head['LastModified'].timestamp()
+    
+    def _get(self, ref, **kwargs):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.object_key(ref), **kwargs)['Body']
+        except self._client_error as e:
+            if self._missing(e):
+                raise FileNotFoundError(ref)
+            raise
+    
+    def read(self, ref, start=0, end=None):
+        if start == 0 and end is None:
+            body = self._get(ref)
+        else:
+            body = self._get(ref, Range=f"bytes={start}-{'' if end is None else end - 1}")
+        with body:
+            return body.read()
+    
+    def iter_chunks(self, ref, chunk_size):
+        body = self._get(ref)
+        with body:
+            yield from body.iter_chunks(chunk_size)
+    
+    def download_url(self, ref, filename):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': self.bucket,
+                'Key': self.object_key(ref),
+                'ResponseContentDisposition': f'attachment; filename="{filename}"',
+            },
+            ExpiresIn=config.S3_PRESIGN_EXPIRES,
+        )
+    
+    def ping(self):
+        self.client.head_bucket(Bucket=self.bucket)
+
+def create_blob_store(storage_url, local_root, folder):
+    """Elegir dónde guardar los archivos según STORAGE_URL"""
+    if storage_url.startswith('s3://'):
+        bucket, _, prefix = storage_url[len('s3://'):].partition('/')
+        prefix = prefix.strip('/')
+        return S3BlobStore(bucket, f"{prefix}/{folder}/" if prefix else f"{folder}/", local_root)
+    return LocalBlobStore(local_root)
+
+if config.STORAGE_URL.startswith('s3://'):
+    logger.info(f"🗄️ Archivos en {config.STORAGE_URL}")
+pdf_store = create_blob_store(config.STORAGE_URL, config.PDF_DIR, 'pdfs')
+
+# --- Firmas: almacén direccionado por contenido ---
+class SignatureStore:
+    """Guarda cada firma una sola vez, con nombre = hash de sus píxeles.
+    
+    Un técnico firma de forma casi idéntica en cientos de órdenes: todas
+    apuntan al mismo archivo firmas/ab/abcd....png. Se guarda la firma ya
+    normalizada (ver normalize_signature) y el hash se calcula sobre sus
+    píxeles, de modo que dos PNG con distinta compresión comparten archivo.
+    Las firmas vectoriales (trazos) se guardan igual, como .json canónico.
+    
+    put() no toca el almacén en la petición: deja los bytes en memoria y un
+    hilo de fondo los escribe. Mientras tanto get() los sirve desde memoria,
+    así que el render de la orden nunca espera a la escritura. Si el almacén
+    falla, el hilo reintenta con backoff; lo que siga sin guardarse se
+    escribe en flush(), que también corre al terminar el proceso.
+    """
+    
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self._pending = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pid = None
+    
+    @staticmethod
+    def prepare(data):
+        """(hash, PNG compacto) de la firma normalizada; None si está en blanco"""
+        try:
+            with Image.open(BytesIO(data)) as img:
+                if img.format != 'PNG':
+                    raise ValueError("Formato de imagen no válido")
+                img = normalize_signature(img)
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Imagen de firma no válida: {str(e)}")
         
-        <div class="row">
-          <div class="col-2">Calibración de software. (solo si aplica)</div>
-          <div class="col">
-            <div class="aplica-group">
-              <input type="radio" name="mantenimiento_calibracion_software" value="aplica" {{ 'checked' if form_data.mantenimiento_calibracion_software == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_calibracion_software" value="no_aplica" {{ 'checked' if form_data.mantenimiento_calibracion_software == 'no_aplica' else '' }}> No Aplica
-            </div>
-          </div>
-        </div>
+        if img is None:
+            return None
+        h = hashlib.sha256(f"{img.mode}:{img.width}x{img.height}:".encode())
+        h.update(img.tobytes())
+        out = BytesIO()
+        img.save(out, 'PNG', optimize=True)
+        return h.hexdigest(), out.getvalue()
+    
+    @staticmethod
+    def prepare_strokes(text):
+        """(hash, JSON canónico) de una firma vectorial; None si no tiene trazos"""
+        canonical = parse_signature_strokes(text)
+        if canonical is None:
+            return None
+        return hashlib.sha256(canonical).hexdigest(), canonical
+    
+    def key_for(self, digest, ext='.png'):
+        return f"{digest[:2]}/{digest}{ext}"
+    
+    def ensure_started(self):
+        """Arrancar el hilo escritor en este proceso (idempotente, seguro tras fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='signature-writer', daemon=True).start()
+            self._pid = os.getpid()
+    
+    def put(self, data):
+        """Registrar la firma PNG y devolver su referencia (None si está en blanco); la escritura es asíncrona"""
+        return self._put(self.prepare(data), '.png')
+    
+    def put_strokes(self, text):
+        """Registrar la firma vectorial y devolver su referencia (None si está en blanco)"""
+        return self._put(self.prepare_strokes(text), '.json')
+    
+    def _put(self, prepared, ext):
+        if prepared is None:
+            return None
+        digest, data = prepared
+        key = self.key_for(digest, ext)
+        ref = self.blobs.ref(key)
+        with self._lock:
+            if ref in self._pending:
+                return ref
+            self._pending[ref] = data
+        self.ensure_started()
+        self._queue.put(key)
+        return ref
+    
+    def get(self, ref):
+        """Bytes de la firma, desde memoria si aún no se ha escrito"""
+        deadline = time.monotonic() + config.SIGNATURE_WRITE_WAIT
+        while True:
+            with self._lock:
+                data = self._pending.get(ref)
+            if data is not None:
+                return data
+            try:
+                return self.blobs.read(ref)
+            except FileNotFoundError:
+                # Otro proceso gunicorn puede tener la escritura en curso
+                if not ref.startswith(self.blobs.ref('')) or time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+    
+    def flush(self):
+        """Esperar a que todas las firmas pendientes estén guardadas.
         
-        <div class="row">
-          <div class="col-2">Verificación de sistemas de seguridad. (solo si aplica)</div>
-          <div class="col">
-            <div class="aplica-group">
-              <input type="radio" name="mantenimiento_verificacion_seguridad" value="aplica" {{ 'checked' if form_data.mantenimiento_verificacion_seguridad == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_verificacion_seguridad" value="no_aplica" {{ 'checked' if form_data.mantenimiento_verificacion_seguridad == 'no_aplica' else '' }}> No Aplica
-            </div>
-          </div>
+        Las que el hilo no pudo guardar tras sus reintentos se escriben aquí,
+        de forma síncrona; devuelve cuántas siguen sin guardarse.
+        """
+        if self._pid == os.getpid():
+            self._queue.join()
+        with self._lock:
+            keys = self._failed | {self._key(ref) for ref in self._pending}
+            self._failed.clear()
+        return sum(not self._write(key, retries=1) for key in sorted(keys))
+    
+    def _key(self, ref):
+        return ref[len(self.blobs.ref('')):]
+    
+    def _write(self, key, retries=None):
+        """Guardar la firma pendiente con backoff; False si no se pudo"""
+        ref = self.blobs.ref(key)
+        with self._lock:
+            data = self._pending.get(ref)
+        if data is None:
+            return True
+        retries = config.SIGNATURE_WRITE_RETRIES if retries is None else retries
+        for intento in range(1, retries + 1):
+            try:
+                # Mismo nombre, mismo contenido: si ya existe no hay nada que subir
+                if not self.blobs.exists(ref):
+                    self.blobs.put(key, data)
+                    logger.info(f"Firma nueva almacenada: {key}")
+                break
+            except Exception as e:
+                logger.warning(f"Error guardando firma {ref} (intento {intento}/{retries}): {str(e)}")
+                if intento < retries:
+                    time.sleep(retry_delay(intento, config.SIGNATURE_RETRY_BASE, 30))
+        else:
+            # Sigue disponible en memoria para get(); flush() la vuelve a intentar
+            logger.error(f"Firma {ref} sin guardar tras {retries} intentos")
+            with self._lock:
+                self._failed.add(key)
+            return False
+        with self._lock:
+            self._pending.pop(ref, None)
+        return True
+    
+    def _run(self):
+        while True:
+            key = self._queue.get()
+            try:
+                self._write(key)
+            finally:
+                self._queue.task_done()
+
+signature_store = SignatureStore(create_blob_store(config.STORAGE_URL, config.SIGNATURES_DIR, 'firmas'))
+atexit.register(signature_store.flush)
+
+# --- Validaciones ---
+def es_email_valido(email):
+    """Validar formato de email"""
+    if not email:
+        return False
+    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+    return re.match(pattern, email.strip()) is not None
+
+@traced('validar_formulario')
+def validar_formulario(form):
+    """Validar datos del formulario según FORM_FIELDS"""
+    errors = []
+    
+    for field in FORM_FIELDS:
+        error = field.validate(field.clean(form))
+        if error:
+            errors.append(error)
+    
+    # Validar firmas (tamaño)
+    if form.get('sig_tech') and len(form['sig_tech']) > config.MAX_SIGNATURE_SIZE:
+        errors.append("La firma del técnico es demasiado grande")
+    
+    if form.get('sig_client') and len(form['sig_client']) > config.MAX_SIGNATURE_SIZE:
+        errors.append("La firma del cliente es demasiado grande")
+    
+    if len(piezas_del_formulario(form)) > PIEZAS_MAX:
+        errors.append(f"Se admiten hasta {PIEZAS_MAX} piezas de reemplazo por orden")
+    
+    return errors
+
+# --- Plantillas HTML ---
+# Se compilan una vez (entorno Jinja de la app, ver TEMPLATES); el CSS y el
+# JavaScript se sirven aparte como recursos estáticos con huella (/assets)
+INDEX_HTML = '''
+<!doctype html>
+<html lang="es">
+<head>
+  <meta charset="utf-8" />
+  <meta name="viewport" content="width=device-width, initial-scale=1" />
+  <title>Novamedical - Orden de Trabajo</title>
+  <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+  <link rel="manifest" href="{{ url_for('manifest') }}">
+  <meta name="theme-color" content="#3498db">
+  {% if asset_url('icon-192.png') %}<link rel="apple-touch-icon" href="{{ asset_url('icon-192.png') }}">{% endif %}
+</head>
+<body>
+  <div class="container">
+    <h2>📋 Novamedical - Orden de Trabajo de Servicio Técnico</h2>
+    
+    {% with messages = get_flashed_messages(with_categories=true) %}
+      {% if messages %}
+        <div class="messages">
+          {% for category, message in messages %}
+            <div class="{{ 'error' if category == 'error' else 'success' }}">{{ message }}</div>
+          {% endfor %}
         </div>
-        
+      {% endif %}
+    {% endwith %}
+    
+{# Controles generados desde FORM_FIELDS #}
+{% macro entrada(f) -%}
+  {%- set valor = form_data.get(f.name) or (today if f.kind == 'date' else '') -%}
+  {%- if f.kind == 'textarea' -%}
+  <textarea name="{{ f.name }}" placeholder="{{ f.placeholder }}" maxlength="{{ f.max_length }}"{% if f.required %} required{% endif %}>{{ valor }}</textarea>
+  {%- elif f.kind == 'select' -%}
+  <select name="{{ f.name }}"{% if f.required %} required{% endif %}>
+              <option value="">{{ f.placeholder }}</option>
+              {%- for value, text in f.choices %}
+              <option value="{{ value }}" {{ 'selected' if valor == value else '' }}>{{ text }}</option>
+              {%- endfor %}
+            </select>
+  {%- else -%}
+  <input name="{{ f.name }}"{% if f.kind == 'date' %} type="date"{% endif %} value="{{ valor }}" maxlength="{{ f.max_length }}"{% if f.required %} required{% endif %}{% if f.placeholder %} placeholder="{{ f.placeholder }}"{% endif %}>
+  {%- endif -%}
+{%- endmacro %}
+{% macro filas(section) -%}
+  {%- for fila in form_sections[section] %}
         <div class="row">
-          <div class="col-2">Verificación por filtraciones varias. (solo si aplica)</div>
+          {%- for f in fila %}
           <div class="col">
-            <div class="aplica-group">
-              <input type="radio" name="mantenimiento_verificacion_filtraciones" value="aplica" {{ 'checked' if form_data.mantenimiento_verificacion_filtraciones == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_verificacion_filtraciones" value="no_aplica" {{ 'checked' if form_data.mantenimiento_verificacion_filtraciones == 'no_aplica' else '' }}> No Aplica
-            </div>
+            <label{% if f.required %} class="required"{% endif %}>{{ f.label }}</label>
+            {{ entrada(f) }}
           </div>
+          {%- endfor %}
         </div>
-        
-        <div class="row">
-          <div class="col-2">Limpieza de unidad CPU. (solo si aplica)</div>
-          <div class="col">
-            <div class="aplica-group">
-              <input type="radio" name="mantenimiento_limpieza_cpu" value="aplica" {{ 'checked' if form_data.mantenimiento_limpieza_cpu == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_limpieza_cpu" value="no_aplica" {{ 'checked' if form_data.mantenimiento_limpieza_cpu == 'no_aplica' else '' }}> No Aplica
-            </div>
+  {%- endfor %}
+{%- endmacro %}
+    <!-- Órdenes guardadas en el dispositivo y resultado de su envío (ver cola.js) -->
+    <div id="cola-estado" class="cola-estado" hidden></div>
+    
+    <form method="post" action="/create" id="orden-form" onsubmit="return enviarOrden(event)">
+      
+      <!-- Sección: Información del Cliente -->
+      <div class="section">
+        <div class="section-title">🏢 Información del Cliente</div>
+        {{ filas('cliente') }}
+      </div>
+
+      <!-- Sección: Datos del Equipamiento -->
+      <div class="section">
+        <div class="section-title">🔧 Datos del Equipamiento</div>
+        {{ filas('equipo') }}
+      </div>
+
+      <!-- Sección: Motivo/Razón de la visita -->
+      <div class="section">
+        <div class="section-title">🎯 Motivo/Razón de la Visita</div>
+        <div class="checkbox-grid">
+          {% for item in checklist.servicio %}
+          <div class="checkbox-item">
+            <input type="checkbox" name="{{ item.key }}" value="si" {{ 'checked' if form_data.get(item.key) == 'si' else '' }}>
+            <label>{{ item.label }}</label>
           </div>
+          {% endfor %}
         </div>
-        
-        <div class="row">
-          <div class="col-2">Cambio de Kit de Filtro. (solo si aplica)</div>
-          <div class="col">
-            <div class="aplica-group">
-              <input type="radio" name="mantenimiento_cambio_filtro" value="aplica" {{ 'checked' if form_data.mantenimiento_cambio_filtro == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_cambio_filtro" value="no_aplica" {{ 'checked' if form_data.mantenimiento_cambio_filtro == 'no_aplica' else '' }}> No Aplica
-            </div>
+        {{ filas('servicio') }}
+      </div>
+
+      <!-- Sección: Tipo de garantía -->
+      <div class="section">
+        <div class="section-title">📄 Tipo de Garantía</div>
+        <div class="checkbox-group">
+          {% for item in checklist.garantia %}
+          <div class="checkbox-item">
+            <input type="radio" name="garantia" value="{{ item.option }}" {{ 'checked' if form_data.get('garantia') == item.option else '' }}>
+            <label>{{ item.label }}</label>
           </div>
+          {% endfor %}
         </div>
+      </div>
+
+      <!-- Sección: Problema reportado e inspección -->
+      <div class="section">
+        <div class="section-title">🔍 Problema Reportado e Inspección</div>
+        {{ filas('problema') }}
+      </div>
+
+      <!-- Sección: Descripción del Mantenimiento -->
+      <div class="section">
+        <div class="section-title">🛠️ Descripción del Mantenimiento</div>
         
         <div class="row">
-          <div class="col-2">Reteste de pernos, pasadores de motor, etc.</div>
-          <div class="col">
-            <div class="aplica-group">
-              <input type="radio" name="mantenimiento_reteste_pernos" value="aplica" {{ 'checked' if form_data.mantenimiento_reteste_pernos == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_reteste_pernos" value="no_aplica" {{ 'checked' if form_data.mantenimiento_reteste_pernos == 'no_aplica' else '' }}> No Aplica
-            </div>
-          </div>
+          <div class="col-2"><strong>Actividad</strong></div>
+          <div class="col"><strong>Aplica/No Aplica</strong></div>
         </div>
         
+        {% for item in checklist.mantenimiento if item.key != 'mantenimiento_otros' %}
         <div class="row">
-          <div class="col-2">Reseteo de contadores internos. (solo si aplica)</div>
+          <div class="col-2">{{ item.label }}</div>
           <div class="col">
             <div class="aplica-group">
-              <input type="radio" name="mantenimiento_reseteo_contadores" value="aplica" {{ 'checked' if form_data.mantenimiento_reseteo_contadores == 'aplica' else '' }}> Aplica
-              <input type="radio" name="mantenimiento_reseteo_contadores" value="no_aplica" {{ 'checked' if form_data.mantenimiento_reseteo_contadores == 'no_aplica' else '' }}> No Aplica
+              <input type="radio" name="{{ item.key }}" value="aplica" {{ 'checked' if form_data.get(item.key) == 'aplica' else '' }}> Aplica
+              <input type="radio" name="{{ item.key }}" value="no_aplica" {{ 'checked' if form_data.get(item.key) == 'no_aplica' else '' }}> No Aplica
             </div>
           </div>
         </div>
+        {% endfor %}
         
-        <!-- Fila 14 - Otros -->
+        <!-- Otros, con detalle -->
         <div class="row">
           <div class="col-2">
-            <strong>Otros (Especificar)</strong>
-            <input type="text" name="mantenimiento_otros_especificar" value="{{ form_data.mantenimiento_otros_especificar or '' }}" placeholder="Especificar otros trabajos...">
+            <strong>{{ fields.mantenimiento_otros_especificar.label }}</strong>
+            {{ entrada(fields.mantenimiento_otros_especificar) }}
           </div>
           <div class="col">
             <div class="aplica-group">
@@ -718,114 +2798,49 @@ INDEX_HTML = '''
       <!-- Sección: Mediciones -->
       <div class="section">
         <div class="section-title">📊 Mediciones de Tensión / T° / Presión</div>
-        <label>Parámetros de medición realizados</label>
-        <textarea name="mediciones_parametros" placeholder="Describa las mediciones realizadas...">{{ form_data.mediciones_parametros or '' }}</textarea>
+        {{ filas('mediciones') }}
       </div>
 
       <!-- Sección: Piezas de reemplazo -->
       <div class="section">
         <div class="section-title">🔩 Piezas de Reemplazo</div>
-        <div class="table-grid">
+        <div class="table-grid" id="piezas">
           <div class="table-header">Descripción de repuesto</div>
           <div class="table-header">Cantidad</div>
           <div class="table-header">Descripción de repuesto</div>
           <div class="table-header">Cantidad</div>
           
-          <input type="text" name="piezas_descripcion1" value="{{ form_data.piezas_descripcion1 or '' }}" placeholder="Descripción repuesto 1">
-          <input type="text" name="piezas_cantidad1" value="{{ form_data.piezas_cantidad1 or '' }}" placeholder="Cantidad">
-          <input type="text" name="piezas_descripcion2" value="{{ form_data.piezas_descripcion2 or '' }}" placeholder="Descripción repuesto 2">
-          <input type="text" name="piezas_cantidad2" value="{{ form_data.piezas_cantidad2 or '' }}" placeholder="Cantidad">
-          
-          <input type="text" name="piezas_descripcion3" value="{{ form_data.piezas_descripcion3 or '' }}" placeholder="Descripción repuesto 3">
-          <input type="text" name="piezas_cantidad3" value="{{ form_data.piezas_cantidad3 or '' }}" placeholder="Cantidad">
-          <input type="text" name="piezas_descripcion4" value="{{ form_data.piezas_descripcion4 or '' }}" placeholder="Descripción repuesto 4">
-          <input type="text" name="piezas_cantidad4" value="{{ form_data.piezas_cantidad4 or '' }}" placeholder="Cantidad">
+          {% for n in range(1, 5) %}
+          <input type="text" name="pieza_descripcion" placeholder="Descripción repuesto {{ n }}">
+          <input type="text" name="pieza_cantidad" placeholder="Cantidad">
+          {% endfor %}
         </div>
+        <button type="button" class="btn-add" onclick="addPieza()">➕ Agregar pieza</button>
       </div>
 
       <!-- Sección: Detalles del servicio -->
       <div class="section">
         <div class="section-title">📝 Detalles del Servicio u Observaciones</div>
-        <textarea name="detalles_servicio" placeholder="Describa detalles adicionales del servicio...">{{ form_data.detalles_servicio or '' }}</textarea>
+        {{ filas('detalles') }}
       </div>
 
       <!-- Sección: Resolución de los trabajos -->
       <div class="section">
         <div class="section-title">✅ Resolución de los Trabajos</div>
         <div class="checkbox-group">
+          {% for item in checklist.resolucion %}
           <div class="checkbox-item">
-            <input type="checkbox" name="resolucion_operativo" value="si" {{ 'checked' if 'resolucion_operativo' in form_data and form_data.resolucion_operativo == 'si' else '' }}>
-            <label>Equipo operativo</label>
-          </div>
-          <div class="checkbox-item">
-            <input type="checkbox" name="resolucion_no_operativo" value="si" {{ 'checked' if 'resolucion_no_operativo' in form_data and form_data.resolucion_no_operativo == 'si' else '' }}>
-            <label>Equipo no operativo</label>
-          </div>
-          <div class="checkbox-item">
-            <input type="checkbox" name="resolucion_requiere_visita" value="si" {{ 'checked' if 'resolucion_requiere_visita' in form_data and form_data.resolucion_requiere_visita == 'si' else '' }}>
-            <label>Requiere nueva visita técnica</label>
+            <input type="checkbox" name="{{ item.key }}" value="si" {{ 'checked' if form_data.get(item.key) == 'si' else '' }}>
+            <label>{{ item.label }}</label>
           </div>
+          {% endfor %}
         </div>
       </div>
 
       <!-- Sección: Encuesta de Servicio -->
       <div class="section">
         <div class="section-title">⭐ Encuesta de Servicio</div>
-        <div class="row">
-          <div class="col">
-            <label>¿Técnico se presentó correctamente en el servicio?</label>
-            <select name="encuesta_presentacion">
-              <option value="">Seleccionar</option>
-              <option value="si" {{ 'selected' if form_data.encuesta_presentacion == 'si' else '' }}>Sí</option>
-              <option value="no" {{ 'selected' if form_data.encuesta_presentacion == 'no' else '' }}>No</option>
-            </select>
-          </div>
-          <div class="col">
-            <label>¿Se realiza la reparación del equipamiento?</label>
-            <select name="encuesta_reparacion">
-              <option value="">Seleccionar</option>
-              <option value="si" {{ 'selected' if form_data.encuesta_reparacion == 'si' else '' }}>Sí</option>
-              <option value="no" {{ 'selected' if form_data.encuesta_reparacion == 'no' else '' }}>No</option>
-            </select>
-          </div>
-        </div>
-        <div class="row">
-          <div class="col">
-            <label>¿Técnico se encontraba preparado para la visita?</label>
-            <select name="encuesta_preparacion">
-              <option value="">Seleccionar</option>
-              <option value="si" {{ 'selected' if form_data.encuesta_preparacion == 'si' else '' }}>Sí</option>
-              <option value="no" {{ 'selected' if form_data.encuesta_preparacion == 'no' else '' }}>No</option>
-            </select>
-          </div>
-          <div class="col">
-            <label>¿La visita técnica fue realizada en los plazos estipulados?</label>
-            <select name="encuesta_plazos">
-              <option value="">Seleccionar</option>
-              <option value="si" {{ 'selected' if form_data.encuesta_plazos == 'si' else '' }}>Sí</option>
-              <option value="no" {{ 'selected' if form_data.encuesta_plazos == 'no' else '' }}>No</option>
-            </select>
-          </div>
-        </div>
-        <div class="row">
-          <div class="col">
-            <label>¿Qué nota le colocaría al servicio realizado? (de 1 a 10)</label>
-            <select name="encuesta_nota">
-              <option value="">Seleccionar nota</option>
-              {% for i in range(1, 11) %}
-                <option value="{{ i }}" {{ 'selected' if form_data.encuesta_nota == i|string else '' }}>{{ i }}</option>
-              {% endfor %}
-            </select>
-          </div>
-          <div class="col">
-            <label>¿Usted recomendaría nuestro servicio técnico?</label>
-            <select name="encuesta_recomendacion">
-              <option value="">Seleccionar</option>
-              <option value="si" {{ 'selected' if form_data.encuesta_recomendacion == 'si' else '' }}>Sí</option>
-              <option value="no" {{ 'selected' if form_data.encuesta_recomendacion == 'no' else '' }}>No</option>
-            </select>
-          </div>
-        </div>
+        {{ filas('encuesta') }}
       </div>
 
       <!-- Sección: Firmas -->
@@ -853,24 +2868,281 @@ INDEX_HTML = '''
     <hr>
     <div class="informes-list">
       <h3>📋 Órdenes de Trabajo Guardadas</h3>
-      <ul>
-        {% for r in records %}
-          <li>
-            <span>{{ r.institucion }} — {{ r.fecha }} — OT-{{ r.id }}</span>
-            <a href="/download/{{r.id}}">📥 Descargar PDF</a>
-          </li>
-        {% else %}
-          <li>No hay órdenes de trabajo guardadas</li>
-        {% endfor %}
-      </ul>
+      <form method="get" action="/" class="search-form">
+        <input name="q" value="{{ request.args.get('q', '') }}" placeholder="Buscar por institución, equipo, N° de serie, técnico o texto...">
+        <button type="submit">🔍 Buscar</button>
+      </form>
+      <form method="get" action="/export" class="search-form export-form">
+        <input name="institucion" placeholder="Institución">
+        <input name="tecnico" placeholder="Técnico">
+        <input name="desde" type="date" title="Desde">
+        <input name="hasta" type="date" title="Hasta">
+        <button type="submit">📦 Exportar ZIP</button>
+      </form>
+      <div id="ordenes">
+        {% include 'ordenes.html' %}
+      </div>
     </div>
   </div>
 
-<script>
-// JavaScript se mantiene igual
+<script src="{{ asset_url('cola.js') }}" defer></script>
+<script src="{{ asset_url('app.js') }}" defer></script>
+</body>
+</html>
+'''
+
+# Lista de órdenes: incluida en la página y servida sola en /ordenes
+ORDENES_HTML = '''
+<ul>
+  {% for r in records %}
+    <li>
+      <span>{{ r.institucion }} — {{ r.fecha }} — OT-{{ r.id }}
+        <span class="estado estado-{{ r.estado }}">{{ estados.get(r.estado, r.estado) }}</span>
+        {% if r.fragmento %}<br><small>{{ r.fragmento }}</small>{% endif %}</span>
+      {% if url_descarga(r) %}
+        <a href="{{ url_descarga(r) }}">📥 Descargar PDF</a>
+      {% endif %}
+    </li>
+  {% else %}
+    <li>No hay órdenes de trabajo guardadas</li>
+  {% endfor %}
+</ul>
+<div class="pagination">
+  {% if request.args.get('before') %}
+    <a href="{{ url_for('index', page_size=page_size) }}">⏮ Más recientes</a>
+  {% endif %}
+  {% if next_before %}
+    <a href="{{ url_for('index', before=next_before, page_size=page_size) }}">Más antiguas ⏭</a>
+  {% endif %}
+</div>
+'''
+
+INDEX_CSS = '''
+body {
+    font-family: Arial, sans-serif;
+    max-width: 1200px;
+    margin: 20px auto;
+    padding: 20px;
+    background: #f5f5f5;
+}
+.container {
+    background: white;
+    padding: 30px;
+    border-radius: 10px;
+    box-shadow: 0 2px10px rgba(0,0,0,0.1);
+}
+h2 {
+    color: #2c3e50;
+    border-bottom: 2px solid #3498db;
+    padding-bottom: 10px;
+    text-align: center;
+}
+.section {
+    margin-bottom: 25px;
+    padding: 20px;
+    border: 1px solid #ddd;
+    border-radius: 5px;
+    background: #fafafa;
+}
+.section-title {
+    font-weight: bold;
+    color: #2c3e50;
+    margin-bottom: 15px;
+    font-size: 1.1em;
+    border-bottom: 1px solid #bdc3c7;
+    padding-bottom: 5px;
+}
+label {
+    display: block;
+    margin-top: 12px;
+    font-weight: bold;
+    color: #34495e;
+}
+input, textarea, select {
+    width: 100%;
+    padding: 10px;
+    border: 1px solid #bdc3c7;
+    border-radius: 5px;
+    font-size: 14px;
+    box-sizing: border-box;
+}
+textarea {
+    min-height: 80px;
+    resize: vertical;
+}
+.sig {
+    border: 2px solid #7f8c8d;
+    height: 150px;
+    background: white;
+    cursor: crosshair;
+    border-radius: 5px;
+    margin-top: 5px;
+}
+.row {
+    display: flex;
+    gap: 20px;
+    margin-bottom: 15px;
+}
+.col {
+    flex: 1;
+}
+.col-2 { flex: 2; }
+.col-3 { flex: 3; }
+
+button {
+    padding: 12px 25px;
+    margin-top: 15px;
+    background: #3498db;
+    color: white;
+    border: none;
+    border-radius: 5px;
+    cursor: pointer;
+    font-size: 16px;
+    font-weight: bold;
+    transition: background 0.3s;
+}
+button:hover {
+    background: #2980b9;
+}
+.btn-clear {
+    background: #e74c3c;
+    padding: 8px 15px;
+    font-size: 14px;
+}
+.btn-clear:hover {
+    background: #c0392b;
+}
+.btn-add {
+    background: #27ae60;
+    padding: 8px 15px;
+    font-size: 14px;
+    margin-top: 10px;
+}
+.btn-add:hover {
+    background: #219150;
+}
+
+/* Estilos para tablas y checkboxes */
+.checkbox-grid {
+    display: grid;
+    grid-template-columns: 1fr 1fr;
+    gap: 15px;
+    margin-top: 10px;
+}
+.checkbox-item {
+    display: flex;
+    align-items: center;
+    gap: 8px;
+}
+.checkbox-group {
+    display: flex;
+    gap: 15px;
+    margin-top: 10px;
+}
+.aplica-group {
+    display: flex;
+    gap: 10px;
+    align-items: center;
+}
+.table-grid {
+    display: grid;
+    grid-template-columns: 2fr 1fr 2fr 1fr;
+    gap: 10px;
+    margin-top: 10px;
+}
+.table-header {
+    font-weight: bold;
+    background: #ecf0f1;
+    padding: 8px;
+    border-radius: 3px;
+}
+
+.error {
+    color: #e74c3c;
+    font-size: 0.9em;
+    margin-top: 5px;
+}
+.success {
+    color: #27ae60;
+    font-size: 0.9em;
+    margin-top: 5px;
+}
+.cola-estado {
+    background: white;
+    border-left: 4px solid #3498db;
+    padding: 10px 15px;
+    margin-bottom: 20px;
+}
+.cola-estado .pendiente {
+    color: #2471a3;
+    font-size: 0.9em;
+    margin-top: 5px;
+}
+.cola-estado .btn-add {
+    margin: 0 0 0 10px;
+    padding: 4px 10px;
+}
+.required:after {
+    content: " *";
+    color: #e74c3c;
+}
+.informes-list {
+    margin-top: 30px;
+}
+.informes-list li {
+    padding: 10px;
+    border-bottom: 1px solid #ecf0f1;
+    display: flex;
+    justify-content: space-between;
+    align-items: center;
+}
+.informes-list a {
+    color: #3498db;
+    text-decoration: none;
+    font-weight: bold;
+}
+.informes-list a:hover {
+    text-decoration: underline;
+}
+.search-form {
+    display: flex;
+    gap: 10px;
+    align-items: center;
+}
+.search-form button {
+    margin-top: 0;
+    white-space: nowrap;
+}
+.export-form {
+    margin-top: 10px;
+}
+.pagination {
+    display: flex;
+    justify-content: space-between;
+    margin-top: 15px;
+}
+.estado {
+    font-size: 0.8em;
+    padding: 2px 8px;
+    border-radius: 10px;
+    margin-left: 8px;
+    background: #ecf0f1;
+    color: #7f8c8d;
+}
+.estado-rendered { background: #d6eaf8; color: #2471a3; }
+.estado-registered { background: #eaecee; color: #566573; }
+.estado-sent { background: #d5f5e3; color: #1e8449; }
+.estado-failed { background: #fadbd8; color: #c0392b; }
+'''
+
+INDEX_JS = '''
+// Trazos de cada firma: listas planas [x0, y0, x1, y1, ...] en píxeles del canvas
+const sigStrokes = {};
+
 function initCanvas(id){
   const canvas = document.getElementById(id);
   const rect = canvas.getBoundingClientRect();
+  sigStrokes[id] = [];
   
   canvas.width = rect.width;
   canvas.height = rect.height;
@@ -894,6 +3166,7 @@ function initCanvas(id){
     [lastX, lastY] = [pos.x, pos.y];
     ctx.beginPath();
     ctx.moveTo(lastX, lastY);
+    sigStrokes[id].push([Math.round(pos.x), Math.round(pos.y)]);
   }
 
   function draw(e) {
@@ -902,9 +3175,16 @@ function initCanvas(id){
     ctx.lineTo(pos.x, pos.y);
     ctx.stroke();
     [lastX, lastY] = [pos.x, pos.y];
+    
+    const stroke = sigStrokes[id][sigStrokes[id].length - 1];
+    const x = Math.round(pos.x), y = Math.round(pos.y);
+    if (x !== stroke[stroke.length - 2] || y !== stroke[stroke.length - 1]) {
+      stroke.push(x, y);
+    }
   }
 
   function stopDrawing() {
+    if (isDrawing) guardarBorrador();
     isDrawing = false;
     ctx.closePath();
   }
@@ -952,67 +3232,737 @@ function clearSig(id){
   ctx.clearRect(0, 0, cvs.width, cvs.height);
   ctx.fillStyle = '#FFFFFF';
   ctx.fillRect(0, 0, cvs.width, cvs.height);
+  sigStrokes[id] = [];
+  guardarBorrador();
+}
+
+function drawStrokes(id){
+  const ctx = document.getElementById(id).getContext('2d');
+  for (const points of sigStrokes[id]) {
+    ctx.beginPath();
+    ctx.moveTo(points[0], points[1]);
+    for (let i = 2; i < points.length; i += 2) {
+      ctx.lineTo(points[i], points[i + 1]);
+    }
+    ctx.stroke();
+  }
+}
+
+// {"w", "h", "s"}: cada trazo con el primer punto absoluto y el resto como
+// diferencias con el anterior (números cortos); unos cientos de bytes en
+// lugar de un PNG en base64
+function encodeStrokes(id){
+  const canvas = document.getElementById(id);
+  const strokes = sigStrokes[id].map(points => {
+    const deltas = [points[0], points[1]];
+    for (let i = 2; i < points.length; i += 2) {
+      deltas.push(points[i] - points[i - 2], points[i + 1] - points[i - 1]);
+    }
+    return deltas;
+  });
+  return strokes.length ? JSON.stringify({w: canvas.width, h: canvas.height, s: strokes}) : '';
+}
+
+function decodeStrokes(encoded){
+  if (!encoded) return [];
+  return JSON.parse(encoded).s.map(deltas => {
+    const points = [deltas[0], deltas[1]];
+    for (let i = 2; i < deltas.length; i += 2) {
+      points.push(points[i - 2] + deltas[i], points[i - 1] + deltas[i + 1]);
+    }
+    return points;
+  });
+}
+
+// Piezas de reemplazo: sin tope, se agregan filas según se necesiten
+function addPieza(focus = true){
+  const grid = document.getElementById('piezas');
+  const n = grid.querySelectorAll('input[name="pieza_descripcion"]').length + 1;
+  const desc = document.createElement('input');
+  desc.type = 'text';
+  desc.name = 'pieza_descripcion';
+  desc.placeholder = 'Descripción repuesto ' + n;
+  const qty = document.createElement('input');
+  qty.type = 'text';
+  qty.name = 'pieza_cantidad';
+  qty.placeholder = 'Cantidad';
+  grid.append(desc, qty);
+  if (focus) desc.focus();
 }
 
 function prepareSignatures(){
   const tech = document.getElementById('sigTech');
   const client = document.getElementById('sigClient');
   
-  if(isCanvasBlank(tech) && isCanvasBlank(client)) {
+  if(!sigStrokes[tech.id].length && !sigStrokes[client.id].length) {
     if(!confirm('No se han capturado firmas. ¿Desea continuar sin firmas?')) {
       return false;
     }
   }
   
-  const tdata = tech.toDataURL('image/png');
-  const cdata = client.toDataURL('image/png');
-  document.getElementById('sig_tech_input').value = tdata;
-  document.getElementById('sig_client_input').value = cdata;
+  document.getElementById('sig_tech_input').value = encodeStrokes(tech.id);
+  document.getElementById('sig_client_input').value = encodeStrokes(client.id);
   
   return true;
 }
 
-function isCanvasBlank(canvas) {
-  const context = canvas.getContext('2d');
-  const pixelBuffer = new Uint32Array(
-    context.getImageData(0, 0, canvas.width, canvas.height).data.buffer
-  );
-  return !pixelBuffer.some(color => color !== 0);
+// Lista de órdenes: la búsqueda y la paginación piden sólo el fragmento
+// /ordenes en lugar de la página completa (sin JS los enlaces siguen funcionando)
+function loadOrdenes(query, push = true){
+  fetch('/ordenes' + query)
+    .then(r => r.ok ? r.text() : Promise.reject(r.status))
+    .then(html => {
+      document.getElementById('ordenes').innerHTML = html;
+      if (push) history.pushState(null, '', '/' + query);
+    })
+    .catch(() => { window.location = '/' + query; });
+}
+
+window.addEventListener('popstate', () => loadOrdenes(location.search, false));
+
+document.addEventListener('click', e => {
+  const link = e.target.closest('#ordenes .pagination a');
+  if (link) {
+    e.preventDefault();
+    loadOrdenes(new URL(link.href).search);
+  }
+});
+
+document.addEventListener('submit', e => {
+  if (e.target.matches('.search-form:not(.export-form)')) {
+    e.preventDefault();
+    loadOrdenes('?' + new URLSearchParams(new FormData(e.target)));
+  }
+});
+
+// --- Sin conexión: borrador local y cola de envío (ver cola.js) ---
+// El formulario se guarda en IndexedDB mientras se completa, y al enviarlo
+// la orden pasa a la cola y se manda a /api/ordenes; si no hay conexión,
+// el service worker (o la página al volver 'online') la reenvía después.
+
+function camposDelFormulario(form){
+  const campos = {};
+  for (const [name, value] of new FormData(form)) {
+    campos[name] = name in campos ? [].concat(campos[name], value) : value;
+  }
+  return campos;
+}
+
+function cargarCampos(form, campos){
+  form.reset();
+  const piezas = [].concat(campos.pieza_descripcion || []);
+  while (form.querySelectorAll('input[name="pieza_descripcion"]').length < piezas.length) {
+    addPieza(false);
+  }
+  for (const [name, value] of Object.entries(campos)) {
+    const values = [].concat(value);
+    form.querySelectorAll(`[name="${CSS.escape(name)}"]`).forEach((input, i) => {
+      if (input.type === 'checkbox' || input.type === 'radio') {
+        input.checked = values.includes(input.value);
+      } else if (input.type !== 'hidden' && i < values.length) {
+        input.value = values[i];
+      }
+    });
+  }
+}
+
+function cargarFirmas(firmas){
+  for (const id of ['sigTech', 'sigClient']) {
+    clearSig(id);
+    sigStrokes[id] = firmas[id] || [];
+    drawStrokes(id);
+  }
+}
+
+let borradorTimer = null;
+
+function guardarBorrador(){
+  if (!window.indexedDB) return;
+  clearTimeout(borradorTimer);
+  borradorTimer = setTimeout(() => {
+    const campos = camposDelFormulario(document.getElementById('orden-form'));
+    delete campos.sig_tech;
+    delete campos.sig_client;
+    const firmas = {sigTech: sigStrokes.sigTech, sigClient: sigStrokes.sigClient};
+    otStore('borrador', 'readwrite', s => s.put({campos, firmas, guardado: Date.now()}, 'actual')).catch(() => {});
+  }, 400);
+}
+
+function restaurarBorrador(){
+  return otStore('borrador', 'readonly', s => s.get('actual')).then(borrador => {
+    if (!borrador) return;
+    cargarCampos(document.getElementById('orden-form'), borrador.campos);
+    cargarFirmas(borrador.firmas);
+  }).catch(() => {});
+}
+
+function limpiarFormulario(form){
+  clearTimeout(borradorTimer);
+  form.reset();
+  for (const id of ['sigTech', 'sigClient']) {
+    clearSig(id);
+  }
+  clearTimeout(borradorTimer);
+  return otStore('borrador', 'readwrite', s => s.delete('actual')).catch(() => {});
+}
+
+function nuevaClave(){
+  if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+  return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
+function enviarOrden(event){
+  if (!prepareSignatures()) return false;
+  // Sin IndexedDB se envía el formulario como siempre
+  if (!window.indexedDB || !window.fetch) return true;
+  
+  event.preventDefault();
+  const form = event.target;
+  const orden = camposDelFormulario(form);
+  orden.idempotency_key = nuevaClave();
+  otEncolar({idempotency_key: orden.idempotency_key, orden, guardada: Date.now()})
+    .then(() => limpiarFormulario(form).then(sincronizar))
+    // IndexedDB no disponible (p. ej. navegación privada): envío normal
+    .catch(() => form.submit());
+  return false;
+}
+
+function sincronizar(){
+  return otEnviar()
+    .then(resultados => {
+      mostrarCola(resultados);
+      if (resultados.some(r => r.estado === 'created')) loadOrdenes(location.search, false);
+    })
+    .catch(() => {
+      // Sin conexión: el service worker reintenta con Background Sync, o la página al volver 'online'
+      if ('serviceWorker' in navigator && 'SyncManager' in window) {
+        navigator.serviceWorker.ready.then(reg => reg.sync.register(OT_SYNC_TAG)).catch(() => {});
+      }
+      mostrarCola();
+    });
+}
+
+function mostrarCola(resultados = []){
+  otPendientes().then(pendientes => {
+    const box = document.getElementById('cola-estado');
+    box.replaceChildren();
+    const linea = (texto, clase) => {
+      const div = document.createElement('div');
+      div.className = clase;
+      div.textContent = texto;
+      box.append(div);
+      return div;
+    };
+    
+    for (const r of resultados) {
+      if (r.estado === 'created') linea(`✅ Orden #${r.id} registrada. El PDF se generará en segundo plano.`, 'success');
+    }
+    const enEspera = pendientes.filter(p => !p.errores).length;
+    if (enEspera) {
+      linea(`📤 ${enEspera} orden(es) guardada(s) en este dispositivo; se enviarán al recuperar la conexión.`, 'pendiente');
+    }
+    for (const p of pendientes.filter(p => p.errores)) {
+      const div = linea(`⚠️ ${p.orden.institucion || 'Orden'} (${p.orden.fecha || ''}) rechazada: ${p.errores.join('; ')}`, 'error');
+      const boton = document.createElement('button');
+      boton.type = 'button';
+      boton.className = 'btn-add';
+      boton.textContent = '✏️ Corregir';
+      boton.onclick = () => corregirOrden(p);
+      div.append(boton);
+    }
+    box.hidden = !box.childElementCount;
+  }).catch(() => {});
+}
+
+// Volver a cargar en el formulario una orden rechazada y sacarla de la cola
+function corregirOrden(pendiente){
+  cargarCampos(document.getElementById('orden-form'), pendiente.orden);
+  cargarFirmas({sigTech: decodeStrokes(pendiente.orden.sig_tech), sigClient: decodeStrokes(pendiente.orden.sig_client)});
+  otQuitar(pendiente.idempotency_key).then(() => mostrarCola());
+  window.scrollTo(0, 0);
 }
 
 window.onload = function(){ 
   initCanvas('sigTech'); 
   initCanvas('sigClient'); 
+  
+  if (window.indexedDB) {
+    restaurarBorrador();
+    sincronizar();
+    const form = document.getElementById('orden-form');
+    form.addEventListener('input', guardarBorrador);
+    form.addEventListener('change', guardarBorrador);
+    window.addEventListener('online', sincronizar);
+  }
+  
+  if ('serviceWorker' in navigator) {
+    navigator.serviceWorker.register('/sw.js').catch(() => {});
+    navigator.serviceWorker.addEventListener('message', e => {
+      if (e.data && e.data.tipo === 'enviadas') {
+        mostrarCola(e.data.resultados);
+        loadOrdenes(location.search, false);
+      }
+    });
+  }
 }
-</script>
-</body>
-</html>
 '''
 
+# Órdenes pendientes en IndexedDB: lo cargan la página y el service worker
+# (importScripts), así que no toca el DOM
+COLA_JS = '''
+const OT_DB = 'novamedical-ot';
+const OT_SYNC_TAG = 'enviar-ordenes';
+const OT_LOTE = 50;
+
+function otDb(){
+  return new Promise((resolve, reject) => {
+    const req = indexedDB.open(OT_DB, 1);
+    req.onupgradeneeded = () => {
+      req.result.createObjectStore('borrador');
+      req.result.createObjectStore('pendientes', {keyPath: 'idempotency_key'});
+    };
+    req.onsuccess = () => resolve(req.result);
+    req.onerror = () => reject(req.error);
+  });
+}
+
+// fn(store) dentro de una transacción; devuelve el resultado de su solicitud
+function otStore(name, mode, fn){
+  return otDb().then(db => new Promise((resolve, reject) => {
+    const tx = db.transaction(name, mode);
+    const req = fn(tx.objectStore(name));
+    tx.oncomplete = () => { db.close(); resolve(req ? req.result : undefined); };
+    tx.onerror = () => { db.close(); reject(tx.error); };
+  }));
+}
+
+function otPendientes(){
+  return otStore('pendientes', 'readonly', s => s.getAll());
+}
+
+function otEncolar(pendiente){
+  return otStore('pendientes', 'readwrite', s => s.put(pendiente));
+}
+
+function otQuitar(key){
+  return otStore('pendientes', 'readwrite', s => s.delete(key));
+}
+
+// Enviar las pendientes a /api/ordenes, varias por solicitud. Las recibidas
+// (created o duplicate) salen de la cola; las rechazadas quedan con sus
+// errores para corregirlas; con 'error' o sin conexión se reintenta después.
+function otEnviar(){
+  return otPendientes().then(pendientes => {
+    const lote = pendientes.filter(p => !p.errores).slice(0, OT_LOTE);
+    if (!lote.length) return [];
+    return fetch('/api/ordenes', {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json'},
+      body: JSON.stringify({ordenes: lote.map(p => p.orden)}),
+    })
+      .then(r => r.ok ? r.json() : Promise.reject(new Error('HTTP ' + r.status)))
+      .then(data => Promise.all(data.resultados.map((resultado, i) => {
+        const pendiente = lote[i];
+        if (resultado.estado === 'created' || resultado.estado === 'duplicate') {
+          return otQuitar(pendiente.idempotency_key).then(() => resultado);
+        }
+        if (resultado.estado === 'invalid') {
+          pendiente.errores = resultado.errores;
+          return otEncolar(pendiente).then(() => resultado);
+        }
+        return resultado;
+      })))
+      .then(resultados => {
+        const avanzo = resultados.some(r => r.estado !== 'error');
+        return avanzo && pendientes.length > lote.length
+          ? otEnviar().then(resto => resultados.concat(resto))
+          : resultados;
+      });
+  });
+}
+'''
+
+# Service worker: guarda la página y sus recursos para abrirla sin conexión
+# y envía la cola de órdenes con Background Sync
+SW_JS = '''
+importScripts({{ cola_url|tojson }});
+
+const SHELL_CACHE = 'ot-shell-{{ version }}';
+const SHELL = {{ shell|tojson }};
+
+self.addEventListener('install', event => {
+  event.waitUntil(caches.open(SHELL_CACHE).then(cache => cache.addAll(SHELL)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys()
+      .then(keys => Promise.all(
+        keys.filter(k => k.startsWith('ot-shell-') && k !== SHELL_CACHE).map(k => caches.delete(k))
+      ))
+      .then(() => self.clients.claim())
+  );
+});
+
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (request.method !== 'GET' || url.origin !== self.location.origin) return;
+  
+  if (request.mode === 'navigate') {
+    // Red primero para tener la lista al día; sin conexión, la última página guardada
+    event.respondWith(
+      fetch(request)
+        .then(response => {
+          if (response.ok && url.pathname === '/' && !url.search) {
+            const copy = response.clone();
+            caches.open(SHELL_CACHE).then(cache => cache.put('/', copy));
+          }
+          return response;
+        })
+        .catch(() => caches.match('/'))
+    );
+  } else if (url.pathname.startsWith('/assets/')) {
+    // Con huella en el nombre: lo guardado nunca queda obsoleto
+    event.respondWith(caches.match(request).then(cached => cached || fetch(request)));
+  }
+});
+
+self.addEventListener('sync', event => {
+  if (event.tag !== OT_SYNC_TAG) return;
+  event.waitUntil(otEnviar().then(resultados =>
+    self.clients.matchAll().then(clients =>
+      clients.forEach(client => client.postMessage({tipo: 'enviadas', resultados}))
+    )
+  ));
+});
+'''
+
+TEMPLATES = {'index.html': INDEX_HTML, 'ordenes.html': ORDENES_HTML, 'sw.js': SW_JS}
+app.jinja_loader = DictLoader(TEMPLATES)
+
+# --- Recursos estáticos con huella ---
+# El nombre lleva el hash del contenido, así que cada versión es una URL
+# nueva y el navegador la guarda un año sin volver a preguntar. Se
+# comprimen una sola vez al arrancar (gzip y, si está instalado, brotli).
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+@dataclass(frozen=True)
+class StaticAsset:
+    filename: str   # p. ej. app.3f2a9c0d1b7e.css
+    mimetype: str
+    etag: str
+    bodies: dict    # {'br' | 'gzip' | 'identity': bytes}
+
+def build_asset(name, content, mimetype, compress=True):
+    body = content.encode('utf-8') if isinstance(content, str) else content
+    digest = hashlib.sha256(body).hexdigest()
+    bodies = {'identity': body}
+    if compress:
+        bodies['gzip'] = gzip.compress(body, 9, mtime=0)
+        try:
+            import brotli
+            bodies['br'] = brotli.compress(body, quality=11)
+        except ImportError:
+            pass
+    stem, ext = os.path.splitext(name)
+    return StaticAsset(f'{stem}.{digest[:12]}{ext}', mimetype, digest[:16], bodies)
+
+APP_LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'novamedical.png')
+
+def app_icon(size):
+    """Logo centrado sobre fondo blanco como icono cuadrado de la app instalada"""
+    icon = Image.new('RGB', (size, size), 'white')
+    with Image.open(APP_LOGO_PATH) as logo:
+        logo = logo.convert('RGBA')
+        scale = size * 0.8 / max(logo.size)
+        logo = logo.resize((round(logo.width * scale), round(logo.height * scale)), Image.LANCZOS)
+        icon.paste(logo, ((size - logo.width) // 2, (size - logo.height) // 2), logo)
+    out = BytesIO()
+    icon.save(out, 'PNG', optimize=True)
+    return out.getvalue()
+
+STATIC_ASSETS = {
+    'app.css': build_asset('app.css', INDEX_CSS, 'text/css'),
+    'app.js': build_asset('app.js', INDEX_JS, 'text/javascript'),
+    'cola.js': build_asset('cola.js', COLA_JS, 'text/javascript'),
+}
+try:
+    for size in (192, 512):
+        STATIC_ASSETS[f'icon-{size}.png'] = build_asset(f'icon-{size}.png', app_icon(size), 'image/png', compress=False)
+except OSError as e:
+    logger.warning(f"Íconos de la app no disponibles {APP_LOGO_PATH}: {str(e)}")
+_ASSETS_BY_FILENAME = {asset.filename: asset for asset in STATIC_ASSETS.values()}
+
+def asset_url(name):
+    """URL con huella del recurso, o None si no existe (p. ej. íconos sin logo)"""
+    if name not in STATIC_ASSETS:
+        return None
+    return url_for('asset', filename=STATIC_ASSETS[name].filename)
+
+@app.route('/assets/<filename>')
+def asset(filename):
+    """CSS/JS de la página, precomprimido según Accept-Encoding"""
+    static = _ASSETS_BY_FILENAME.get(filename)
+    if not static:
+        return Response('Recurso no encontrado', status=404, mimetype='text/plain')
+    
+    encoding = next(
+        (e for e in ('br', 'gzip') if e in static.bodies and request.accept_encodings[e]),
+        'identity'
+    )
+    rv = Response(static.bodies[encoding], mimetype=static.mimetype)
+    if encoding != 'identity':
+        rv.headers['Content-Encoding'] = encoding
+    rv.vary.add('Accept-Encoding')
+    rv.set_etag(f'{static.etag}-{encoding}')
+    rv.cache_control.public = True
+    rv.cache_control.max_age = ASSET_MAX_AGE
+    rv.cache_control.immutable = True
+    return rv.make_conditional(request)
+
+# --- App instalable (PWA) ---
+@app.route('/manifest.webmanifest')
+def manifest():
+    icons = [
+        {'src': asset_url(f'icon-{size}.png'), 'sizes': f'{size}x{size}', 'type': 'image/png'}
+        for size in (192, 512) if f'icon-{size}.png' in STATIC_ASSETS
+    ]
+    return Response(json.dumps({
+        'name': 'Novamedical - Orden de Trabajo',
+        'short_name': 'Novamedical OT',
+        'lang': 'es',
+        'start_url': url_for('index'),
+        'scope': '/',
+        'display': 'standalone',
+        'background_color': '#ecf0f1',
+        'theme_color': '#3498db',
+        'icons': icons,
+    }, ensure_ascii=False), mimetype='application/manifest+json')
+
+@app.route('/sw.js')
+def service_worker():
+    """Service worker en la raíz (su alcance es todo el sitio); sin caché para que se actualice en cada despliegue"""
+    shell = [url_for('index'), url_for('manifest')] + [asset_url(name) for name in STATIC_ASSETS]
+    rv = Response(render_template(
+        'sw.js',
+        cola_url=asset_url('cola.js'),
+        shell=shell,
+        version=hashlib.sha256(' '.join(shell).encode('utf-8')).hexdigest()[:12],
+    ), mimetype='text/javascript')
+    rv.cache_control.no_cache = True
+    return rv
+
+def render_pagina(template, **context):
+    """Renderizar una plantilla ya compilada con lo que comparten todas las vistas"""
+    return render_template(
+        template,
+        fields=FORM_FIELDS_BY_NAME,
+        form_sections=FORM_SECTIONS,
+        checklist=CHECKLIST_BY_GROUP,
+        estados=ESTADOS_ORDEN,
+        url_descarga=url_descarga,
+        asset_url=asset_url,
+        **context
+    )
+
+def lista_ordenes():
+    """Órdenes de la lista según ?q=, ?before= y ?page_size="""
+    terms = terminos_busqueda(request.args.get('q', ''))
+    if terms:
+        records = [
+            dict(r, fragmento=fragmento_busqueda(r, terms))
+            for r in storage.search_informes(terms, config.PAGE_SIZE)
+        ]
+        next_before = None
+    else:
+        records, next_before = pagina_informes(
+            request.args.get('before', type=int),
+            request.args.get('page_size', type=int)
+        )
+    return {'records': records, 'next_before': next_before, 'page_size': request.args.get('page_size', type=int)}
+
 # --- Routes Mejoradas ---
 @app.route('/')
 def index():
     """Página principal con lista de informes"""
     try:
-        with db_connection() as conn:
-            records = conn.execute(
-                'SELECT id, institucion, fecha, pdf_path FROM informes ORDER BY id DESC'
-            ).fetchall()
-        
-        today = datetime.now().strftime('%Y-%m-%d')
-        form_data = request.args.get('form_data', {})
-        
-        return render_template_string(
-            INDEX_HTML, 
-            records=records, 
-            today=today,
-            form_data=form_data
-        )
-    
+        ordenes = lista_ordenes()
     except Exception as e:
         logger.error(f"Error cargando página principal: {str(e)}")
         flash('Error cargando la página', 'error')
-        return render_template_string(INDEX_HTML, records=[], today=datetime.now().strftime('%Y-%m-%d'))
+        ordenes = {'records': [], 'next_before': None, 'page_size': None}
+    
+    return render_pagina(
+        'index.html',
+        today=datetime.now().strftime('%Y-%m-%d'),
+        form_data=request.args.get('form_data', {}),
+        **ordenes
+    )
+
+@app.route('/ordenes')
+def ordenes():
+    """Sólo la lista de órdenes (mismos parámetros que /), para buscar y paginar sin recargar"""
+    try:
+        return render_pagina('ordenes.html', **lista_ordenes())
+    except Exception as e:
+        logger.error(f"Error cargando lista de órdenes: {str(e)}")
+        return Response('Error cargando la lista', status=500, mimetype='text/plain')
+
+@app.route('/api/informes')
+def api_informes():
+    """Listado JSON paginado: ?before=<id>&limit=<n>"""
+    try:
+        records, next_before = pagina_informes(
+            request.args.get('before', type=int),
+            request.args.get('limit', type=int)
+        )
+        return {
+            'items': [
+                {key: r[key] for key in ('id', 'institucion', 'fecha', 'estado')}
+                | {'download_url': url_descarga(r)}
+                for r in records
+            ],
+            'next_before': next_before,
+        }
+    
+    except Exception as e:
+        logger.error(f"Error listando informes: {str(e)}")
+        return {'error': 'Error listando informes'}, 500
+
+@app.route('/api/informes/search')
+def api_informes_search():
+    """Búsqueda por institución, equipo, serie, técnico o texto: ?q=&limit=&offset="""
+    terms = terminos_busqueda(request.args.get('q', ''))
+    if not terms:
+        return {'error': 'Parámetro q requerido'}, 400
+    
+    limit = min(max(request.args.get('limit', config.PAGE_SIZE, type=int), 1), config.MAX_PAGE_SIZE)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    try:
+        started = time.perf_counter()
+        records = storage.search_informes(terms, limit, offset)
+        return {
+            'items': [
+                {key: r[key] for key in ('id', 'institucion', 'fecha', 'estado')}
+                | {'fragmento': fragmento_busqueda(r, terms)}
+                | {'download_url': url_descarga(r)}
+                for r in records
+            ],
+            'next_offset': offset + limit if len(records) == limit else None,
+            'took_ms': round((time.perf_counter() - started) * 1000, 2),
+        }
+    
+    except Exception as e:
+        logger.error(f"Error buscando informes: {str(e)}")
+        return {'error': 'Error en la búsqueda'}, 500
+
+@app.route('/api/estadisticas/checklist')
+def api_estadisticas_checklist():
+    """Órdenes por modelo con un ítem del checklist: ?item=mantenimiento_calibracion_ejes&valor=si|aplica|no_aplica"""
+    item = CHECKLIST_BY_KEY.get(request.args.get('item', ''))
+    if not item:
+        return {'error': 'Parámetro item no válido', 'items': list(CHECKLIST_BY_KEY)}, 400
+    valor = CHECK_NO_APLICA if request.args.get('valor') == 'no_aplica' else CHECK_SI
+    try:
+        return {
+            'item': item.key,
+            'valor': item.decode(valor),
+            'por_modelo': [
+                {'marca_modelo': marca_modelo, 'ordenes': ordenes}
+                for marca_modelo, ordenes in storage.conteo_checklist(item.code, valor)
+            ],
+        }
+
+    except Exception as e:
+        logger.error(f"Error en estadísticas de checklist: {str(e)}")
+        return {'error': 'Error en las estadísticas'}, 500
+
+@timed_stage('signature_decode')
+@traced('guardar_firma')
+def guardar_firma(dataurl):
+    """Guardar una firma en el almacén direccionado por contenido; devuelve su ruta o None"""
+    if not dataurl:
+        return None
+    tracer.current().set_attribute('firma.bytes', len(dataurl))
+    
+    # Trazos vectoriales (formulario actual) o PNG (clientes anteriores)
+    if dataurl.startswith('{'):
+        return signature_store.put_strokes(dataurl)
+    
+    if not dataurl.startswith('data:image/png;base64,'):
+        raise ValueError("Formato de imagen no válido")
+    
+    try:
+        header, b64 = dataurl.split(',', 1)
+        data = base64.b64decode(b64)
+    except Exception as e:
+        logger.error(f"Error decodificando firma: {str(e)}")
+        return None
+    
+    if len(data) > config.MAX_SIGNATURE_SIZE:
+        raise ValueError("Imagen de firma demasiado grande")
+    
+    return signature_store.put(data)
+
+def preparar_orden(form, idempotency_key=None):
+    """(informe, checklist, piezas) listos para insert_informe, con las firmas ya guardadas.
+    
+    Con PDF_LAZY y sin email que enviar no hay nada que renderizar ahora:
+    la orden queda 'registered' y el PDF se genera al descargarlo.
+    """
+    # Campos de texto; checklist y piezas van a sus tablas
+    informe = datos_del_formulario(form)
+    checklist = checklist_del_formulario(form)
+    piezas = piezas_del_formulario(form)
+    
+    informe['tecnico_firma'] = guardar_firma(form.get('sig_tech', ''))
+    informe['cliente_firma'] = guardar_firma(form.get('sig_client', ''))
+    informe['pdf_path'] = ''
+    informe['created_at'] = datetime.now().isoformat()
+    informe['estado'] = 'registered' if config.PDF_LAZY and not destinatario_para(informe) else 'pending'
+    if idempotency_key:
+        informe['idempotency_key'] = idempotency_key
+    return informe, checklist, piezas
+
+@traced('registrar_orden')
+def registrar_orden(form, idempotency_key=None):
+    """Guardar una orden ya validada y encolar su PDF.
+    
+    Devuelve (id, bajo_demanda), ver preparar_orden.
+    """
+    informe, checklist, piezas = preparar_orden(form, idempotency_key)
+    
+    via = 'api' if idempotency_key else 'formulario'
+    if informe['estado'] == 'registered':
+        orden_id = storage.insert_informe(informe, checklist, piezas)
+        ORDERS_CREATED.inc(via=via)
+        logger.info(f"Orden {orden_id} registrada (PDF bajo demanda)")
+        return orden_id, True
+    
+    with storage.transaction():
+        orden_id = storage.insert_informe(informe, checklist, piezas)
+        
+        # Encolar generación de PDF y envío en la misma transacción
+        enqueue_job(orden_id, 'render')
+    
+    ORDERS_CREATED.inc(via=via)
+    job_queue.notify()
+    logger.info(f"Orden {orden_id} registrada y encolada")
+    return orden_id, False
+
+@traced('registrar_ordenes')
+def registrar_ordenes(preparadas):
+    """Guardar un lote de órdenes de preparar_orden y encolar sus PDF en una
+    sola transacción; devuelve sus ids"""
+    with storage.transaction():
+        ids = storage.insert_informes(preparadas)
+        enqueue_jobs([
+            orden_id for orden_id, (informe, _, _) in zip(ids, preparadas) if informe['estado'] == 'pending'
+        ], 'render')
+    ORDERS_CREATED.inc(len(ids), via='api')
+    job_queue.notify()
+    return ids
 
 @app.route('/create', methods=['POST'])
 def create():
@@ -1027,284 +3977,12 @@ def create():
                 flash(error, 'error')
             return redirect(url_for('index'))
         
-        # Extraer TODOS los datos del formulario
-        institucion = form.get('institucion', '').strip()
-        encargado = form.get('encargado', '').strip()
-        contacto = form.get('contacto', '').strip()
-        comuna = form.get('comuna', '').strip()
-        ciudad = form.get('ciudad', '').strip()
-        fecha = form.get('fecha', '')
-        equipo = form.get('equipo', '').strip()
-        marca_modelo = form.get('marca_modelo', '').strip()
-        numero_serie = form.get('numero_serie', '').strip()
-        tecnico_nombre = form.get('tecnico_nombre', '').strip()
-        
-        # Tipo de servicio
-        servicio_instalacion = form.get('servicio_instalacion', 'no')
-        servicio_mantenimiento = form.get('servicio_mantenimiento', 'no')
-        servicio_correctivo = form.get('servicio_correctivo', 'no')
-        servicio_visita = form.get('servicio_visita', 'no')
-        servicio_comercial = form.get('servicio_comercial', 'no')
-        servicio_otro = form.get('servicio_otro', 'no')
-        servicio_otro_especificar = form.get('servicio_otro_especificar', '').strip()
-        
-        # Tipo de garantía
-        garantia = form.get('garantia', '')
-        garantia_en_garantia = 'si' if garantia == 'en_garantia' else 'no'
-        garantia_fuera_garantia = 'si' if garantia == 'fuera_garantia' else 'no'
-        garantia_en_convenio = 'si' if garantia == 'en_convenio' else 'no'
-        
-        # Problema e inspección
-        problema_cliente = form.get('problema_cliente', '').strip()
-        inspeccion_visual = form.get('inspeccion_visual', '').strip()
-        
-        # Descripción mantenimiento (Aplica/No Aplica)
-        mantenimiento_prueba_funcionamiento = form.get('mantenimiento_prueba_funcionamiento', '')
-        mantenimiento_apertura_mecanismos = form.get('mantenimiento_apertura_mecanismos', '')
-        mantenimiento_desinfeccion = form.get('mantenimiento_desinfeccion', '')
-        mantenimiento_limpieza_lubricacion = form.get('mantenimiento_limpieza_lubricacion', '')
-        mantenimiento_lubricacion_motores = form.get('mantenimiento_lubricacion_motores', '')
-        mantenimiento_calibracion_ejes = form.get('mantenimiento_calibracion_ejes', '')
-        mantenimiento_calibracion_software = form.get('mantenimiento_calibracion_software', '')
-        mantenimiento_verificacion_seguridad = form.get('mantenimiento_verificacion_seguridad', '')
-        mantenimiento_verificacion_filtraciones = form.get('mantenimiento_verificacion_filtraciones', '')
-        mantenimiento_limpieza_cpu = form.get('mantenimiento_limpieza_cpu', '')
-        mantenimiento_cambio_filtro = form.get('mantenimiento_cambio_filtro', '')
-        mantenimiento_reteste_pernos = form.get('mantenimiento_reteste_pernos', '')
-        mantenimiento_reseteo_contadores = form.get('mantenimiento_reseteo_contadores', '')
-        mantenimiento_otros = form.get('mantenimiento_otros', '')
-        mantenimiento_otros_especificar = form.get('mantenimiento_otros_especificar', '').strip()
-        
-        # Mediciones
-        mediciones_parametros = form.get('mediciones_parametros', '').strip()
-        
-        # Piezas de reemplazo
-        piezas_descripcion1 = form.get('piezas_descripcion1', '').strip()
-        piezas_cantidad1 = form.get('piezas_cantidad1', '').strip()
-        piezas_descripcion2 = form.get('piezas_descripcion2', '').strip()
-        piezas_cantidad2 = form.get('piezas_cantidad2', '').strip()
-        piezas_descripcion3 = form.get('piezas_descripcion3', '').strip()
-        piezas_cantidad3 = form.get('piezas_cantidad3', '').strip()
-        piezas_descripcion4 = form.get('piezas_descripcion4', '').strip()
-        piezas_cantidad4 = form.get('piezas_cantidad4', '').strip()
-        
-        # Detalles del servicio
-        detalles_servicio = form.get('detalles_servicio', '').strip()
-        
-        # Resolución
-        resolucion_operativo = form.get('resolucion_operativo', 'no')
-        resolucion_no_operativo = form.get('resolucion_no_operativo', 'no')
-        resolucion_requiere_visita = form.get('resolucion_requiere_visita', 'no')
-        
-        # Encuesta de servicio
-        encuesta_presentacion = form.get('encuesta_presentacion', '')
-        encuesta_reparacion = form.get('encuesta_reparacion', '')
-        encuesta_preparacion = form.get('encuesta_preparacion', '')
-        encuesta_plazos = form.get('encuesta_plazos', '')
-        encuesta_nota = form.get('encuesta_nota', '')
-        encuesta_recomendacion = form.get('encuesta_recomendacion', '')
-        
-        sig_tech = form.get('sig_tech', '')
-        sig_client = form.get('sig_client', '')
-        
-        # Guardar firmas como imágenes
-        def save_sig(dataurl, filename_prefix):
-            if not dataurl:
-                return None
-            
-            if not dataurl.startswith('data:image/png;base64,'):
-                raise ValueError("Formato de imagen no válido")
-            
-            try:
-                header, b64 = dataurl.split(',', 1)
-                data = base64.b64decode(b64)
-            except Exception as e:
-                logger.error(f"Error decodificando firma: {str(e)}")
-                return None
-            
-            if len(data) > config.MAX_SIGNATURE_SIZE:
-                raise ValueError("Imagen de firma demasiado grande")
-            
-            filename = f"{filename_prefix}_{int(datetime.now().timestamp())}_{secrets.token_hex(8)}.png"
-            path = os.path.join(config.UPLOADS_DIR, filename)
-            
-            with open(path, 'wb') as f:
-                f.write(data)
-            
-            return path
-        
-        tech_sig_path = save_sig(sig_tech, 'tech')
-        client_sig_path = save_sig(sig_client, 'client')
-        
-        # Crear registro en BD con TODOS los campos
-        created_at = datetime.now().isoformat()
-        
-        with db_connection() as conn:
-            cursor = conn.execute('''
-                INSERT INTO informes 
-                (institucion, encargado, contacto, comuna, ciudad, fecha, equipo, marca_modelo, numero_serie,
-                 servicio_instalacion, servicio_mantenimiento, servicio_correctivo, servicio_visita,
-                 servicio_comercial, servicio_otro, servicio_otro_especificar,
-                 garantia_en_garantia, garantia_fuera_garantia, garantia_en_convenio,
-                 problema_cliente, inspeccion_visual,
-                 mantenimiento_prueba_funcionamiento, mantenimiento_apertura_mecanismos,
-                 mantenimiento_desinfeccion, mantenimiento_limpieza_lubricacion,
-                 mantenimiento_lubricacion_motores, mantenimiento_calibracion_ejes,
-                 mantenimiento_calibracion_software, mantenimiento_verificacion_seguridad,
-                 mantenimiento_verificacion_filtraciones, mantenimiento_limpieza_cpu,
-                 mantenimiento_cambio_filtro, mantenimiento_reteste_pernos,
-                 mantenimiento_reseteo_contadores, mantenimiento_otros, mantenimiento_otros_especificar,
-                 mediciones_parametros,
-                 piezas_descripcion1, piezas_cantidad1, piezas_descripcion2, piezas_cantidad2,
-                 piezas_descripcion3, piezas_cantidad3, piezas_descripcion4, piezas_cantidad4,
-                 detalles_servicio,
-                 resolucion_operativo, resolucion_no_operativo, resolucion_requiere_visita,
-                 encuesta_presentacion, encuesta_reparacion, encuesta_preparacion,
-                 encuesta_plazos, encuesta_nota, encuesta_recomendacion,
-                 tecnico_nombre, tecnico_firma, cliente_firma, pdf_path, created_at)
-                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            ''', (
-                institucion, encargado, contacto, comuna, ciudad, fecha, equipo, marca_modelo, numero_serie,
-                servicio_instalacion, servicio_mantenimiento, servicio_correctivo, servicio_visita,
-                servicio_comercial, servicio_otro, servicio_otro_especificar,
-                garantia_en_garantia, garantia_fuera_garantia, garantia_en_convenio,
-                problema_cliente, inspeccion_visual,
-                mantenimiento_prueba_funcionamiento, mantenimiento_apertura_mecanismos,
-                mantenimiento_desinfeccion, mantenimiento_limpieza_lubricacion,
-                mantenimiento_lubricacion_motores, mantenimiento_calibracion_ejes,
-                mantenimiento_calibracion_software, mantenimiento_verificacion_seguridad,
-                mantenimiento_verificacion_filtraciones, mantenimiento_limpieza_cpu,
-                mantenimiento_cambio_filtro, mantenimiento_reteste_pernos,
-                mantenimiento_reseteo_contadores, mantenimiento_otros, mantenimiento_otros_especificar,
-                mediciones_parametros,
-                piezas_descripcion1, piezas_cantidad1, piezas_descripcion2, piezas_cantidad2,
-                piezas_descripcion3, piezas_cantidad3, piezas_descripcion4, piezas_cantidad4,
-                detalles_servicio,
-                resolucion_operativo, resolucion_no_operativo, resolucion_requiere_visita,
-                encuesta_presentacion, encuesta_reparacion, encuesta_preparacion,
-                encuesta_plazos, encuesta_nota, encuesta_recomendacion,
-                tecnico_nombre, tech_sig_path, client_sig_path, '', created_at
-            ))
-            
-            orden_id = cursor.lastrowid
-        
-        # Generar PDF con TODOS los datos
-        pdf_filename = f'orden_trabajo_{orden_id}.pdf'
-        pdf_path = os.path.join(config.PDF_DIR, pdf_filename)
-        
-        generate_pdf(pdf_path, {
-            'id': orden_id,
-            'institucion': institucion,
-            'encargado': encargado,
-            'contacto': contacto,
-            'comuna': comuna,        
-            'ciudad': ciudad,        
-            'fecha': fecha,
-            'equipo': equipo,
-            'marca_modelo': marca_modelo,
-            'numero_serie': numero_serie,
-            'tecnico_nombre': tecnico_nombre,
-            
-            # Tipo de servicio
-            'servicio_instalacion': servicio_instalacion,
-            'servicio_mantenimiento': servicio_mantenimiento,
-            'servicio_correctivo': servicio_correctivo,
-            'servicio_visita': servicio_visita,
-            'servicio_comercial': servicio_comercial,
-            'servicio_otro': servicio_otro,
-            'servicio_otro_especificar': servicio_otro_especificar,
-            
-            # Tipo de garantía
-            'garantia_en_garantia': garantia_en_garantia,
-            'garantia_fuera_garantia': garantia_fuera_garantia,
-            'garantia_en_convenio': garantia_en_convenio,
-            
-            # Problema e inspección
-            'problema_cliente': problema_cliente,
-            'inspeccion_visual': inspeccion_visual,
-            
-            # Mantenimiento
-            'mantenimiento_prueba_funcionamiento': mantenimiento_prueba_funcionamiento,
-            'mantenimiento_apertura_mecanismos': mantenimiento_apertura_mecanismos,
-            'mantenimiento_desinfeccion': mantenimiento_desinfeccion,
-            'mantenimiento_limpieza_lubricacion': mantenimiento_limpieza_lubricacion,
-            'mantenimiento_lubricacion_motores': mantenimiento_lubricacion_motores,
-            'mantenimiento_calibracion_ejes': mantenimiento_calibracion_ejes,
-            'mantenimiento_calibracion_software': mantenimiento_calibracion_software,
-            'mantenimiento_verificacion_seguridad': mantenimiento_verificacion_seguridad,
-            'mantenimiento_verificacion_filtraciones': mantenimiento_verificacion_filtraciones,
-            'mantenimiento_limpieza_cpu': mantenimiento_limpieza_cpu,
-            'mantenimiento_cambio_filtro': mantenimiento_cambio_filtro,
-            'mantenimiento_reteste_pernos': mantenimiento_reteste_pernos,
-            'mantenimiento_reseteo_contadores': mantenimiento_reseteo_contadores,
-            'mantenimiento_otros': mantenimiento_otros,
-            'mantenimiento_otros_especificar': mantenimiento_otros_especificar,
-            
-            # Mediciones
-            'mediciones_parametros': mediciones_parametros,
-            
-            # Piezas
-            'piezas_descripcion1': piezas_descripcion1,
-            'piezas_cantidad1': piezas_cantidad1,
-            'piezas_descripcion2': piezas_descripcion2,
-            'piezas_cantidad2': piezas_cantidad2,
-            'piezas_descripcion3': piezas_descripcion3,
-            'piezas_cantidad3': piezas_cantidad3,
-            'piezas_descripcion4': piezas_descripcion4,
-            'piezas_cantidad4': piezas_cantidad4,
-            
-            # Detalles
-            'detalles_servicio': detalles_servicio,
-            
-            # Resolución
-            'resolucion_operativo': resolucion_operativo,
-            'resolucion_no_operativo': resolucion_no_operativo,
-            'resolucion_requiere_visita': resolucion_requiere_visita,
-            
-            # Encuesta
-            'encuesta_presentacion': encuesta_presentacion,
-            'encuesta_reparacion': encuesta_reparacion,
-            'encuesta_preparacion': encuesta_preparacion,
-            'encuesta_plazos': encuesta_plazos,
-            'encuesta_nota': encuesta_nota,
-            'encuesta_recomendacion': encuesta_recomendacion,
-            
-            'tech_sig': tech_sig_path,
-            'client_sig': client_sig_path
-        })
-        
-        # Actualizar ruta del PDF en BD
-        with db_connection() as conn:
-            conn.execute(
-                'UPDATE informes SET pdf_path = ? WHERE id = ?', 
-                (pdf_path, orden_id)
-            )
-        
-        # Intentar enviar email
-        recipient = None
-        if es_email_valido(contacto):
-            recipient = contacto
-        elif es_email_valido(encargado):
-            recipient = encargado
-        
-        if recipient:
-            try:
-                send_email_with_attachment(
-                    recipient, 
-                    f'Orden de Trabajo Novamedical #{orden_id} - {institucion}',
-                    f'Se adjunta la orden de trabajo #{orden_id} para {institucion}.\n\nFecha del servicio: {fecha}\nTécnico: {tecnico_nombre}',
-                    pdf_path
-                )
-                flash(f'✅ Orden #{orden_id} generada y enviada a {recipient}', 'success')
-                logger.info(f"Orden {orden_id} enviada a {recipient}")
-            
-            except Exception as e:
-                error_msg = f'Orden #{orden_id} generada pero falló el envío: {str(e)}'
-                flash(error_msg, 'error')
-                logger.error(f"Error enviando email para orden {orden_id}: {str(e)}")
+        orden_id, bajo_demanda = registrar_orden(form)
+        tracer.current().set_attribute('orden.id', orden_id)
+        if bajo_demanda:
+            flash(f'✅ Orden #{orden_id} registrada. El PDF se generará al descargarlo.', 'success')
         else:
-            flash(f'✅ Orden #{orden_id} generada correctamente. No se detectó email válido para envío.', 'success')
-            logger.info(f"Orden {orden_id} generada sin envío de email")
+            flash(f'✅ Orden #{orden_id} registrada. El PDF se generará y enviará en segundo plano.', 'success')
         
         return redirect(url_for('index'))
     
@@ -1314,429 +3992,1009 @@ def create():
         flash(f'Error interno del servidor: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+class FormularioJSON(dict):
+    """Campos de una orden en JSON ({nombre: [valores]}) con la parte de la
+    interfaz de request.form que usan la validación y preparar_orden.
+    
+    MultiDict.get arma una excepción por cada campo ausente, y una orden
+    típica deja vacíos la mayoría de los ítems del checklist.
+    """
+    
+    def __getitem__(self, name):
+        return dict.__getitem__(self, name)[0]
+    
+    def get(self, name, default=None):
+        values = dict.get(self, name)
+        return values[0] if values else default
+    
+    def getlist(self, name):
+        return list(dict.get(self, name, ()))
+
+def formulario_desde_json(orden):
+    """Equivalente a request.form para una orden en JSON.
+    
+    La orden usa los mismos nombres y valores que el formulario (texto, o
+    lista de textos para los campos repetidos como pieza_descripcion).
+    """
+    form = FormularioJSON()
+    for name, value in orden.items():
+        values = [
+            str(item) for item in (value if isinstance(value, list) else [value])
+            if isinstance(item, (str, int, float)) and not isinstance(item, bool)
+        ]
+        if values:
+            form[name] = values
+    return form
+
+def recibir_orden(orden, existentes):
+    """Resultado de registrar una orden de /api/ordenes; existentes: {clave: id} ya recibidas"""
+    key, error = clave_de_orden(orden)
+    if error:
+        return error
+    
+    if key in existentes:
+        return {'idempotency_key': key, 'estado': 'duplicate', 'id': existentes[key]}
+    
+    form = formulario_desde_json(orden)
+    errors = validar_formulario(form)
+    if errors:
+        return {'idempotency_key': key, 'estado': 'invalid', 'errores': errors}
+    
+    try:
+        orden_id, _ = registrar_orden(form, key)
+    except ValueError as e:
+        return {'idempotency_key': key, 'estado': 'invalid', 'errores': [str(e)]}
+    except Exception:
+        # Dos envíos simultáneos de la misma orden: el índice único deja pasar uno
+        existing = storage.ids_por_idempotency_key([key]).get(key)
+        if existing is None:
+            raise
+        return {'idempotency_key': key, 'estado': 'duplicate', 'id': existing}
+    
+    existentes[key] = orden_id
+    return {'idempotency_key': key, 'estado': 'created', 'id': orden_id}
+
+def clave_de_orden(orden):
+    """(idempotency_key, None), o (None, resultado invalid) si la orden no la trae bien"""
+    if not isinstance(orden, dict):
+        return None, {'estado': 'invalid', 'errores': ['La orden debe ser un objeto JSON']}
+    key = orden.get('idempotency_key')
+    if not isinstance(key, str) or not key.strip() or len(key) > 100:
+        return None, {'estado': 'invalid', 'errores': ['idempotency_key es requerido (texto de hasta 100 caracteres)']}
+    return key, None
+
+def recibir_lote(ordenes):
+    """Resultados de /api/ordenes para un lote, en el mismo orden.
+    
+    Busca las claves ya recibidas en una consulta, valida cada orden y guarda
+    todas las válidas en una transacción (registrar_ordenes). Si la
+    transacción falla (p. ej. otra solicitud registró la misma clave a la
+    vez) se reintenta orden por orden para dar el resultado de cada una.
+    """
+    resultados = [None] * len(ordenes)
+    keys = [orden.get('idempotency_key') for orden in ordenes if isinstance(orden, dict)]
+    keys = [key for key in keys if isinstance(key, str)]
+    existentes = storage.ids_por_idempotency_key(keys) if keys else {}
+    
+    pendientes = {}   # clave -> posición de la orden a registrar
+    repetidas = []    # (posición, posición de la primera con la misma clave)
+    preparadas = []
+    for i, orden in enumerate(ordenes):
+        key, error = clave_de_orden(orden)
+        if error:
+            resultados[i] = error
+        elif key in existentes:
+            resultados[i] = {'idempotency_key': key, 'estado': 'duplicate', 'id': existentes[key]}
+        elif key in pendientes:
+            repetidas.append((i, pendientes[key]))
+        else:
+            form = formulario_desde_json(orden)
+            errors = validar_formulario(form)
+            if not errors:
+                try:
+                    preparadas.append(preparar_orden(form, key))
+                    pendientes[key] = i
+                except ValueError as e:
+                    errors = [str(e)]
+            if errors:
+                resultados[i] = {'idempotency_key': key, 'estado': 'invalid', 'errores': errors}
+    
+    if preparadas:
+        try:
+            ids = registrar_ordenes(preparadas)
+        except Exception as e:
+            logger.warning(f"Lote de {len(preparadas)} órdenes rechazado, se registran una por una: {str(e)}")
+            for i in pendientes.values():
+                try:
+                    resultados[i] = recibir_orden(ordenes[i], existentes)
+                except Exception as e:
+                    logger.error(f"Error registrando orden desde la API: {str(e)}")
+                    logger.error(traceback.format_exc())
+                    resultados[i] = {'idempotency_key': ordenes[i]['idempotency_key'], 'estado': 'error'}
+        else:
+            for i, orden_id in zip(pendientes.values(), ids):
+                resultados[i] = {'idempotency_key': ordenes[i]['idempotency_key'], 'estado': 'created', 'id': orden_id}
+    
+    # La misma clave dos veces en el lote: la segunda es un reenvío de la primera
+    for i, primera in repetidas:
+        resultado = resultados[primera]
+        if resultado['estado'] == 'created':
+            resultado = dict(resultado, estado='duplicate')
+        resultados[i] = resultado
+    return resultados
+
+def iter_lineas(stream, chunk_size=1 << 16):
+    """Líneas (bytes, sin el salto) de un flujo leído por bloques de chunk_size.
+    
+    Sólo usa read(n): request.stream no tiene búfer y, según la versión de
+    Werkzeug, leerlo por líneas va de a un byte o no admite BufferedReader.
+    """
+    pendiente = []
+    while True:
+        bloque = stream.read(chunk_size)
+        if not bloque:
+            break
+        partes = bloque.split(b'\n')
+        if len(partes) == 1:
+            pendiente.append(bloque)
+            continue
+        pendiente.append(partes[0])
+        yield b''.join(pendiente)
+        yield from partes[1:-1]
+        pendiente = [partes[-1]]
+    final = b''.join(pendiente)
+    if final:
+        yield final
+
+def leer_ndjson(lineas):
+    """(número de línea, orden, error) de un cuerpo NDJSON; las líneas vacías se saltan.
+    
+    Consume las líneas de a una sin cargar el cuerpo completo; si la línea
+    no es JSON, orden es None y error el resultado invalid a devolver.
+    """
+    for numero, linea in enumerate(lineas, 1):
+        if not linea.strip():
+            continue
+        try:
+            yield numero, json.loads(linea), None
+        except ValueError as e:
+            yield numero, None, {'estado': 'invalid', 'errores': [f'JSON no válido: {str(e)}']}
+
+def recibir_ndjson(lineas):
+    """Por cada lote de INTAKE_BATCH_SIZE líneas ya guardado, sus resultados con el número de línea"""
+    ordenes = leer_ndjson(lineas)
+    while True:
+        lote = list(itertools.islice(ordenes, config.INTAKE_BATCH_SIZE))
+        if not lote:
+            return
+        legibles = [orden for _, orden, error in lote if not error]
+        recibidas = iter(recibir_lote(legibles) if legibles else ())
+        resultados = [{'linea': numero, **(error or next(recibidas))} for numero, _, error in lote]
+        registrar_recepcion(resultados)
+        yield resultados
+
+def responder_ndjson(stream):
+    """Cuerpo de la respuesta NDJSON, enviado lote a lote mientras se lee la solicitud.
+    
+    Ni la solicitud ni los resultados se juntan en memoria. Un error
+    interno corta la respuesta con una línea de estado error: las líneas
+    sin resultado no se guardaron y se pueden reenviar.
+    """
+    try:
+        for resultados in recibir_ndjson(iter_lineas(stream)):
+            yield ''.join(json.dumps(resultado, ensure_ascii=False) + '\n' for resultado in resultados)
+    except Exception as e:
+        logger.error(f"Error recibiendo órdenes NDJSON: {str(e)}")
+        logger.error(traceback.format_exc())
+        yield json.dumps({'estado': 'error', 'errores': ['Error interno del servidor']}, ensure_ascii=False) + '\n'
+
+@app.route('/api/ordenes', methods=['POST'])
+def api_ordenes():
+    """Registrar órdenes en lote: JSON {"ordenes": [{...}, ...]} o NDJSON.
+    
+    Cada orden lleva los campos del formulario y una idempotency_key que
+    genera el cliente: reenviar una orden ya recibida (p. ej. al volver la
+    conexión, o al repetir una importación cortada) no la duplica y
+    devuelve su id. Responde con un resultado por orden, en el mismo orden:
+    created, duplicate, invalid o error.
+    
+    Con Content-Type application/x-ndjson el cuerpo es una orden por línea,
+    sin tope de cantidad (para importaciones desde el CMMS): se lee por
+    partes, se guarda en transacciones de INTAKE_BATCH_SIZE órdenes y la
+    respuesta es NDJSON con un resultado por línea, enviada por lotes.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        return Response(stream_with_context(responder_ndjson(request.stream)), mimetype='application/x-ndjson')
+    
+    payload = request.get_json(silent=True)
+    ordenes = payload.get('ordenes') if isinstance(payload, dict) else None
+    if not isinstance(ordenes, list) or not ordenes:
+        return {'error': 'Se esperaba {"ordenes": [...]} o un cuerpo application/x-ndjson'}, 400
+    if len(ordenes) > config.INTAKE_MAX_BATCH:
+        return {'error': f'Se admiten hasta {config.INTAKE_MAX_BATCH} órdenes por solicitud (sin tope con NDJSON)'}, 413
+    
+    try:
+        resultados = recibir_lote(ordenes)
+    except Exception as e:
+        logger.error(f"Error recibiendo órdenes: {str(e)}")
+        logger.error(traceback.format_exc())
+        return {'error': 'Error interno del servidor'}, 500
+    registrar_recepcion(resultados)
+    return {'resultados': resultados}
+
+def registrar_recepcion(resultados):
+    creadas = sum(r['estado'] == 'created' for r in resultados)
+    if creadas:
+        logger.info(f"API: {creadas} de {len(resultados)} órdenes registradas")
+
+def enviar_pdf(path, filename, etag):
+    """Responder con un PDF local: ETag, 304, Range y Cache-Control.
+    
+    Si ?v= coincide con el hash, esa URL identifica un contenido que no
+    cambia y el navegador la guarda DOWNLOAD_MAX_AGE sin volver a preguntar;
+    si no, revalida cada vez con If-None-Match y recibe un 304 sin cuerpo.
+    Con DOWNLOAD_ACCEL el proxy envía el archivo (y atiende los Range).
+    """
+    span = tracer.current()
+    if span.recording:
+        span.set_attribute('pdf.size_bytes', os.path.getsize(path))
+    
+    accel_path = None
+    if config.DOWNLOAD_ACCEL == 'x-accel-redirect':
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(config.PDF_DIR))
+        if not relative.startswith('..'):
+            accel_path = config.DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + relative.replace(os.sep, '/')
+    
+    if accel_path:
+        if request.if_none_match.contains(etag):
+            rv = Response(status=304)
+        else:
+            rv = Response(mimetype='application/pdf')
+            rv.headers['X-Accel-Redirect'] = accel_path
+            rv.headers.set('Content-Disposition', 'attachment', filename=filename)
+        rv.set_etag(etag)
+    else:
+        rv = send_file(
+            os.path.abspath(path), mimetype='application/pdf',
+            as_attachment=True, download_name=filename, etag=etag
+        )
+        # Anunciar que se puede reanudar una descarga cortada
+        rv.headers.setdefault('Accept-Ranges', 'bytes')
+    
+    # Son datos de clientes: sólo la caché del navegador, nunca la de un proxy compartido
+    rv.cache_control.public = False
+    rv.cache_control.private = True
+    if request.args.get('v') == etag[:16]:
+        rv.cache_control.no_cache = None
+        rv.cache_control.max_age = config.DOWNLOAD_MAX_AGE
+        rv.cache_control.immutable = True
+    else:
+        rv.cache_control.no_cache = True
+    return rv
+
 @app.route('/download/<int:id>')
 def download(id):
     """Descargar PDF de la orden de trabajo"""
     try:
-        with db_connection() as conn:
-            row = conn.execute(
-                'SELECT pdf_path FROM informes WHERE id = ?', 
-                (id,)
-            ).fetchone()
+        tracer.current().set_attribute('orden.id', id)
+        row = storage.get_informe(id)
         
-        if not row or not row['pdf_path'] or not os.path.exists(row['pdf_path']):
+        if not row:
             flash('PDF no encontrado', 'error')
             return redirect(url_for('index'))
         
-        filename = os.path.basename(row['pdf_path'])
-        return send_from_directory(config.PDF_DIR, filename, as_attachment=True)
+        filename = f'orden_trabajo_{id}.pdf'
+        if pdf_store.exists(row['pdf_path']):
+            # En S3 el cliente descarga directo del bucket con una URL firmada
+            url = pdf_store.download_url(row['pdf_path'], filename)
+            if url:
+                return redirect(url)
+            etag = row['pdf_sha256']
+            if not etag:
+                # PDF anterior al hash: se calcula una vez
+                etag = sha256_file(row['pdf_path'])
+                storage.update_informe(id, pdf_sha256=etag)
+            return enviar_pdf(row['pdf_path'], filename, etag)
+        
+        if row['estado'] == 'pending':
+            flash(f'La orden #{id} aún se está procesando', 'error')
+            return redirect(url_for('index'))
+        
+        # Sin archivo en disco: la fila tiene todo lo necesario para generarlo
+        path = pdf_cache.get(row)
+        return enviar_pdf(path, filename, pdf_cache.digest(path))
     
+    except HTTPException:
+        # 416 de un Range fuera del archivo: es la respuesta, no un error
+        raise
     except Exception as e:
         logger.error(f"Error descargando PDF {id}: {str(e)}")
         flash('Error descargando el archivo', 'error')
         return redirect(url_for('index'))
 
-# --- PDF Generation COMPLETO Y FUNCIONAL ---
-def generate_pdf(path, data):
-    """Generar PDF con diseño mejorado - uso eficiente del espacio"""
-    try:
-        c = rcanvas.Canvas(path, pagesize=A4)
-        width, height = A4
-        margin = 40
-        y = height - margin
-        
-        # ===== ENCABEZADO PROFESIONAL =====
-        try:
-            c.drawImage("C:/Users/Novam/Downloads/Informe_novamedical/novamedical.png", margin -10, y - 70, width=100, height=100)
-        except:
-            pass
-        
-        c.setFont('Helvetica-Bold', 14)
-        c.drawString(margin + 80, y, 'NOVAMEDICAL CHILE LTDA')
-        c.setFont('Helvetica', 9)
-        c.drawString(margin + 80, y - 15, '77.899.260-4')
-        c.drawString(margin + 80, y - 30, 'Tel: +56 2 3288 1618')
-        c.drawString(margin + 80, y - 45, 'Email: serviciotecnico@novamedical.cl')
-        
-        c.setFont('Helvetica-Bold', 12)
-        c.drawString(width - 180, y, f'ORDEN DE TRABAJO N°: {data["id"]}')
-        c.setFont('Helvetica', 9)
-        c.drawString(width - 180, y - 15, f'Fecha: {data.get("fecha", "")}')
-        
-        y -= 80
-        
-        # ===== DATOS DEL CLIENTE - MEJOR DISEÑO =====
-        c.setFont('Helvetica-Bold', 11)
-        c.drawString(margin, y, 'DATOS DE CLIENTE Y/O USUARIO')
-        y -= 15
-        
-        c.setFont('Helvetica', 9)
-        # Primera fila horizontal
-        c.drawString(margin, y, "Institución:")
-        if data.get('institucion'):
-            c.drawString(margin + 50, y, data['institucion'][:40])
-        
-        c.drawString(width/2, y, "Encargado: ")
-        if data.get('encargado'):
-            c.drawString(width/2 + 48, y, data['encargado'][:25])
-        y -= 12
-        
-        # Segunda fila horizontal  
-        c.drawString(margin, y, "Contacto:")
-        if data.get('contacto'):
-            c.drawString(margin + 45, y, data['contacto'][:30])
-        
-        c.drawString(width/2, y, "Comuna:")
-        if data.get('comuna'):
-            c.drawString(width/2 + 40, y, data['comuna'][:20])
-        y -= 12
-        
-        # Tercera fila horizontal
-        c.drawString(margin, y, "Ciudad:")
-        if data.get('ciudad'):
-            c.drawString(margin + 35, y, data['ciudad'][:20])
-        y -= 20
-        
-        # ===== DATOS DEL EQUIPAMIENTO - AL LADO =====
-        c.setFont('Helvetica-Bold', 11)
-        c.drawString(margin, y, 'DATOS DEL EQUIPAMIENTO')
-        y -= 15
-        
-        c.setFont('Helvetica', 9)
-        c.drawString(margin, y, "Equipo:")
-        if data.get('equipo'):
-            c.drawString(margin + 35, y, data['equipo'][:25])
-        
-        c.drawString(width/2, y, "Marca/Modelo: ")
-        if data.get('marca_modelo'):
-            c.drawString(width/2 + 60, y, data['marca_modelo'][:25])
-        y -= 12
-        
-        c.drawString(margin, y, "N° Serie:")
-        if data.get('numero_serie'):
-            c.drawString(margin + 40, y, data['numero_serie'][:20])
-        
-        c.drawString(width/2, y, "Ingeniero:")
-        if data.get('tecnico_nombre'):
-            c.drawString(width/2 + 40, y, data['tecnico_nombre'][:25])
-        y -= 25
-        
-        # ===== SECCIÓN HORIZONTAL: MOTIVO + GARANTÍA =====
-        section_height = 0
-        
-        # Columna izquierda - MOTIVO DE VISITA
-        left_x = margin
-        right_x = width/2 + 20
-        
-        c.setFont('Helvetica-Bold', 11)
-        c.drawString(left_x, y, 'MOTIVO DE VISITA')
-        
-        c.setFont('Helvetica', 9)
-        servicios = []
-        if data.get('servicio_instalacion') == 'si':
-            servicios.append("✓ Instalación/Puesta en marcha")
-        if data.get('servicio_mantenimiento') == 'si':
-            servicios.append("✓ Mantenimiento preventivo")
-        if data.get('servicio_correctivo') == 'si':
-            servicios.append("✓ Mantenimiento correctivo")
-        if data.get('servicio_visita') == 'si':
-            servicios.append("✓ Visita técnica/Diagnóstico")
-        if data.get('servicio_comercial') == 'si':
-            servicios.append("✓ Solicitud comercial")
-        if data.get('servicio_otro') == 'si':
-            otros = data.get('servicio_otro_especificar', 'Otro/demo')
-            servicios.append(f"✓ Otro: {otros}")
-        
-        temp_y = y - 15
-        for servicio in servicios:
-            if temp_y < 100:  # Si se acaba el espacio, nueva página
-                c.showPage()
-                y = height - margin
-                temp_y = y - 15
-                c.setFont('Helvetica-Bold', 11)
-                c.drawString(left_x, y, 'MOTIVO DE VISITA (cont.)')
-                c.setFont('Helvetica', 9)
-                y -= 15
-            
-            c.drawString(left_x + 5, temp_y, servicio)
-            temp_y -= 10
-        
-        left_section_bottom = temp_y
-        
-        # Columna derecha - TIPO DE GARANTÍA
-        c.setFont('Helvetica-Bold', 11)
-        c.drawString(right_x, y, 'TIPO DE GARANTÍA')
-        
-        c.setFont('Helvetica', 9)
-        temp_y = y - 15
-        if data.get('garantia_en_garantia') == 'si':
-            c.drawString(right_x + 5, temp_y, "✓ En garantía")
-            temp_y -= 10
-        if data.get('garantia_fuera_garantia') == 'si':
-            c.drawString(right_x + 5, temp_y, "✓ Fuera de garantía")
-            temp_y -= 10
-        if data.get('garantia_en_convenio') == 'si':
-            c.drawString(right_x + 5, temp_y, "✓ En convenio")
-            temp_y -= 10
-        
-        right_section_bottom = temp_y
-        
-        # Actualizar Y con la sección más larga
-        y = min(left_section_bottom, right_section_bottom) - 15
-        
-        # ===== PROBLEMA REPORTADO =====
-        if data.get('problema_cliente'):
-            c.setFont('Helvetica-Bold', 11)
-            c.drawString(margin, y, 'PROBLEMA REPORTADO')
-            y -= 15
-            
-            c.setFont('Helvetica', 9)
-            problema_lines = split_text(data['problema_cliente'], 80)
-            for line in problema_lines:
-                if y < 100:
-                    c.showPage()
-                    y = height - margin - 15
-                c.drawString(margin + 5, y, line)
-                y -= 10
-            y -= 5
-        
-        # ===== INSPECCIÓN VISUAL =====
-        if data.get('inspeccion_visual'):
-            c.setFont('Helvetica-Bold', 11)
-            c.drawString(margin, y, 'INSPECCIÓN VISUAL')
-            y -= 15
-            
-            c.setFont('Helvetica', 9)
-            inspeccion_lines = split_text(data['inspeccion_visual'], 80)
-            for line in inspeccion_lines:
-                if y < 100:
-                    c.showPage()
-                    y = height - margin - 15
-                c.drawString(margin + 5, y, line)
-                y -= 10
-            y -= 10
-        
-        # ===== DESCRIPCIÓN DEL MANTENIMIENTO - DISEÑO MEJORADO =====
-        c.setFont('Helvetica-Bold', 11)
-        c.drawString(margin, y, 'DESCRIPCIÓN DEL MANTENIMIENTO')
-        y -= 20
-        
-        c.setFont('Helvetica', 9)
-        actividades = [
-            ("Prueba funcionamiento", data.get('mantenimiento_prueba_funcionamiento')),
-            ("Apertura mecanismos", data.get('mantenimiento_apertura_mecanismos')),
-            ("Desinfección equipo", data.get('mantenimiento_desinfeccion')),
-            ("Limpieza/lubricación", data.get('mantenimiento_limpieza_lubricacion')),
-            ("Lubricación motores", data.get('mantenimiento_lubricacion_motores')),
-            ("Calibración ejes", data.get('mantenimiento_calibracion_ejes')),
-            ("Calibración software", data.get('mantenimiento_calibracion_software')),
-            ("Verificación seguridad", data.get('mantenimiento_verificacion_seguridad')),
-            ("Verificación filtraciones", data.get('mantenimiento_verificacion_filtraciones')),
-            ("Limpieza CPU", data.get('mantenimiento_limpieza_cpu')),
-            ("Cambio filtro", data.get('mantenimiento_cambio_filtro')),
-            ("Reteste pernos", data.get('mantenimiento_reteste_pernos')),
-            ("Reseteo contadores", data.get('mantenimiento_reseteo_contadores')),
+# --- PDF Generation: motor de maquetación declarativo ---
+# El documento se describe una sola vez como una lista de secciones. Al
+# importar el módulo cada sección se compila a operaciones de dibujo con
+# posiciones y fuentes ya resueltas; renderizar una orden sólo recorre esas
+# operaciones insertando los valores y decide los saltos de página.
+PAGE_WIDTH, PAGE_HEIGHT = A4
+PDF_MARGIN = 40
+PDF_BOTTOM = 100
+SIGNATURE_BOX = (180, 50)  # caja de cada firma, en puntos
+FONT_TITLE = ('Helvetica-Bold', 11)
+FONT_BODY = ('Helvetica', 9)
+
+# Tipos de operación: (tipo, fuente, tamaño, x, dy, ...)
+OP_TEXT = 0       # texto fijo
+OP_FIELD = 1      # valor de data[key] truncado a maxlen, si existe
+OP_FORMAT = 2     # plantilla str.format con los valores de la orden
+OP_LINE = 3       # línea horizontal (x1, dy, x2)
+OP_SIGNATURE = 4  # imagen de firma o texto alternativo
+OP_IMAGE = 5      # imagen fija (logo)
+
+class _FormatData(dict):
+    def __missing__(self, key):
+        return ''
+
+def _text(font, x, dy, text):
+    return (OP_TEXT, font[0], font[1], x, dy, text)
+
+def _field(font, x, dy, key, maxlen):
+    return (OP_FIELD, font[0], font[1], x, dy, key, maxlen)
+
+class PdfSection(ABC):
+    """Bloque del documento con título opcional y filas de altura conocida.
+    
+    rows(data) devuelve una lista de (altura, ops) relativas al borde
+    superior de cada fila. El motor mantiene el título junto a la primera
+    fila y lo repite con '(cont.)' si la sección continúa en otra página.
+    """
+    
+    def __init__(self, titles=(), title_gap=15, space_after=10, optional=False):
+        # titles: [(x, texto)] para secciones con varias columnas
+        self.title_ops = [_text(FONT_TITLE, x, 0, t) for x, t in titles]
+        self.cont_ops = [_text(FONT_TITLE, x, 0, f'{t} (cont.)') for x, t in titles]
+        self.title_gap = title_gap if titles else 0
+        self.space_after = space_after
+        self.optional = optional
+    
+    @abstractmethod
+    def rows(self, data):
+        ...
+
+class FieldsSection(PdfSection):
+    """Pares etiqueta: valor en filas de una o dos columnas (todo precompilado)"""
+    
+    def __init__(self, title, rows, row_height=12, **kwargs):
+        super().__init__([(PDF_MARGIN, title)], **kwargs)
+        self._rows = []
+        for row in rows:
+            ops = []
+            for x, label, value_dx, key, maxlen in row:
+                ops.append(_text(FONT_BODY, x, 0, label))
+                ops.append(_field(FONT_BODY, x + value_dx, 0, key, maxlen))
+            self._rows.append((row_height, tuple(ops)))
+    
+    def rows(self, data):
+        return self._rows
+
+class ChecksSection(PdfSection):
+    """Columnas de opciones marcadas ('✓ texto'), p. ej. motivo y garantía"""
+    
+    def __init__(self, columns, line_height=10, **kwargs):
+        # columns: [(x, título, [(key, valor_esperado, texto)])]
+        super().__init__([(x, title) for x, title, _ in columns], **kwargs)
+        self.line_height = line_height
+        self.columns = [
+            (x + 5, [(key, expected, text) for key, expected, text in items])
+            for x, _, items in columns
         ]
+    
+    def rows(self, data):
+        columns = []
+        for x, items in self.columns:
+            lines = []
+            for key, expected, text in items:
+                if data.get(key) == expected:
+                    lines.append(_text(FONT_BODY, x, 0, text.format_map(_FormatData(data)) if '{' in text else text))
+            columns.append(lines)
         
-        # Diseño en 2 columnas para mantenimiento
-        col_width = (width - 2*margin) / 2
-        start_y = y
-        current_y = y
-        
-        for i, (actividad, estado) in enumerate(actividades):
-            if estado == 'aplica':
-                symbol = "✓"
-            elif estado == 'no_aplica':
-                symbol = "✗"
-            else:
-                symbol = "○"
-            
-            # Alternar entre columnas
-            if i % 2 == 0:
-                x_pos = margin + 5
-            else:
-                x_pos = margin + col_width + 10
-            
-            if current_y < 100:  # Nueva página si es necesario
-                c.showPage()
-                current_y = height - margin - 20
-                c.setFont('Helvetica-Bold', 11)
-                c.drawString(margin, current_y, 'DESCRIPCIÓN MANTENIMIENTO (cont.)')
-                current_y -= 20
-                c.setFont('Helvetica', 9)
-            
-            c.drawString(x_pos, current_y, f"{symbol} {actividad}")
-            
-            # Solo bajar Y en filas impares (cuando completamos una fila)
-            if i % 2 == 1:
-                current_y -= 12
-        
-        # Ajustar Y para la siguiente sección
-        y = current_y - 15
+        depth = max((len(lines) for lines in columns), default=0)
+        return [
+            (self.line_height, tuple(lines[i] for lines in columns if i < len(lines)))
+            for i in range(depth)
+        ]
+
+class TextSection(PdfSection):
+    """Texto libre ajustado a un ancho fijo de caracteres; se omite si está vacío"""
+    
+    def __init__(self, title, key, width=80, line_height=10, **kwargs):
+        super().__init__([(PDF_MARGIN, title)], optional=True, **kwargs)
+        self.key = key
+        self.width = width
+        self.line_height = line_height
+    
+    def rows(self, data):
+        return [
+            (self.line_height, (_text(FONT_BODY, PDF_MARGIN + 5, 0, line),))
+            for line in split_text(data.get(self.key) or '', self.width)
+        ]
+
+class ActivitiesSection(PdfSection):
+    """Grilla de actividades en dos columnas con símbolo aplica / no aplica"""
+    
+    SYMBOLS = {'aplica': '✓', 'no_aplica': '✗'}
+    
+    def __init__(self, title, activities, other_key, other_detail_key, row_height=12, **kwargs):
+        super().__init__([(PDF_MARGIN, title)], **kwargs)
+        col_width = (PAGE_WIDTH - 2 * PDF_MARGIN) / 2
+        self.columns_x = (PDF_MARGIN + 5, PDF_MARGIN + col_width + 10)
+        self.activities = activities
+        self.other_key = other_key
+        self.other_detail_key = other_detail_key
+        self.row_height = row_height
+    
+    def rows(self, data):
+        rows = []
+        for i in range(0, len(self.activities), 2):
+            ops = tuple(
+                _text(FONT_BODY, x, 0, f"{self.SYMBOLS.get(data.get(key), '○')} {label}")
+                for x, (label, key) in zip(self.columns_x, self.activities[i:i + 2])
+            )
+            rows.append((self.row_height, ops))
         
-        # Otros mantenimientos
-        if data.get('mantenimiento_otros') == 'aplica' and data.get('mantenimiento_otros_especificar'):
-            c.drawString(margin, y, f"✓ Otros: {data['mantenimiento_otros_especificar']}")
-            y -= 15
+        if data.get(self.other_key) == 'aplica' and data.get(self.other_detail_key):
+            rows.append((15, (_text(FONT_BODY, PDF_MARGIN, -3, f"✓ Otros: {data[self.other_detail_key]}"),)))
+        return rows
+
+class PartsSection(PdfSection):
+    """Piezas de reemplazo [(descripción, cantidad)], una por línea y sin tope"""
+    
+    def __init__(self, title, key, line_height=10, **kwargs):
+        super().__init__([(PDF_MARGIN, title)], optional=True, **kwargs)
+        self.key = key
+        self.line_height = line_height
+    
+    def rows(self, data):
+        return [
+            (self.line_height, (_text(FONT_BODY, PDF_MARGIN + 5, 0, f"• {desc} - Cant: {qty}" if qty else f"• {desc}"),))
+            for desc, qty in data.get(self.key) or ()
+        ]
+
+class SignaturesSection(PdfSection):
+    """Firmas lado a lado; el bloque nunca se parte entre páginas"""
+    
+    def __init__(self, signatures, block_height=50, sig_w=SIGNATURE_BOX[0], sig_h=SIGNATURE_BOX[1], **kwargs):
+        super().__init__(**kwargs)
+        ops = []
+        for x, title, name_key, sig_key, placeholder in signatures:
+            ops.append(_text(('Helvetica-Bold', 9), x, 0, title))
+            ops.append((OP_FORMAT, 'Helvetica', 8, x, -12, f'Nombre: {{{name_key}}}'))
+            ops.append((OP_LINE, None, None, x, -25, x + sig_w))
+            ops.append((OP_SIGNATURE, 'Helvetica', 8, x, -80, sig_key, sig_w, sig_h, placeholder))
+        self._rows = [(block_height, tuple(ops))]
+    
+    def rows(self, data):
+        return self._rows
+
+# Encabezado de la primera página
+PDF_LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'novamedical.png')
+
+# Membrete invariante: se compila una vez por proceso (ver PdfLetterhead)
+PDF_LETTERHEAD_OPS = (
+    (OP_IMAGE, None, None, PDF_MARGIN - 10, -70, PDF_LOGO_PATH, 100, 100),
+    _text(('Helvetica-Bold', 14), PDF_MARGIN + 80, 0, 'NOVAMEDICAL CHILE LTDA'),
+    _text(FONT_BODY, PDF_MARGIN + 80, -15, '77.899.260-4'),
+    _text(FONT_BODY, PDF_MARGIN + 80, -30, 'Tel: +56 2 3288 1618'),
+    _text(FONT_BODY, PDF_MARGIN + 80, -45, 'Email: serviciotecnico@novamedical.cl'),
+)
+
+# Datos propios de cada orden en el encabezado
+PDF_HEADER_OPS = (
+    (OP_FORMAT, 'Helvetica-Bold', 12, PAGE_WIDTH - 180, 0, 'ORDEN DE TRABAJO N°: {id}'),
+    (OP_FORMAT, 'Helvetica', 9, PAGE_WIDTH - 180, -15, 'Fecha: {fecha}'),
+)
+PDF_HEADER_HEIGHT = 80
+
+HALF = PAGE_WIDTH / 2
+
+def _pdf_field_rows(block):
+    """Filas de FieldsSection con los campos de FORM_FIELDS ubicados en ese bloque"""
+    rows = {}
+    for field in FORM_FIELDS:
+        if field.pdf and field.pdf[0] == block:
+            _, row, column, label, value_dx, maxlen = field.pdf
+            rows.setdefault(row, []).append((column, (PDF_MARGIN, HALF)[column], label, value_dx, field.name, maxlen))
+    return [[cell[1:] for cell in sorted(rows[row])] for row in sorted(rows)]
+
+def _text_section(name, **kwargs):
+    return TextSection(FORM_FIELDS_BY_NAME[name].pdf_title, name, **kwargs)
+
+PDF_LAYOUT = (
+    FieldsSection('DATOS DE CLIENTE Y/O USUARIO', _pdf_field_rows('cliente'), space_after=8),
+    FieldsSection('DATOS DEL EQUIPAMIENTO', _pdf_field_rows('equipo'), space_after=13),
+    ChecksSection([
+        (PDF_MARGIN, 'MOTIVO DE VISITA', [
+            (item.key, 'si', f'✓ {item.pdf_label}') for item in CHECKLIST_BY_GROUP['servicio']
+        ]),
+        (HALF + 20, 'TIPO DE GARANTÍA', [
+            (item.key, 'si', f'✓ {item.pdf_label}') for item in CHECKLIST_BY_GROUP['garantia']
+        ]),
+    ], space_after=15),
+    _text_section('problema_cliente', space_after=5),
+    _text_section('inspeccion_visual'),
+    ActivitiesSection('DESCRIPCIÓN DEL MANTENIMIENTO', [
+        (item.pdf_label, item.key) for item in CHECKLIST_BY_GROUP['mantenimiento']
+        if item.key != 'mantenimiento_otros'
+    ], 'mantenimiento_otros', 'mantenimiento_otros_especificar', title_gap=20, space_after=3),
+    _text_section('mediciones_parametros'),
+    PartsSection('PIEZAS DE REEMPLAZO', 'piezas', space_after=5),
+    _text_section('detalles_servicio'),
+    ChecksSection([
+        (PDF_MARGIN, 'RESOLUCIÓN FINAL', [
+            (item.key, 'si', f'✓ {item.pdf_label}') for item in CHECKLIST_BY_GROUP['resolucion']
+        ]),
+    ], space_after=20),
+    SignaturesSection([
+        (PDF_MARGIN, 'FIRMA INGENIERO', 'tecnico_nombre', 'tech_sig', '[Firma del técnico]'),
+        (PAGE_WIDTH - PDF_MARGIN - 180, 'FIRMA CLIENTE / RESPONSABLE', 'encargado', 'client_sig', '[Firma del cliente]'),
+    ]),
+)
+
+class PdfRenderer:
+    """Dibuja operaciones precompiladas sobre un canvas llevando el cursor y la página.
+    
+    Todo el texto de una página va a un único objeto de texto (un solo
+    BT/ET) en lugar de uno por cada drawString.
+    """
+    
+    def __init__(self, c, data):
+        self.c = c
+        self.data = data
+        self.fmt = _FormatData(data)
+        self.y = PAGE_HEIGHT - PDF_MARGIN
+        self.font = None
+        self.text = c.beginText()
+        self.footer = f"Documento generado automáticamente - Novamedical Services - {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+    
+    def set_font(self, name, size):
+        if self.font != (name, size):
+            self.text.setFont(name, size)
+            self.font = (name, size)
+    
+    def draw_string(self, font, size, x, y, value):
+        self.set_font(font, size)
+        self.text.setTextOrigin(x, y)
+        self.text.textOut(value)
+    
+    def draw(self, ops, y):
+        c = self.c
+        for op in ops:
+            kind = op[0]
+            if kind == OP_TEXT:
+                self.draw_string(op[1], op[2], op[3], y + op[4], op[5])
+            elif kind == OP_FIELD:
+                value = self.data.get(op[5])
+                if value:
+                    self.draw_string(op[1], op[2], op[3], y + op[4], str(value)[:op[6]])
+            elif kind == OP_FORMAT:
+                self.draw_string(op[1], op[2], op[3], y + op[4], op[5].format_map(self.fmt))
+            elif kind == OP_LINE:
+                c.line(op[3], y + op[4], op[5], y + op[4])
+            elif kind == OP_SIGNATURE:
+                self.draw_signature(op, y)
+            elif kind == OP_IMAGE:
+                try:
+                    c.drawImage(op[5], op[3], y + op[4], width=op[6], height=op[7])
+                except Exception:
+                    pass
+    
+    def draw_signature(self, op, y):
+        _, font, size, x, dy, key, w, h, placeholder = op
+        path = self.data.get(key)
+        # Una firma registrada que no se puede leer hace fallar el render (y
+        # el trabajo se reintenta) en vez de emitir la orden sin ella
+        image = signature_image(path) if path else None
+        if image is None:
+            self.draw_string(font, size, x, y - 45, placeholder)
+        elif isinstance(image, VectorSignature):
+            image.draw(self.c, x, y + dy, w, h)
+        else:
+            draw_image_xobject(self.c, image, x, y + dy, w, h)
+    
+    def new_page(self):
+        self.finish_page()
+        self.c.showPage()
+        self.font = None
+        self.text = self.c.beginText()
+        self.y = PAGE_HEIGHT - PDF_MARGIN
+    
+    def finish_page(self):
+        self.draw_string('Helvetica', 7, PDF_MARGIN, 30, self.footer)
+        self.c.drawText(self.text)
+    
+    def render(self, header_ops, header_height, layout, letterhead=None):
+        if letterhead is None or not letterhead.draw(self.c):
+            self.draw(PDF_LETTERHEAD_OPS, self.y)
+        self.draw(header_ops, self.y)
+        self.y -= header_height
         
-        # ===== MEDICIONES =====
-        if data.get('mediciones_parametros'):
-            c.setFont('Helvetica-Bold', 11)
-            c.drawString(margin, y, 'MEDICIONES REALIZADAS')
-            y -= 15
+        for section in layout:
+            rows = section.rows(self.data)
+            if not rows and section.optional:
+                continue
             
-            c.setFont('Helvetica', 9)
-            mediciones_lines = split_text(data['mediciones_parametros'], 80)
-            for line in mediciones_lines:
-                if y < 100:
-                    c.showPage()
-                    y = height - margin - 15
-                c.drawString(margin + 5, y, line)
-                y -= 10
-            y -= 10
-        
-        # ===== PIEZAS DE REEMPLAZO =====
-        piezas = []
-        if data.get('piezas_descripcion1') and data.get('piezas_cantidad1'):
-            piezas.append((data['piezas_descripcion1'], data['piezas_cantidad1']))
-        if data.get('piezas_descripcion2') and data.get('piezas_cantidad2'):
-            piezas.append((data['piezas_descripcion2'], data['piezas_cantidad2']))
-        if data.get('piezas_descripcion3') and data.get('piezas_cantidad3'):
-            piezas.append((data['piezas_descripcion3'], data['piezas_cantidad3']))
-        if data.get('piezas_descripcion4') and data.get('piezas_cantidad4'):
-            piezas.append((data['piezas_descripcion4'], data['piezas_cantidad4']))
-        
-        if piezas:
-            c.setFont('Helvetica-Bold', 11)
-            c.drawString(margin, y, 'PIEZAS DE REEMPLAZO')
-            y -= 15
+            # El título nunca queda solo al pie de la página
+            first_height = rows[0][0] if rows else 0
+            if self.y - section.title_gap - first_height < PDF_BOTTOM:
+                self.new_page()
+            if section.title_ops:
+                self.draw(section.title_ops, self.y)
+                self.y -= section.title_gap
             
-            c.setFont('Helvetica', 9)
-            for descripcion, cantidad in piezas:
-                if y < 100:
-                    c.showPage()
-                    y = height - margin - 15
-                c.drawString(margin + 5, y, f"• {descripcion} - Cant: {cantidad}")
-                y -= 10
-            y -= 5
-        
-        # ===== DETALLES DEL SERVICIO =====
-        if data.get('detalles_servicio'):
-            c.setFont('Helvetica-Bold', 11)
-            c.drawString(margin, y, 'DETALLES Y OBSERVACIONES')
-            y -= 15
+            for height, ops in rows:
+                if self.y - height < PDF_BOTTOM:
+                    self.new_page()
+                    if section.cont_ops:
+                        self.draw(section.cont_ops, self.y)
+                        self.y -= section.title_gap
+                self.draw(ops, self.y)
+                self.y -= height
             
-            c.setFont('Helvetica', 9)
-            detalles_lines = split_text(data['detalles_servicio'], 80)
-            for line in detalles_lines:
-                if y < 100:
-                    c.showPage()
-                    y = height - margin - 15
-                c.drawString(margin + 5, y, line)
-                y -= 10
-            y -= 10
-        
-        # ===== RESOLUCIÓN =====
-        c.setFont('Helvetica-Bold', 11)
-        c.drawString(margin, y, 'RESOLUCIÓN FINAL')
-        y -= 15
-        
-        c.setFont('Helvetica', 9)
-        if data.get('resolucion_operativo') == 'si':
-            c.drawString(margin + 5, y, "✓ Equipo operativo")
-            y -= 10
-        if data.get('resolucion_no_operativo') == 'si':
-            c.drawString(margin + 5, y, "✓ Equipo no operativo")
-            y -= 10
-        if data.get('resolucion_requiere_visita') == 'si':
-            c.drawString(margin + 5, y, "✓ Requiere nueva visita")
-            y -= 10
-        
-        y -= 20
+            self.y -= section.space_after
         
-        # ===== FIRMAS =====
-                # ===== FIRMAS - CORREGIDAS =====
-        if y < 150:
-            c.showPage()
-            y = height - margin
-        
-        # Firmas en horizontal - UNA AL LADO DE LA OTRA
-        sig_h = 50
-        sig_w = 180
-        x_sig_tech = margin
-        x_sig_client = width - margin - sig_w
-        
-        # Posición Y común para ambas firmas
-        start_y = y
-        
-        # Firma Técnico (IZQUIERDA)
-        c.setFont('Helvetica-Bold', 9)
-        c.drawString(x_sig_tech, start_y, "FIRMA INGENIERO")
-        c.setFont('Helvetica', 8)
-        c.drawString(x_sig_tech, start_y - 12, f"Nombre: {data.get('tecnico_nombre', '')}")
+        self.finish_page()
+
+def pdf_image_xobject(img, name):
+    """Imagen PIL codificada una sola vez (Flate, sin ASCII85) para reutilizar en cualquier documento"""
+    xobj = pdfdoc.PDFImageXObject(name)
+    xobj.width, xobj.height = img.size
+    if img.mode == '1':
+        # 1 bit por píxel, filas rellenas a byte: el mismo formato que PDF
+        xobj.colorSpace, xobj.bitsPerComponent = 'DeviceGray', 1
+    elif img.mode == 'L':
+        xobj.colorSpace, xobj.bitsPerComponent = 'DeviceGray', 8
+    else:
+        img = img.convert('RGB')
+        xobj.colorSpace, xobj.bitsPerComponent = 'DeviceRGB', 8
+    xobj.streamContent = zlib.compress(img.tobytes(), 9)
+    xobj._filters = ('FlateDecode',)
+    return xobj
+
+def register_image_xobject(doc, xobj):
+    """Registrar el XObject en el documento (una vez) y devolver su nombre interno.
+    
+    Se registra una copia superficial: ReportLab marca el objeto con su
+    nombre en cada documento, pero los bytes codificados se comparten.
+    """
+    if not doc.hasForm(xobj.name):
+        doc.addForm(xobj.name, copy.copy(xobj))
+    return doc.getXObjectName(xobj.name)
+
+def draw_image_xobject(c, xobj, x, y, width, height):
+    """Dibujar un XObject precodificado ajustado a la caja sin deformarlo (anclado a la izquierda)"""
+    register_image_xobject(c._doc, xobj)
+    scale = min(width / xobj.width, height / xobj.height)
+    w, h = xobj.width * scale, xobj.height * scale
+    c.saveState()
+    c.translate(x, y + (height - h) / 2)
+    c.scale(w, h)
+    c.doForm(xobj.name)
+    c.restoreState()
+
+class PdfLetterhead:
+    """Membrete invariante (logo y datos de la empresa) como form XObject.
+    
+    La primera vez que se usa en el proceso se codifica el logo (JPEG tal
+    cual o Flate, sin ASCII85) y se genera el flujo de contenido del membrete en un canvas
+    auxiliar. Cada documento sólo registra esos objetos ya codificados y
+    los dibuja con un único doForm.
+    
+    Compartir objetos entre documentos no tiene API pública en ReportLab:
+    se usan los métodos del documento del canvas (c._doc) y los atributos
+    de pdfdoc, por eso la versión está fijada en requirements.txt y setup.py.
+    """
+    
+    FORM_NAME = 'membrete'
+    LOGO_NAME = 'membrete_logo'
+    
+    def __init__(self, ops):
+        self.ops = ops
+        self._lock = threading.Lock()
+        self._compiled = None
+    
+    def load_logo(self, path, width, height):
+        """Logo como XObject de imagen listo para incrustar, o None si no existe"""
+        try:
+            logo = pdfdoc.PDFImageXObject(self.LOGO_NAME)
+            logo.bitsPerComponent = 8
+            with Image.open(path) as img:
+                # Más resolución que 2 px por punto no se aprecia impresa
+                if img.format == 'JPEG' and img.mode in ('RGB', 'L') and img.width <= width * 2:
+                    # El JPEG se incrusta tal cual (DCTDecode), sin recodificar
+                    logo.width, logo.height = img.size
+                    logo.colorSpace = 'DeviceRGB' if img.mode == 'RGB' else 'DeviceGray'
+                    with open(path, 'rb') as f:
+                        logo.streamContent = f.read()
+                    logo._filters = ('DCTDecode',)
+                    return logo
+                
+                img = img.convert('RGBA')
+                img.thumbnail((width * 2, height * 2))
+                background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+                rgb = Image.alpha_composite(background, img).convert('RGB')
+            
+            return pdf_image_xobject(rgb, self.LOGO_NAME)
         
-        # Dibujar línea para firma del técnico
-        c.line(x_sig_tech, start_y - 25, x_sig_tech + sig_w, start_y - 25)
+        except Exception as e:
+            logger.warning(f"Logo no disponible {path}: {str(e)}")
+            return None
+    
+    def compile(self):
+        """(logo, fuentes, flujo) del membrete; se calcula una sola vez"""
+        if self._compiled is None:
+            with self._lock:
+                if self._compiled is None:
+                    self._compiled = self._build()
+        return self._compiled
+    
+    def _build(self):
+        y = PAGE_HEIGHT - PDF_MARGIN
+        logo = None
+        code = []
+        for op in self.ops:
+            if op[0] == OP_IMAGE:
+                logo = self.load_logo(op[5], op[6], op[7])
+                if logo is not None:
+                    name = pdfdoc.xObjectName(self.LOGO_NAME)
+                    code.append(f"q {fp_str(op[6], 0, 0, op[7], op[3], y + op[4])} cm /{name} Do Q")
         
-        # Imagen de firma del técnico (si existe)
-        if data.get('tech_sig') and os.path.exists(data['tech_sig']):
-            try:
-                processed_tech_path = process_signature_image(data['tech_sig'])
-                c.drawImage(processed_tech_path, x_sig_tech, start_y - 80, width=sig_w, height=sig_h)
-            except Exception as e:
-                c.drawString(x_sig_tech, start_y - 45, "[Firma del técnico]")
-        else:
-            c.drawString(x_sig_tech, start_y - 45, "[Firma del técnico]")
+        text_ops = [op for op in self.ops if op[0] != OP_IMAGE]
+        scratch = rcanvas.Canvas(BytesIO(), pagesize=A4)
+        renderer = PdfRenderer(scratch, {})
+        renderer.draw(text_ops, y)
+        code.append(renderer.text.getCode())
         
-        # Firma Cliente (DERECHA) - MISMA ALTURA QUE EL TÉCNICO
-        c.setFont('Helvetica-Bold', 9)
-        c.drawString(x_sig_client, start_y, "FIRMA CLIENTE / RESPONSABLE")
-        c.setFont('Helvetica', 8)
-        c.drawString(x_sig_client, start_y - 12, f"Nombre: {data.get('encargado', '')}")
+        # Nombres internos (/F1, /F2...) con que el flujo referencia las fuentes
+        fonts = [(name, scratch._doc.getInternalFontName(name)) for name in dict.fromkeys(op[1] for op in text_ops)]
         
-        # Dibujar línea para firma del cliente
-        c.line(x_sig_client, start_y - 25, x_sig_client + sig_w, start_y - 25)
+        form = pdfdoc.PDFFormXObject(0, 0, PAGE_WIDTH, PAGE_HEIGHT)
+        form.setStreamList(code)
+        return logo, fonts, form.stream
+    
+    def draw(self, c):
+        """Dibujar el membrete en la página actual; False si hay que dibujarlo a mano"""
+        logo, fonts, stream = self.compile()
+        doc = c._doc
         
-        # Imagen de firma del cliente (si existe)
-        if data.get('client_sig') and os.path.exists(data['client_sig']):
-            try:
-                processed_client_path = process_signature_image(data['client_sig'])
-                c.drawImage(processed_client_path, x_sig_client, start_y - 80, width=sig_w, height=sig_h)
-            except Exception as e:
-                c.drawString(x_sig_client, start_y - 45, "[Firma del cliente]")
-        else:
-            c.drawString(x_sig_client, start_y - 45, "[Firma del cliente]")
+        # El flujo precompilado sólo es válido si el documento asigna los
+        # mismos nombres internos a las fuentes (siempre ocurre en una página
+        # nueva, porque se registran en el mismo orden)
+        if any(doc.getInternalFontName(name) != internal for name, internal in fonts):
+            return False
         
-        # Pie de página
-        c.setFont('Helvetica', 7)
-        c.drawString(margin, 30, f"Documento generado automáticamente - Novamedical Services - {datetime.now().strftime('%d/%m/%Y %H:%M')}")
+        form = pdfdoc.PDFFormXObject(0, 0, PAGE_WIDTH, PAGE_HEIGHT)
+        form.stream = stream
+        form.compression = c._pageCompression
+        if logo is not None:
+            register_image_xobject(doc, logo)
+            form.XObjects = doc.xobjDict([self.LOGO_NAME])
+        doc.addForm(self.FORM_NAME, form)
+        c.doForm(self.FORM_NAME)
+        return True
+
+pdf_letterhead = PdfLetterhead(PDF_LETTERHEAD_OPS)
+
+@timed_stage('generate_pdf')
+@traced('generate_pdf')
+def generate_pdf(path, data):
+    """Generar el PDF de una orden a partir del layout precompilado"""
+    try:
+        c = rcanvas.Canvas(path, pagesize=A4)
+        PdfRenderer(c, data).render(PDF_HEADER_OPS, PDF_HEADER_HEIGHT, PDF_LAYOUT, pdf_letterhead)
         c.save()
+        PDFS_RENDERED.inc(result='ok')
+        span = tracer.current()
+        if span.recording:
+            span.set_attribute('orden.id', data.get('id'))
+            span.set_attribute('pdf.size_bytes', os.path.getsize(path))
         logger.info(f"PDF mejorado generado: {path}")
     
     except Exception as e:
+        PDFS_RENDERED.inc(result='error')
         logger.error(f"Error generando PDF {path}: {str(e)}")
         raise
 
-def process_signature_image(image_path):
-    """Procesar imagen de firma para evitar fondos negros"""
+def generate_pdf_atomic(path, data):
+    """generate_pdf a un temporal y renombrar: nunca queda un PDF a medias en path"""
+    tmp_path = f"{path}.{secrets.token_hex(4)}.tmp"
     try:
-        base, ext = os.path.splitext(image_path)
-        processed_path = f"{base}_processed{ext}"
-        
-        with Image.open(image_path) as img:
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
-            
-            background = Image.new('RGBA', img.size, (255, 255, 255, 255))
-            combined = Image.alpha_composite(background, img)
-            rgb_img = combined.convert('RGB')
-            rgb_img.save(processed_path, 'PNG')
-            
-        return processed_path
+        generate_pdf(tmp_path, data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def normalize_signature(img):
+    """Recortar la firma a la tinta y reducirla a la resolución de su caja en el PDF.
+    
+    El canvas del formulario llega al ancho de la pantalla y casi todo es
+    fondo blanco: se compone sobre blanco, se recorta al rectángulo con
+    trazos, se reduce a SIGNATURE_DPI para la caja SIGNATURE_BOX y queda en
+    escala de grises (o 1 bit con SIGNATURE_BILEVEL). None si no hay trazos.
+    """
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    
+    background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+    gray = Image.alpha_composite(background, img).convert('L')
+    
+    bbox = gray.point(lambda v: 255 if v < 224 else 0).getbbox()
+    if bbox is None:
+        return None
+    
+    pad = 4
+    left, top, right, bottom = bbox
+    gray = gray.crop((max(left - pad, 0), max(top - pad, 0), min(right + pad, gray.width), min(bottom + pad, gray.height)))
+    
+    max_size = tuple(round(side * config.SIGNATURE_DPI / 72) for side in SIGNATURE_BOX)
+    if gray.width > max_size[0] or gray.height > max_size[1]:
+        gray.thumbnail(max_size, Image.LANCZOS)
+    
+    if config.SIGNATURE_BILEVEL:
+        return gray.point(lambda v: 255 if v >= 128 else 0, '1')
+    return gray
+
+@timed_stage('process_signature_image')
+@traced('process_signature_image')
+def process_signature_image(data, name):
+    """Firma normalizada y codificada para el PDF, sin pasar por disco; None si está en blanco"""
+    tracer.current().set_attribute('firma.bytes', len(data))
+    try:
+        with Image.open(BytesIO(data)) as img:
+            img = normalize_signature(img)
+        return None if img is None else pdf_image_xobject(img, name)
         
     except Exception as e:
-        logger.warning(f"Error procesando imagen {image_path}: {str(e)}")
-        return image_path
+        logger.warning(f"Error procesando imagen de firma: {str(e)}")
+        return None
+
+SIGNATURE_MAX_STROKES = 200
+SIGNATURE_MAX_POINTS = 10000
+SIGNATURE_MAX_CANVAS = 4096
+SIGNATURE_TOLERANCE = 0.5  # px: desviación máxima al simplificar los trazos
+
+def simplify_stroke(points, tolerance):
+    """Ramer-Douglas-Peucker: quitar puntos que se desvían menos de tolerance de la recta"""
+    if len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x0, y0), (x1, y1) = points[first], points[last]
+        dx, dy = x1 - x0, y1 - y0
+        norm = (dx * dx + dy * dy) ** 0.5
+        worst, index = -1.0, None
+        for i in range(first + 1, last):
+            px, py = points[i]
+            if norm:
+                dist = abs(dy * (px - x0) - dx * (py - y0)) / norm
+            else:
+                dist = ((px - x0) ** 2 + (py - y0) ** 2) ** 0.5
+            if dist > worst:
+                worst, index = dist, i
+        if index is not None and worst > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+def parse_signature_strokes(text):
+    """Validar los trazos enviados por el formulario y devolver su JSON canónico.
+    
+    Formato: {"w": ancho, "h": alto, "s": [[x0, y0, dx1, dy1, ...], ...]},
+    coordenadas enteras del canvas y cada punto como diferencia con el
+    anterior. La forma canónica se desplaza al rectángulo con tinta, así que
+    la misma firma en otra posición del canvas comparte archivo en el almacén,
+    y cada trazo se simplifica (puntos casi alineados no cambian el dibujo).
+    None si no hay trazos; ValueError si el contenido no es válido.
+    """
+    try:
+        payload = json.loads(text)
+        w, h, raw_strokes = payload['w'], payload['h'], payload['s']
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Firma vectorial no válida: {str(e)}")
+    
+    def is_int(v):
+        return isinstance(v, int) and not isinstance(v, bool)
+    
+    if not (is_int(w) and is_int(h) and 0 < w <= SIGNATURE_MAX_CANVAS and 0 < h <= SIGNATURE_MAX_CANVAS):
+        raise ValueError("Firma vectorial no válida: tamaño de canvas")
+    if not isinstance(raw_strokes, list) or len(raw_strokes) > SIGNATURE_MAX_STROKES:
+        raise ValueError("Firma vectorial no válida: demasiados trazos")
+    
+    strokes = []
+    total = 0
+    for deltas in raw_strokes:
+        if not isinstance(deltas, list) or len(deltas) < 2 or len(deltas) % 2 or not all(is_int(v) for v in deltas):
+            raise ValueError("Firma vectorial no válida: trazo mal formado")
+        total += len(deltas) // 2
+        if total > SIGNATURE_MAX_POINTS:
+            raise ValueError("Firma vectorial no válida: demasiados puntos")
+        
+        x, y = 0, 0
+        points = []
+        for i in range(0, len(deltas), 2):
+            x += deltas[i]
+            y += deltas[i + 1]
+            if not (0 <= x <= w and 0 <= y <= h):
+                raise ValueError("Firma vectorial no válida: punto fuera del canvas")
+            points.append((x, y))
+        strokes.append(simplify_stroke(points, SIGNATURE_TOLERANCE))
+    
+    if not strokes:
+        return None
+    
+    min_x = min(x for points in strokes for x, _ in points)
+    min_y = min(y for points in strokes for _, y in points)
+    max_x = max(x for points in strokes for x, _ in points)
+    max_y = max(y for points in strokes for _, y in points)
+    
+    canonical = []
+    for points in strokes:
+        px, py = min_x, min_y
+        deltas = []
+        for x, y in points:
+            deltas += [x - px, y - py]
+            px, py = x, y
+        canonical.append(deltas)
+    
+    return json.dumps({'w': max_x - min_x, 'h': max_y - min_y, 's': canonical}, separators=(',', ':')).encode()
+
+class VectorSignature:
+    """Firma como trazados PDF; los operadores se generan una vez por firma"""
+    
+    LINE_WIDTH = 3  # el mismo grosor que usa el canvas del formulario
+    
+    def __init__(self, data):
+        payload = json.loads(data)
+        self.width, self.height = payload['w'], payload['h']
+        ops = [f"1 J 1 j {self.LINE_WIDTH} w"]
+        for deltas in payload['s']:
+            x, y = 0, 0
+            for i in range(0, len(deltas), 2):
+                x += deltas[i]
+                y += deltas[i + 1]
+                if i == 0:
+                    ops.append(f"{x} {self.height - y} m")
+                    if len(deltas) == 2:
+                        # Un toque sin movimiento: el extremo redondeado dibuja un punto
+                        ops.append(f"{x} {self.height - y} l")
+                else:
+                    ops.append(f"{x} {self.height - y} l")
+            ops.append("S")
+        self.ops = '\n'.join(ops)
+    
+    def draw(self, c, x, y, width, height):
+        """Dibujar ajustada a la caja sin deformarla (anclada a la izquierda)"""
+        lw = self.LINE_WIDTH
+        scale = min(width / (self.width + lw), height / (self.height + lw))
+        c.saveState()
+        c.translate(x + lw / 2 * scale, y + (height - (self.height + lw) * scale) / 2 + lw / 2 * scale)
+        c.scale(scale, scale)
+        c.addLiteral(self.ops)
+        c.restoreState()
+
+@functools.lru_cache(maxsize=config.SIGNATURE_CACHE_SIZE)
+def signature_image(path):
+    """Firma lista para incrustar; una ruta del almacén siempre tiene el mismo contenido"""
+    data = signature_store.get(path)
+    if path.endswith('.json'):
+        return VectorSignature(data)
+    name = 'firma_' + hashlib.sha1(path.encode()).hexdigest()[:16]
+    return process_signature_image(data, name)
 
 def split_text(text, n):
     """Dividir texto en líneas de máximo n caracteres"""
@@ -1763,53 +5021,809 @@ def split_text(text, n):
     
     return lines
 
-def send_email_with_attachment(recipient, subject, body, attachment_path):
-    """Enviar email con archivo adjunto"""
-    if not config.SMTP_HOST or config.SMTP_HOST == 'smtp.example.com':
-        raise RuntimeError('Servidor SMTP no configurado.')
+# --- Envío de correo: sesiones SMTP persistentes + bandeja de salida ---
+class SmtpPermanentError(Exception):
+    """Error que no se resuelve reintentando (configuración, adjunto inexistente...)"""
+
+def smtp_configurado():
+    return bool(config.SMTP_HOST) and config.SMTP_HOST != 'smtp.example.com'
+
+def build_email_message(recipient, subject, body, attachment_path):
+    """Construir el mensaje con el PDF adjunto"""
+    if attachment_path and not pdf_store.exists(attachment_path):
+        raise SmtpPermanentError(f"Archivo adjunto no encontrado: {attachment_path}")
     
-    if not os.path.exists(attachment_path):
-        raise FileNotFoundError(f"Archivo adjunto no encontrado: {attachment_path}")
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = config.EMAIL_SENDER or config.SMTP_USER
+    msg['To'] = recipient
+    msg.set_content(body or '')
     
-    try:
-        msg = EmailMessage()
-        msg['Subject'] = subject
-        msg['From'] = config.EMAIL_SENDER or config.SMTP_USER
-        msg['To'] = recipient
-        msg.set_content(body)
-        
-        with open(attachment_path, 'rb') as f:
-            file_data = f.read()
-            file_name = os.path.basename(attachment_path)
-        
+    if attachment_path:
+        file_data = pdf_store.read(attachment_path)
         msg.add_attachment(
             file_data,
             maintype='application',
             subtype='pdf',
-            filename=file_name
+            filename=os.path.basename(attachment_path)
         )
+    return msg
+
+class DeliveryStats:
+    """Contadores de rendimiento del envío de correo"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.batches = 0
+        self.connections_opened = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+    
+    def record_sent(self, latency):
+        with self._lock:
+            self.sent += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+    
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+    
+    def snapshot(self):
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started_at, 1e-9)
+            return {
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'batches': self.batches,
+                'connections_opened': self.connections_opened,
+                'throughput_per_min': round(self.sent / elapsed * 60, 2),
+                'avg_latency_ms': round(self.latency_total / self.sent * 1000, 2) if self.sent else 0.0,
+                'max_latency_ms': round(self.latency_max * 1000, 2),
+            }
+
+delivery_stats = DeliveryStats()
+
+class SmtpPool:
+    """Pool de sesiones SMTP autenticadas que se reutilizan entre mensajes.
+    
+    Cada sesión paga STARTTLS y login una sola vez; las sesiones ociosas por
+    más de SMTP_IDLE_TIMEOUT se cierran y las caídas se descartan para que la
+    siguiente petición reconecte.
+    """
+    
+    def __init__(self, size, idle_timeout):
+        self.idle_timeout = idle_timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+    
+    def connect(self):
+        if not smtp_configurado():
+            raise SmtpPermanentError('Servidor SMTP no configurado.')
         
-        with smtplib.SMTP(config.SMTP_HOST, config.SMTP_PORT) as server:
-            server.starttls()
+        server = smtplib.SMTP(config.SMTP_HOST, config.SMTP_PORT, timeout=config.SMTP_TIMEOUT)
+        try:
+            if config.SMTP_USE_TLS:
+                server.starttls()
             if config.SMTP_USER and config.SMTP_PASS:
                 server.login(config.SMTP_USER, config.SMTP_PASS)
-            server.send_message(msg)
+        except Exception:
+            self.discard(server)
+            raise
+        delivery_stats.incr('connections_opened')
+        return server
+    
+    def acquire(self):
+        """Obtener una sesión viva (reutilizada o nueva)"""
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    server, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self.connect()
+                
+                if time.monotonic() - last_used > self.idle_timeout:
+                    self.discard(server)
+                    continue
+                return server
+        except Exception:
+            self._slots.release()
+            raise
+    
+    def release(self, server):
+        if server is not None:
+            self._idle.put((server, time.monotonic()))
+        self._slots.release()
+    
+    def reconnect(self, server):
+        """Reemplazar una sesión caída sin liberar el cupo"""
+        self.discard(server)
+        return self.connect()
+    
+    def discard(self, server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+    
+    def close_all(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self.discard(server)
+
+smtp_pool = SmtpPool(config.SMTP_POOL_SIZE, config.SMTP_IDLE_TIMEOUT)
+
+# Errores que indican que la sesión ya no sirve y hay que reconectar
+SMTP_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+@timed_stage('smtp_send')
+@traced('smtp send', SPAN_KIND_CLIENT)
+def _send_over(server, msg):
+    """Enviar por una sesión del pool reconectando una vez si está caída"""
+    try:
+        server.send_message(msg)
+    except SMTP_CONNECTION_ERRORS:
+        server = smtp_pool.reconnect(server)
+        server.send_message(msg)
+    return server
+
+def encolar_email(recipient, subject, body, attachment_path, informe_id=None):
+    """Registrar un correo en la bandeja de salida (dentro de storage.transaction() si hay una abierta)"""
+    storage.enqueue_email(informe_id, recipient, subject, body, attachment_path, tracer.current().traceparent)
+
+def retry_delay(intentos, base=None, max_delay=None):
+    """Backoff exponencial: base, 2·base, 4·base... con tope (por omisión los de SMTP)"""
+    base = config.SMTP_RETRY_BASE if base is None else base
+    max_delay = config.SMTP_RETRY_MAX_DELAY if max_delay is None else max_delay
+    return min(base * (2 ** max(intentos - 1, 0)), max_delay)
+
+class MailDelivery:
+    """Drena la bandeja de salida (tabla outbox) en lotes enviados por una misma sesión SMTP"""
+    
+    def __init__(self, workers, poll_interval, batch_size):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'mail-worker-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = os.getpid()
+    
+    def notify(self):
+        self.ensure_started()
+        self._wakeup.set()
+    
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._pid = None
+        smtp_pool.close_all()
+    
+    def claim_batch(self):
+        """Tomar atómicamente hasta batch_size mensajes cuyo reintento ya venció"""
+        stale = datetime.fromtimestamp(time.time() - config.JOB_TIMEOUT).isoformat()
+        return storage.claim_emails(stale, self.batch_size)
+    
+    def _mark_sent(self, item):
+        now = datetime.now().isoformat()
+        with storage.transaction():
+            storage.update_email(item['id'], estado='sent', error=None, sent_at=now, updated_at=now)
+            if item['informe_id']:
+                storage.update_informe(item['informe_id'], estado='sent')
+    
+    def _mark_failed(self, item, error, permanent=False):
+        now = datetime.now().isoformat()
+        with storage.transaction():
+            if permanent or item['intentos'] >= config.SMTP_MAX_RETRIES:
+                storage.update_email(item['id'], estado='failed', error=error, updated_at=now)
+                if item['informe_id']:
+                    storage.update_informe(item['informe_id'], estado='failed')
+                delivery_stats.incr('failed')
+                logger.error(f"Correo {item['id']} a {item['destinatario']} descartado: {error}")
+            else:
+                delay = retry_delay(item['intentos'])
+                storage.update_email(
+                    item['id'], estado='queued', error=error, next_attempt_at=time.time() + delay, updated_at=now
+                )
+                delivery_stats.incr('retried')
+                logger.warning(f"Correo {item['id']} a {item['destinatario']} reintenta en {delay:.0f}s: {error}")
+    
+    def _release(self, items):
+        """Devolver a la cola sin penalizar mensajes que no llegaron a intentarse"""
+        if not items:
+            return
+        storage.release_emails([item['id'] for item in items])
+    
+    def send_batch(self):
+        """Enviar un lote por una sola sesión; devuelve el número de mensajes procesados"""
+        items = self.claim_batch()
+        if not items:
+            return 0
+        delivery_stats.incr('batches')
         
-        logger.info(f"Email enviado correctamente a {recipient}")
+        try:
+            server = smtp_pool.acquire()
+        except SmtpPermanentError as e:
+            for item in items:
+                self._mark_failed(item, str(e), permanent=True)
+            return len(items)
+        except Exception as e:
+            for item in items:
+                self._mark_failed(item, f'Conexión SMTP: {str(e)}')
+            return len(items)
+        
+        try:
+            for i, item in enumerate(items):
+                # Los correos de un lote son de órdenes distintas: cada uno
+                # continúa la traza del trabajo que lo encoló
+                with tracer.trace('enviar correo', item['traceparent'], SPAN_KIND_CLIENT, {
+                    'orden.id': item['informe_id'], 'email.intento': item['intentos'], 'server.address': config.SMTP_HOST,
+                }) as span:
+                    try:
+                        msg = build_email_message(item['destinatario'], item['asunto'], item['cuerpo'], item['adjunto_path'])
+                        started = time.monotonic()
+                        server = _send_over(server, msg)
+                        delivery_stats.record_sent(time.monotonic() - started)
+                        self._mark_sent(item)
+                        logger.info(f"Email enviado correctamente a {item['destinatario']}")
+                    except SmtpPermanentError as e:
+                        span.record_exception(e)
+                        self._mark_failed(item, str(e), permanent=True)
+                    except SMTP_CONNECTION_ERRORS as e:
+                        # La reconexión también falló: reintentar todo el resto más tarde
+                        span.record_exception(e)
+                        smtp_pool.discard(server)
+                        server = None
+                        self._mark_failed(item, str(e))
+                        self._release(items[i + 1:])
+                        break
+                    except Exception as e:
+                        span.record_exception(e)
+                        self._mark_failed(item, str(e))
+        finally:
+            smtp_pool.release(server)
+        return len(items)
     
-    except Exception as e:
-        logger.error(f"Error enviando email a {recipient}: {str(e)}")
-        raise
+    def run_pending(self):
+        """Enviar en el hilo actual todos los mensajes vencidos"""
+        processed = 0
+        while True:
+            n = self.send_batch()
+            if not n:
+                return processed
+            processed += n
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.send_batch():
+                    continue
+            except Exception as e:
+                logger.error(f"Error procesando bandeja de salida: {str(e)}")
+            
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+mail_delivery = MailDelivery(config.SMTP_POOL_SIZE, config.JOB_POLL_INTERVAL, config.SMTP_BATCH_SIZE)
+
+# --- Cola de trabajos en segundo plano ---
+ESTADOS_ORDEN = {
+    'pending': 'En proceso',
+    'rendered': 'PDF generado',
+    'registered': 'Registrada',
+    'sent': 'Enviada',
+    'failed': 'Error',
+}
+
+def enqueue_job(informe_id, tipo):
+    """Registrar un trabajo pendiente (dentro de storage.transaction() si hay una abierta)"""
+    enqueue_jobs([informe_id], tipo)
+
+def enqueue_jobs(informe_ids, tipo):
+    """enqueue_job para un lote de órdenes, en un solo INSERT"""
+    storage.enqueue_jobs(informe_ids, tipo, tracer.current().traceparent)
+
+def informe_a_datos_pdf(row):
+    """Construir el diccionario que espera generate_pdf a partir de una fila de informes"""
+    data = {field.name: row.get(field.name) or '' for field in FORM_FIELDS}
+    data['id'] = row['id']
+    # Checklist de las tablas hijas con los valores del formulario ('si', 'aplica'...)
+    checklist = row.get('checklist') or {}
+    for item in CHECKLIST_ITEMS:
+        data[item.key] = item.decode(checklist.get(item.code))
+    data['piezas'] = row.get('piezas') or []
+    data['tech_sig'] = row.get('tecnico_firma')
+    data['client_sig'] = row.get('cliente_firma')
+    return data
+
+def url_descarga(row):
+    """URL del PDF, o None si aún no hay; con el hash del PDF en ?v= se cachea como inmutable"""
+    if not row['pdf_path'] and row['estado'] != 'registered':
+        return None
+    return url_for('download', id=row['id'], v=(row['pdf_sha256'] or '')[:16] or None)
+
+def destinatario_para(data):
+    """Elegir el email de destino: contacto o, en su defecto, encargado"""
+    if es_email_valido(data.get('contacto')):
+        return data['contacto'].strip()
+    if es_email_valido(data.get('encargado')):
+        return data['encargado'].strip()
+    return None
+
+def job_render(informe_id):
+    """Generar el PDF de una orden y dejar su correo en la bandeja de salida"""
+    row = storage.get_informe(informe_id)
+    if not row:
+        raise LookupError(f"Orden {informe_id} no existe")
+    
+    key = f'orden_trabajo_{informe_id}.pdf'
+    data = informe_a_datos_pdf(row)
+    with pdf_store.staged(key) as tmp_path:
+        generate_pdf(tmp_path, data)
+        pdf_sha256 = sha256_file(tmp_path)
+    pdf_path = pdf_store.ref(key)
+    
+    with storage.transaction():
+        storage.update_informe(informe_id, pdf_path=pdf_path, pdf_sha256=pdf_sha256, estado='rendered')
+        recipient = destinatario_para(data)
+        if recipient:
+            encolar_email(
+                recipient,
+                f'Orden de Trabajo Novamedical #{informe_id} - {data["institucion"]}',
+                f'Se adjunta la orden de trabajo #{informe_id} para {data["institucion"]}.\n\nFecha del servicio: {data["fecha"]}\nTécnico: {data["tecnico_nombre"]}',
+                pdf_path,
+                informe_id=informe_id
+            )
+        else:
+            logger.info(f"Orden {informe_id} generada sin envío de email")
+    
+    if recipient:
+        mail_delivery.notify()
+
+JOB_HANDLERS = {
+    'render': job_render,
+}
+
+class JobQueue:
+    """Pool de hilos que consume la tabla jobs del backend de informes.
+    
+    Los trabajos se persisten en la BD, por lo que sobreviven a reinicios y
+    pueden ser tomados por cualquier proceso gunicorn. Cada proceso arranca
+    su propio pool la primera vez que atiende una petición.
+    
+    Un trabajo que falla, o cuyo proceso murió (sin latido durante
+    JOB_TIMEOUT), vuelve a la cola con backoff exponencial hasta
+    JOB_MAX_ATTEMPTS intentos; después queda 'failed' junto con su orden.
+    Mientras corre, un hilo de latido renueva su updated_at para que otro
+    worker no lo tome por abandonado aunque tarde más que JOB_TIMEOUT.
+    """
+    
+    def __init__(self, workers, poll_interval):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._running = set()
+        self._heartbeat_pid = None
+    
+    def ensure_started(self):
+        """Arrancar los hilos en este proceso (idempotente, seguro tras fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = os.getpid()
+            logger.info(f"Cola de trabajos iniciada con {self.workers} hilos (pid {self._pid})")
+    
+    def notify(self):
+        self.ensure_started()
+        self._wakeup.set()
+    
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._pid = None
+        self._heartbeat_pid = None
+    
+    def _ensure_heartbeat(self):
+        # Aparte de ensure_started: run_pending procesa trabajos sin hilos del pool
+        if self._heartbeat_pid == os.getpid():
+            return
+        with self._lock:
+            if self._heartbeat_pid == os.getpid():
+                return
+            threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True).start()
+            self._heartbeat_pid = os.getpid()
+    
+    def _heartbeat(self):
+        while not self._stop.wait(config.JOB_TIMEOUT / 3):
+            ids = list(self._running)
+            if not ids:
+                continue
+            try:
+                storage.touch_jobs(ids)
+            except Exception as e:
+                logger.error(f"Error renovando trabajos en curso: {str(e)}")
+    
+    def _retry_or_fail(self, job, error):
+        """Devolver el trabajo a la cola con espera, o marcarlo 'failed' si agotó sus intentos.
+        
+        Devuelve True si quedó 'failed' (la orden la marca quien llama).
+        """
+        now = datetime.now().isoformat()
+        if job['intentos'] >= config.JOB_MAX_ATTEMPTS:
+            storage.update_job(job['id'], estado='failed', error=error, updated_at=now)
+            logger.error(f"Trabajo {job['id']} ({job['tipo']}) de orden {job['informe_id']} descartado tras {job['intentos']} intentos: {error}")
+            return True
+        delay = retry_delay(job['intentos'], config.JOB_RETRY_BASE, config.JOB_RETRY_MAX_DELAY)
+        storage.update_job(job['id'], estado='queued', error=error, next_attempt_at=time.time() + delay, updated_at=now)
+        logger.warning(f"Trabajo {job['id']} ({job['tipo']}) de orden {job['informe_id']} reintenta en {delay:.0f}s: {error}")
+        return False
+    
+    def claim(self):
+        """Tomar atómicamente el siguiente trabajo pendiente cuya espera ya venció"""
+        stale = datetime.fromtimestamp(time.time() - config.JOB_TIMEOUT).isoformat()
+        with storage.transaction(immediate=True):
+            # Recuperar trabajos abandonados por un proceso que murió: cuentan
+            # como un intento, así un render que tumba al worker no se repite sin fin
+            for abandonado in storage.jobs_abandonados(stale):
+                if self._retry_or_fail(abandonado, 'Abandonado: sin latido durante JOB_TIMEOUT'):
+                    storage.update_informe(abandonado['informe_id'], estado='failed')
+            return storage.claim_job()
+    
+    def run_job(self, job):
+        self._ensure_heartbeat()
+        self._running.add(job['id'])
+        try:
+            # Continúa la traza de la petición que encoló el trabajo
+            with tracer.trace(f"job {job['tipo']}", job['traceparent'], SPAN_KIND_CONSUMER, {
+                'orden.id': job['informe_id'], 'job.id': job['id'], 'job.intento': job['intentos'],
+            }) as span:
+                return self._run_handler(job, span)
+        finally:
+            self._running.discard(job['id'])
+    
+    def _run_handler(self, job, span):
+        handler = JOB_HANDLERS[job['tipo']]
+        try:
+            handler(job['informe_id'])
+        except Exception as e:
+            span.record_exception(e)
+            with storage.transaction():
+                if self._retry_or_fail(job, str(e)):
+                    storage.update_informe(job['informe_id'], estado='failed')
+            return False
+        
+        storage.update_job(job['id'], estado='done', error=None, updated_at=datetime.now().isoformat())
+        return True
+    
+    def run_pending(self):
+        """Procesar en el hilo actual todos los trabajos pendientes"""
+        processed = 0
+        while True:
+            job = self.claim()
+            if not job:
+                return processed
+            self.run_job(job)
+            processed += 1
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.claim()
+            except Exception as e:
+                logger.error(f"Error leyendo cola de trabajos: {str(e)}")
+                job = None
+            
+            if job:
+                # Un error al registrar el resultado no debe matar el hilo: el
+                # trabajo queda 'running' y claim lo recupera tras JOB_TIMEOUT
+                try:
+                    self.run_job(job)
+                except Exception as e:
+                    logger.error(f"Error procesando trabajo {job['id']}: {str(e)}")
+                continue
+            
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+job_queue = JobQueue(config.JOB_WORKERS, config.JOB_POLL_INTERVAL)
+
+def start_background_workers():
+    """Arrancar en este proceso los hilos de la cola de trabajos y de la bandeja de salida.
+    
+    Lo llaman el hook post_worker_init de gunicorn (gunicorn.conf.py) y el
+    arranque con python, así los trabajos pendientes se procesan sin esperar
+    la primera petición.
+    """
+    job_queue.ensure_started()
+    mail_delivery.ensure_started()
+
+def stop_background_workers():
+    """Detener los hilos y guardar las firmas pendientes (hook worker_exit de gunicorn)"""
+    job_queue.stop()
+    mail_delivery.stop()
+    signature_store.flush()
+
+@app.before_request
+def start_job_queue():
+    # Respaldo para servidores WSGI sin el hook de arranque (idempotente)
+    start_background_workers()
+
+# --- Caché de PDF bajo demanda ---
+class PdfCache:
+    """Directorio de PDF generados al descargarlos, acotado en bytes (LRU).
+    
+    Cada archivo se nombra por orden y huella de sus datos, así una fila
+    modificada nunca sirve un PDF viejo. Cada acceso actualiza el mtime y,
+    al superar max_bytes, se borran los menos usados hasta bajar al 90%.
+    Peticiones simultáneas por la misma orden esperan a un único render.
+    El SHA-256 de cada PDF (ETag de /download) se calcula una vez por archivo.
+    
+    El tamaño se lleva por proceso y se recalcula del disco al desalojar:
+    con varios workers gunicorn la cota es aproximada.
+    """
+    
+    def __init__(self, directory, max_bytes):
+        # Absoluta: send_file resuelve las relativas contra la raíz de la app
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._digests = {}
+        self._size = None
+        os.makedirs(self.directory, exist_ok=True)
+    
+    def path_for(self, row):
+        data = {k: v for k, v in row.items() if k not in ('pdf_path', 'pdf_sha256', 'estado')}
+        digest = hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, f"orden_trabajo_{row['id']}-{digest}.pdf")
+    
+    def get(self, row):
+        """Ruta del PDF de la fila, generándolo si no está en caché"""
+        path = self.path_for(row)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+        
+        with self._lock:
+            done = self._inflight.get(path)
+            leader = done is None
+            if leader:
+                done = self._inflight[path] = threading.Event()
+        
+        if not leader:
+            done.wait()
+            if not os.path.exists(path):
+                raise RuntimeError(f"No se pudo generar el PDF de la orden {row['id']}")
+            return path
+        
+        try:
+            generate_pdf_atomic(path, informe_a_datos_pdf(row))
+        finally:
+            with self._lock:
+                del self._inflight[path]
+                self._digests.pop(path, None)
+            done.set()
+        
+        self._added(os.path.getsize(path))
+        return path
+    
+    def digest(self, path):
+        """SHA-256 del PDF en caché, calculado sólo la primera vez que se pide"""
+        with self._lock:
+            digest = self._digests.get(path)
+        if digest is None:
+            digest = sha256_file(path)
+            with self._lock:
+                self._digests[path] = digest
+        return digest
+    
+    def _added(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._size = self._evict()
+    
+    def _scan(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pdf'):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries, sum(size for _, size, _ in entries)
+    
+    def _evict(self):
+        """Borrar los PDF menos usados hasta quedar en el 90% de max_bytes"""
+        entries, total = self._scan()
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._digests.pop(path, None)
+            total -= size
+            removed += 1
+        logger.info(f"Caché de PDF: {removed} archivos desalojados, {total // 1024} KB en uso")
+        return total
+
+pdf_cache = PdfCache(config.PDF_CACHE_DIR, config.PDF_CACHE_MAX_MB * 1024 * 1024)
+
+# --- Exportación masiva (ZIP en streaming) ---
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+class ZipStream:
+    """Destino de escritura para zipfile que acumula lo escrito hasta que se entrega.
+    
+    Sin seek(), zipfile escribe cada entrada con descriptor de datos al final,
+    así el ZIP se puede enviar a medida que se arma, sin tenerlo en memoria.
+    """
+    
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self._offset
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def pdf_para_exportar(row):
+    """(mtime, trozos) del PDF de la orden; si falta en el almacén, el de la caché bajo demanda"""
+    st = pdf_store.stat(row['pdf_path']) if row['pdf_path'] else None
+    if st:
+        return st[1], pdf_store.iter_chunks(row['pdf_path'], EXPORT_CHUNK_SIZE)
+    
+    path = pdf_cache.get(storage.get_informe(row['id']))
+    return os.path.getmtime(path), iter_file(path, EXPORT_CHUNK_SIZE)
+
+def exportar_zip(filters):
+    """Generador con los bytes del ZIP: un PDF por orden más indice.csv.
+    
+    Las órdenes se leen por lotes (EXPORT_BATCH_SIZE) sin mantener una
+    conexión abierta mientras el cliente descarga, y cada PDF se copia en
+    trozos de EXPORT_CHUNK_SIZE: la memoria no crece con el tamaño del ZIP.
+    """
+    stream = ZipStream()
+    indice = StringIO()
+    writer = csv.writer(indice)
+    writer.writerow(['id', 'fecha', 'institucion', 'tecnico', 'estado', 'archivo'])
+    total = 0
+    
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        after_id = 0
+        while True:
+            rows = storage.export_informes(filters, after_id, config.EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            after_id = rows[-1]['id']
+            
+            for row in rows:
+                archivo = f"orden_trabajo_{row['id']}.pdf"
+                try:
+                    mtime, chunks = pdf_para_exportar(row)
+                except Exception as e:
+                    logger.error(f"Error exportando orden {row['id']}: {str(e)}")
+                    writer.writerow([row['id'], row['fecha'], row['institucion'], row['tecnico_nombre'], row['estado'], ''])
+                    continue
+                
+                info = zipfile.ZipInfo(archivo, date_time=time.localtime(mtime)[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with zf.open(info, 'w') as dest:
+                    for chunk in chunks:
+                        dest.write(chunk)
+                        data = stream.drain()
+                        if data:
+                            yield data
+                
+                writer.writerow([row['id'], row['fecha'], row['institucion'], row['tecnico_nombre'], row['estado'], archivo])
+                total += 1
+                data = stream.drain()
+                if data:
+                    yield data
+        
+        zf.writestr('indice.csv', indice.getvalue().encode('utf-8-sig'))
+    
+    yield stream.drain()
+    logger.info(f"Exportación completada: {total} órdenes {filters}")
+
+@app.route('/export')
+def export():
+    """ZIP con los PDF de las órdenes: ?institucion=&tecnico=&desde=AAAA-MM-DD&hasta=AAAA-MM-DD"""
+    filters = {
+        name: request.args[name].strip()
+        for name in EXPORT_FILTERS
+        if request.args.get(name, '').strip()
+    }
+    for name in ('desde', 'hasta'):
+        if name in filters:
+            try:
+                datetime.strptime(filters[name], '%Y-%m-%d')
+            except ValueError:
+                flash(f'Fecha no válida en "{name}" (use AAAA-MM-DD)', 'error')
+                return redirect(url_for('index'))
+    
+    if not filters:
+        flash('Indique al menos un filtro (institución, técnico o rango de fechas) para exportar', 'error')
+        return redirect(url_for('index'))
+    
+    filename = f"ordenes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return Response(
+        exportar_zip(filters),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
 
 # --- Health Check ---
 @app.route('/health')
 def health_check():
     """Endpoint de verificación de salud"""
     try:
-        with db_connection() as conn:
-            conn.execute('SELECT 1').fetchone()
+        storage.ping()
+        pdf_store.ping()
         
-        required_dirs = [config.UPLOADS_DIR, config.PDF_DIR]
+        required_dirs = [config.UPLOADS_DIR, config.SIGNATURES_DIR, config.PDF_DIR, config.PDF_CACHE_DIR]
         for directory in required_dirs:
             if not os.path.exists(directory):
                 os.makedirs(directory, exist_ok=True)
@@ -1817,7 +5831,10 @@ def health_check():
         return {
             'status': 'healthy',
             'database': 'ok',
+            'db_pool': db_pool.stats(),
             'directories': 'ok',
+            'files': 's3' if isinstance(pdf_store, S3BlobStore) else 'local',
+            'email': delivery_stats.snapshot(),
             'timestamp': datetime.now().isoformat()
         }
     
@@ -1829,9 +5846,208 @@ def health_check():
             'timestamp': datetime.now().isoformat()
         }, 500
 
+# --- Métricas de pools y colas, leídas en cada scrape ---
+def _delivery_counts():
+    stats = delivery_stats.snapshot()
+    return {(result,): stats[result] for result in ('sent', 'failed', 'retried')}
+
+def _db_pool_gauges():
+    stats = db_pool.stats()
+    return {('in_use',): stats['in_use'], ('idle',): stats['idle']}
+
+def _db_pool_counts():
+    stats = db_pool.stats()
+    return {('opened',): stats['opened'], ('reused',): stats['reused']}
+
+def _queue_depth():
+    # Sólo los estados activos: usan idx_jobs_estado / idx_outbox_estado y no recorren el historial
+    return storage.queue_depth()
+
+metrics.callback('novamedical_emails_total', 'Correos enviados, descartados y reintentados', _delivery_counts,
+                 kind='counter', labels=('result',))
+metrics.callback('novamedical_smtp_connections_opened_total', 'Sesiones SMTP abiertas',
+                 lambda: {(): delivery_stats.snapshot()['connections_opened']}, kind='counter')
+metrics.callback('novamedical_db_pool_connections', 'Conexiones SQLite del pool', _db_pool_gauges, labels=('state',))
+metrics.callback('novamedical_db_pool_checkouts_total', 'Conexiones SQLite abiertas o reutilizadas', _db_pool_counts,
+                 kind='counter', labels=('kind',))
+metrics.callback('novamedical_queue_depth', 'Trabajos de render y correos pendientes o en curso', _queue_depth,
+                 labels=('queue', 'estado'))
+metrics.callback('novamedical_signature_cache_hits_total', 'Firmas servidas desde la caché en memoria',
+                 lambda: {(): signature_image.cache_info().hits}, kind='counter')
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métricas del proceso en el formato de texto de Prometheus"""
+    return Response(metrics.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# --- Regeneración masiva de PDF (CLI) ---
+def _init_regeneration_worker():
+    # Un mensaje por PDF ensucia la salida cuando se generan miles
+    logger.setLevel(logging.WARNING)
+
+def _regenerar_pdf(task):
+    """Ejecutado en un proceso hijo: sólo genera y publica el archivo, no toca la BD"""
+    informe_id, key, data = task
+    try:
+        with pdf_store.staged(key) as tmp_path:
+            generate_pdf(tmp_path, data)
+            pdf_sha256 = sha256_file(tmp_path)
+        return informe_id, pdf_store.ref(key), pdf_sha256, None
+    except Exception as e:
+        return informe_id, None, None, str(e)
+
+def _leer_checkpoint(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _guardar_checkpoint(path, state):
+    write_atomic(path, json.dumps(state).encode('utf-8'))
+
+def regenerar_pdfs(filters, workers=None, chunk_size=200, only_missing=False, checkpoint=None, from_id=None, stop=None):
+    """Regenerar los PDF de las órdenes que cumplen los filtros en paralelo.
+    
+    El proceso principal lee las órdenes por lotes (keyset sobre id), arma
+    los datos de cada PDF y actualiza pdf_path y su hash en la BD; los hijos del
+    ProcessPoolExecutor sólo renderizan. Al terminar cada lote se guarda el
+    último id en el checkpoint: si el proceso se interrumpe, una nueva
+    ejecución continúa desde ahí. Al completar el recorrido se elimina.
+    Si se activa stop (threading.Event), termina el lote en curso y sale.
+    Devuelve (generados, fallidos, segundos).
+    """
+    workers = workers or os.cpu_count() or 1
+    state = {'last_id': 0, 'done': 0, 'failed': []}
+    if from_id is not None:
+        state['last_id'] = from_id
+    elif checkpoint:
+        saved = _leer_checkpoint(checkpoint)
+        if saved:
+            if saved.get('filters') != filters:
+                logger.warning(f"El checkpoint {checkpoint} es de otros filtros ({saved.get('filters')}); se ignora")
+            else:
+                state.update(saved)
+                logger.info(f"Reanudando desde la orden {state['last_id']} ({state['done']} PDFs ya generados)")
+    state['filters'] = filters
+    
+    total = storage.count_informes(filters, state['last_id'])
+    logger.info(f"Regenerando hasta {total} PDFs con {workers} procesos (lotes de {chunk_size})")
+    
+    started = time.monotonic()
+    generated = failed = skipped = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_regeneration_worker) as executor:
+        while True:
+            if stop is not None and stop.is_set():
+                logger.warning(f"Interrumpido tras la orden {state['last_id']}; el mismo comando continúa desde ahí")
+                break
+            rows = storage.export_informes(filters, state['last_id'], chunk_size, columns='*')
+            if not rows:
+                break
+            
+            tasks = []
+            estados = {}
+            for row in storage.with_detalles(rows):
+                if only_missing and pdf_store.exists(row['pdf_path']):
+                    skipped += 1
+                    continue
+                estados[row['id']] = row['estado']
+                tasks.append((row['id'], f"orden_trabajo_{row['id']}.pdf", informe_a_datos_pdf(row)))
+            
+            chunk_generated = 0
+            for informe_id, pdf_path, pdf_sha256, error in executor.map(
+                _regenerar_pdf, tasks, chunksize=max(1, len(tasks) // (workers * 4))
+            ):
+                if error:
+                    failed += 1
+                    state['failed'].append(informe_id)
+                    logger.error(f"Error regenerando PDF de la orden {informe_id}: {error}")
+                    continue
+                chunk_generated += 1
+                # Como job_render; una orden ya enviada conserva 'sent'
+                if estados[informe_id] == 'sent':
+                    storage.update_informe(informe_id, pdf_path=pdf_path, pdf_sha256=pdf_sha256)
+                else:
+                    storage.update_informe(informe_id, pdf_path=pdf_path, pdf_sha256=pdf_sha256, estado='rendered')
+            
+            generated += chunk_generated
+            state['last_id'] = rows[-1]['id']
+            state['done'] += chunk_generated
+            if checkpoint:
+                _guardar_checkpoint(checkpoint, state)
+            
+            processed = generated + failed + skipped
+            elapsed = time.monotonic() - started
+            rate = generated / elapsed if elapsed else 0
+            remaining = (total - processed) / (processed / elapsed) if processed and elapsed else 0
+            logger.info(
+                f"{processed}/{total} órdenes ({processed * 100 // max(total, 1)}%) - "
+                f"{rate:.1f} PDF/s - quedan ~{remaining:.0f}s"
+            )
+    
+    # Recorrido completo: la próxima ejecución vuelve a empezar desde el principio
+    interrupted = stop is not None and stop.is_set()
+    if checkpoint and not interrupted and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    if state['failed']:
+        logger.warning(f"Órdenes con error: {state['failed']}")
+    
+    elapsed = time.monotonic() - started
+    logger.info(
+        f"Regeneración terminada: {generated} PDFs generados, {failed} con error, "
+        f"{skipped} existentes omitidos en {elapsed:.1f}s "
+        f"({generated / elapsed if elapsed else 0:.1f} PDF/s, {workers} procesos)"
+    )
+    return generated, failed, elapsed
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='Novamedical - Órdenes de Trabajo')
+    commands = parser.add_subparsers(dest='comando')
+    commands.add_parser('servidor', help='iniciar el servidor web (por defecto)')
+    
+    regen = commands.add_parser('regenerar-pdfs', help='regenerar en paralelo los PDF de las órdenes guardadas')
+    regen.add_argument('--institucion', help='sólo órdenes de esta institución')
+    regen.add_argument('--tecnico', help='sólo órdenes de este técnico')
+    regen.add_argument('--desde', help='fecha inicial AAAA-MM-DD')
+    regen.add_argument('--hasta', help='fecha final AAAA-MM-DD')
+    regen.add_argument('--faltantes', action='store_true', help='sólo órdenes cuyo PDF no está en disco')
+    regen.add_argument('--procesos', type=int, default=None, help='procesos en paralelo (por defecto, uno por CPU)')
+    regen.add_argument('--lote', type=int, default=200, help='órdenes leídas de la BD por lote')
+    regen.add_argument('--checkpoint', default='regenerar_pdfs.checkpoint.json',
+                       help='archivo para reanudar si se interrumpe ("" para desactivar)')
+    regen.add_argument('--desde-id', type=int, default=None, help='empezar después de este id (ignora el checkpoint)')
+    return parser
+
+def main_regenerar_pdfs(args):
+    filters = {name: getattr(args, name) for name in EXPORT_FILTERS if getattr(args, name)}
+    
+    # Ctrl-C / SIGTERM (redeploy): terminar el lote en curso y guardar el
+    # checkpoint; un segundo Ctrl-C aborta de inmediato
+    stop = threading.Event()
+    def request_stop(signum, frame):
+        stop.set()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    
+    generated, failed, _ = regenerar_pdfs(
+        filters,
+        workers=args.procesos,
+        chunk_size=args.lote,
+        only_missing=args.faltantes,
+        checkpoint=args.checkpoint or None,
+        from_id=args.desde_id,
+        stop=stop,
+    )
+    return 1 if failed or stop.is_set() else 0
+
 # --- Run ---
 # --- Configuración para Railway ---
 if __name__ == '__main__':
+    args = build_arg_parser().parse_args()
+    if args.comando == 'regenerar-pdfs':
+        raise SystemExit(main_regenerar_pdfs(args))
+    
     logger.info("🚀 Iniciando Novamedical Orders en Railway")
     logger.info(f"📁 Directorio de trabajo: {os.getcwd()}")
     logger.info(f"🗄️ Base de datos: {config.DB_FILE}")
@@ -1857,6 +6073,8 @@ if __name__ == '__main__':
     except:
         logger.warning("⚠️ No se pudo verificar el logo")
     
+    start_background_workers()
+    
     # Iniciar servidor
     app.run(
         host=host,
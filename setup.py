@@ -7,7 +7,7 @@ setup(
     install_requires=[
         "flask==2.2.5",
         "gunicorn==20.1.0", 
-        "reportlab==3.6.12",
+        "reportlab==5.0.1",
         "pillow==9.5.0"
     ]
 )
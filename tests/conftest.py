@@ -0,0 +1,128 @@
+"""
+Configuración común de las pruebas
+
+La app lee su configuración del entorno al importarse, así que se importa
+una sola vez con una BD SQLite, PDF y firmas en un directorio temporal y
+la cola de trabajos sin hilos (JOB_WORKERS=0): cada prueba procesa los
+trabajos con job_queue.run_pending().
+
+Las pruebas con PostgreSQL usan TEST_DATABASE_URL o, si no está, levantan
+un servidor local con pgserver; sin ninguno de los dos se omiten. En ambos
+casos trabajan en una base nueva que se borra al terminar. Las de S3 usan
+TEST_S3_ENDPOINT_URL (p. ej. MinIO, con AWS_ACCESS_KEY_ID y
+AWS_SECRET_ACCESS_KEY) o el servidor S3 de moto, cada una en un bucket nuevo.
+"""
+
+import logging
+import os
+import secrets
+import socket
+import sys
+import tempfile
+
+import pytest
+
+WORKDIR = tempfile.mkdtemp(prefix='novamedical_tests_')
+os.environ.update({
+    'DB_FILE': os.path.join(WORKDIR, 'informes.db'),
+    'UPLOADS_DIR': os.path.join(WORKDIR, 'uploads'),
+    'PDF_DIR': os.path.join(WORKDIR, 'pdfs'),
+    'DATABASE_URL': '',
+    'STORAGE_URL': '',
+    'SMTP_HOST': '',
+    'SMTP_POOL_SIZE': '1',
+    'JOB_WORKERS': '0',
+    'TRACE_EXPORTER': '',
+})
+os.chdir(WORKDIR)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import informe_tecnico_web_app as app_module  # noqa: E402
+
+@pytest.fixture(scope='session')
+def app():
+    return app_module
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+@pytest.fixture
+def crear_orden(app, client):
+    """POST /create con los campos mínimos; devuelve el id de la orden creada"""
+    def crear(**campos):
+        data = {'institucion': 'Hospital de Prueba', 'fecha': '2024-05-10', 'tecnico_nombre': 'Juan Pérez'}
+        data.update(campos)
+        response = client.post('/create', data=data)
+        assert response.status_code == 302
+        return app.storage.list_informes(limit=1)[0]['id']
+    return crear
+
+@pytest.fixture(scope='session')
+def pg_dsn(tmp_path_factory):
+    """DSN de una base PostgreSQL vacía, creada para esta sesión de pruebas"""
+    psycopg2 = pytest.importorskip('psycopg2')
+    url = os.environ.get('TEST_DATABASE_URL')
+    server = None
+    if not url:
+        pgserver = pytest.importorskip('pgserver')
+        # Su limpieza al salir registra en INFO cuando pytest ya cerró la captura
+        logging.getLogger(pgserver.__name__).setLevel(logging.WARNING)
+        server = pgserver.get_server(str(tmp_path_factory.mktemp('pgdata')), cleanup_mode='stop')
+        url = server.get_uri()
+    
+    nombre = f'novamedical_test_{secrets.token_hex(4)}'
+    admin = psycopg2.connect(url)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'CREATE DATABASE {nombre}')
+    yield psycopg2.extensions.make_dsn(url, dbname=nombre)
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS {nombre} WITH (FORCE)')
+    admin.close()
+    if server is not None:
+        server.cleanup()
+
+@pytest.fixture(scope='session')
+def pg_storage(app, pg_dsn):
+    storage = app.PostgresStorage(pg_dsn, 1, 4)
+    storage.migrate()
+    yield storage
+    storage._pool.closeall()
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def backend(request, app, monkeypatch):
+    """La app usando cada backend de informes (con su cola de trabajos y bandeja de salida)"""
+    if request.param == 'postgresql':
+        monkeypatch.setattr(app, 'storage', request.getfixturevalue('pg_storage'))
+    return app.storage
+
+@pytest.fixture(scope='session')
+def s3_endpoint():
+    """URL de un servidor S3 compatible para las pruebas"""
+    url = os.environ.get('TEST_S3_ENDPOINT_URL')
+    if url:
+        yield url
+        return
+    moto_server = pytest.importorskip('moto.server')
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    server = moto_server.ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+    server.start()
+    yield f'http://127.0.0.1:{port}'
+    server.stop()
+
+@pytest.fixture
+def s3_store(app, s3_endpoint, monkeypatch):
+    """S3BlobStore de PDF en un bucket nuevo, como lo arma STORAGE_URL=s3://bucket/prueba"""
+    if not os.environ.get('TEST_S3_ENDPOINT_URL'):
+        monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'prueba')
+        monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'prueba')
+    monkeypatch.setattr(app.config, 'S3_ENDPOINT_URL', s3_endpoint)
+    monkeypatch.setattr(app.config, 'S3_REGION', 'us-east-1')
+    monkeypatch.setattr(app.config, 'S3_MULTIPART_MB', 5)
+    bucket = f'novamedical-test-{secrets.token_hex(4)}'
+    store = app.create_blob_store(f's3://{bucket}/prueba', app.config.PDF_DIR, 'pdfs')
+    store.client.create_bucket(Bucket=bucket)
+    return store
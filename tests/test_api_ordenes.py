@@ -0,0 +1,106 @@
+"""Recepción de órdenes en lote por /api/ordenes (JSON y NDJSON)"""
+
+import io
+import json
+import uuid
+
+import pytest
+
+def orden(i, **campos):
+    datos = {
+        'idempotency_key': str(uuid.uuid4()), 'institucion': f'Hospital NDJSON {i}',
+        'fecha': '2024-05-10', 'tecnico_nombre': 'Juan Pérez',
+    }
+    datos.update(campos)
+    return datos
+
+def ndjson(client, lineas):
+    body = ''.join(linea + '\n' for linea in lineas).encode('utf-8')
+    response = client.post('/api/ordenes', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    return response, [json.loads(linea) for linea in response.data.splitlines()]
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1 << 16])
+def test_iter_lineas_corta_por_saltos_entre_bloques(app, chunk_size):
+    cuerpo = b'{"a": 1}\n\n{"b": "\xc3\xb1"}\r\n{"c": 3}'
+    
+    lineas = list(app.iter_lineas(io.BytesIO(cuerpo), chunk_size))
+    
+    assert lineas == [b'{"a": 1}', b'', b'{"b": "\xc3\xb1"}\r', b'{"c": 3}']
+
+def test_ndjson_en_varios_lotes_con_lineas_invalidas(app, client, monkeypatch):
+    monkeypatch.setattr(app.config, 'INTAKE_BATCH_SIZE', 2)
+    ordenes = [orden(i) for i in range(5)]
+    lineas = [json.dumps(o) for o in ordenes]
+    lineas.insert(2, '')
+    lineas.insert(4, '{no es json')
+    lineas.append(json.dumps(orden(9, fecha='no-es-fecha')))
+    
+    _, resultados = ndjson(client, lineas)
+    
+    assert [r['linea'] for r in resultados] == [1, 2, 4, 5, 6, 7, 8]
+    assert [r['estado'] for r in resultados] == ['created', 'created', 'created', 'invalid', 'created', 'created', 'invalid']
+    creados = [r for r in resultados if r['estado'] == 'created']
+    assert [r['idempotency_key'] for r in creados] == [o['idempotency_key'] for o in ordenes]
+    assert app.storage.get_informe(creados[-1]['id'])['institucion'] == 'Hospital NDJSON 4'
+
+def test_ndjson_responde_en_streaming(app):
+    body = json.dumps(orden(0)).encode('utf-8') + b'\n'
+    with app.app.test_request_context('/api/ordenes', method='POST', data=body, content_type='application/x-ndjson'):
+        response = app.api_ordenes()
+        assert response.is_streamed
+        assert json.loads(''.join(response.response))['estado'] == 'created'
+
+def test_ndjson_reenviado_no_duplica(client):
+    lineas = [json.dumps(orden(i)) for i in range(3)]
+    
+    _, primera = ndjson(client, lineas)
+    _, segunda = ndjson(client, lineas)
+    
+    assert [r['estado'] for r in segunda] == ['duplicate'] * 3
+    assert [r['id'] for r in segunda] == [r['id'] for r in primera]
+
+def test_ndjson_error_interno_corta_con_linea_de_error(app, client, monkeypatch):
+    monkeypatch.setattr(app.config, 'INTAKE_BATCH_SIZE', 2)
+    lotes = []
+    recibir_lote = app.recibir_lote
+    
+    def falla_en_el_segundo_lote(ordenes):
+        lotes.append(len(ordenes))
+        if len(lotes) == 2:
+            raise RuntimeError('BD caída')
+        return recibir_lote(ordenes)
+    
+    monkeypatch.setattr(app, 'recibir_lote', falla_en_el_segundo_lote)
+    
+    _, resultados = ndjson(client, [json.dumps(orden(i)) for i in range(6)])
+    
+    assert [r.get('linea') for r in resultados] == [1, 2, None]
+    assert [r['estado'] for r in resultados] == ['created', 'created', 'error']
+
+def test_json_en_lote(client):
+    ordenes = [orden(i) for i in range(3)]
+    
+    response = client.post('/api/ordenes', json={'ordenes': ordenes})
+    
+    assert response.status_code == 200
+    assert [r['estado'] for r in response.json['resultados']] == ['created'] * 3
+
+def test_json_reenviado_devuelve_la_orden_ya_creada(app, client):
+    pendiente = orden(0, institucion='Hospital Sin Conexión')
+    
+    primera = client.post('/api/ordenes', json={'ordenes': [pendiente]}).json['resultados'][0]
+    reenvio = client.post('/api/ordenes', json={'ordenes': [pendiente, pendiente]}).json['resultados']
+    
+    assert primera['estado'] == 'created'
+    assert [(r['estado'], r['id']) for r in reenvio] == [('duplicate', primera['id'])] * 2
+    assert app.storage.ids_por_idempotency_key([pendiente['idempotency_key']]) == {pendiente['idempotency_key']: primera['id']}
+
+def test_json_sin_clave_o_invalida(client):
+    sin_clave = orden(0)
+    del sin_clave['idempotency_key']
+    
+    response = client.post('/api/ordenes', json={'ordenes': [sin_clave, orden(1, fecha='ayer')]})
+    
+    assert [r['estado'] for r in response.json['resultados']] == ['invalid', 'invalid']
+    assert client.post('/api/ordenes', json={'ordenes': []}).status_code == 400
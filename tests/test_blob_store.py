@@ -0,0 +1,83 @@
+"""Almacén de PDF y firmas: disco local y S3 (MinIO o moto)"""
+
+import os
+import urllib.request
+
+import pytest
+
+@pytest.fixture(params=['local', 's3'])
+def store(request, app, tmp_path):
+    if request.param == 's3':
+        return request.getfixturevalue('s3_store')
+    return app.LocalBlobStore(str(tmp_path / 'pdfs'))
+
+def test_put_read_y_stat(store):
+    ref = store.put('orden_trabajo_1.pdf', b'%PDF-1.4 contenido')
+    
+    assert store.exists(ref)
+    assert store.read(ref) == b'%PDF-1.4 contenido'
+    assert store.read(ref, 0, 8) == b'%PDF-1.4'
+    assert store.read(ref, 9) == b'contenido'
+    assert store.stat(ref)[0] == len(b'%PDF-1.4 contenido')
+    assert b''.join(store.iter_chunks(ref, 4)) == b'%PDF-1.4 contenido'
+
+def test_referencia_inexistente(store):
+    ref = store.ref('no_existe.pdf')
+    
+    assert store.stat(ref) is None
+    assert not store.exists(ref)
+    assert not store.exists('')
+    with pytest.raises(FileNotFoundError):
+        store.read(ref)
+
+def test_staged_publica_solo_si_termina_bien(store):
+    with store.staged('bien.pdf') as path:
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-bien')
+    with pytest.raises(RuntimeError):
+        with store.staged('mal.pdf') as path:
+            with open(path, 'wb') as f:
+                f.write(b'%PDF-a medias')
+            raise RuntimeError('falla el render')
+    
+    assert store.read(store.ref('bien.pdf')) == b'%PDF-bien'
+    assert not store.exists(store.ref('mal.pdf'))
+
+def test_s3_sube_archivos_grandes_en_partes(s3_store):
+    with s3_store.staged('grande.pdf') as path:
+        with open(path, 'wb') as f:
+            f.write(os.urandom(6 * 1024 * 1024))
+    
+    head = s3_store.client.head_object(Bucket=s3_store.bucket, Key=s3_store.prefix + 'grande.pdf')
+    assert head['ContentLength'] == 6 * 1024 * 1024
+    assert head['ETag'].strip('"').endswith('-2')
+    assert head['ContentType'] == 'application/pdf'
+
+def test_s3_traduce_referencias_locales_antiguas(app, s3_store):
+    s3_store.put('orden_trabajo_7.pdf', b'%PDF-antiguo')
+    
+    assert s3_store.read(os.path.join(app.config.PDF_DIR, 'orden_trabajo_7.pdf')) == b'%PDF-antiguo'
+
+def test_s3_download_redirige_a_url_firmada(app, client, s3_store, crear_orden, monkeypatch):
+    monkeypatch.setattr(app, 'pdf_store', s3_store)
+    informe_id = crear_orden(institucion='Hospital S3')
+    app.job_queue.run_pending()
+    row = app.storage.get_informe(informe_id)
+    assert row['pdf_path'] == s3_store.ref(f'orden_trabajo_{informe_id}.pdf')
+    
+    response = client.get(f'/download/{informe_id}')
+    
+    assert response.status_code == 302
+    location = response.headers['Location']
+    assert 'X-Amz-Signature=' in location
+    with urllib.request.urlopen(location) as descarga:
+        assert descarga.read().startswith(b'%PDF-')
+        assert f'orden_trabajo_{informe_id}.pdf' in descarga.headers['Content-Disposition']
+
+def test_almacen_incompleto_falla_al_construirse(app):
+    class SoloLectura(app.BlobStore):
+        def read(self, ref, start=0, end=None):
+            return b''
+    
+    with pytest.raises(TypeError, match='abstract'):
+        SoloLectura()
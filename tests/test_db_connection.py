@@ -0,0 +1,57 @@
+"""Transacciones anidadas del pool de conexiones SQLite"""
+
+import pytest
+
+def institucion(app, informe_id):
+    row = app.storage.get_informe(informe_id)
+    return row['institucion'] if row else None
+
+def test_error_interno_deshace_solo_el_bloque_interno(app, crear_orden):
+    informe_id = crear_orden(institucion='Antes')
+    
+    with app.db_connection() as conn:
+        conn.execute('UPDATE informes SET institucion = ? WHERE id = ?', ('Externo', informe_id))
+        with pytest.raises(RuntimeError):
+            with app.db_connection() as inner:
+                inner.execute('UPDATE informes SET comuna = ? WHERE id = ?', ('Interno', informe_id))
+                raise RuntimeError('falla el bloque interno')
+    
+    row = app.storage.get_informe(informe_id)
+    assert row['institucion'] == 'Externo'
+    assert row['comuna'] != 'Interno'
+
+def test_error_externo_deshace_tambien_los_bloques_internos(app, crear_orden):
+    informe_id = crear_orden(institucion='Antes')
+    
+    with pytest.raises(RuntimeError):
+        with app.db_connection() as conn:
+            conn.execute('SELECT 1').fetchone()
+            with app.db_connection() as inner:
+                inner.execute('UPDATE informes SET institucion = ? WHERE id = ?', ('Interno', informe_id))
+            raise RuntimeError('falla el bloque externo')
+    
+    assert institucion(app, informe_id) == 'Antes'
+
+def test_bloques_anidados_confirman_con_el_externo(app, crear_orden):
+    informe_id = crear_orden(institucion='Antes')
+    
+    with app.db_connection():
+        with app.db_connection() as inner:
+            inner.execute('UPDATE informes SET institucion = ? WHERE id = ?', ('Interno', informe_id))
+            with app.db_connection() as innermost:
+                innermost.execute('UPDATE informes SET comuna = ? WHERE id = ?', ('Más interno', informe_id))
+    
+    row = app.storage.get_informe(informe_id)
+    assert (row['institucion'], row['comuna']) == ('Interno', 'Más interno')
+
+def test_interrupcion_deshace_y_devuelve_la_conexion_limpia(app, crear_orden):
+    informe_id = crear_orden(institucion='Antes')
+    
+    with pytest.raises(KeyboardInterrupt):
+        with app.db_connection() as conn:
+            conn.execute('UPDATE informes SET institucion = ? WHERE id = ?', ('Interrumpido', informe_id))
+            raise KeyboardInterrupt
+    
+    assert institucion(app, informe_id) == 'Antes'
+    with app.db_pool.connection() as conn:
+        assert not conn.in_transaction
@@ -0,0 +1,54 @@
+"""Exportación masiva de PDF en un ZIP armado en streaming (/export)"""
+
+import csv
+import io
+import zipfile
+
+def leer_zip(response):
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    return zipfile.ZipFile(io.BytesIO(response.get_data()))
+
+def test_zip_con_los_pdf_filtrados_y_su_indice(app, client, backend, crear_orden, monkeypatch):
+    monkeypatch.setattr(app.config, 'EXPORT_BATCH_SIZE', 1)
+    renderizada = crear_orden(institucion='Hospital Exportación', fecha='2024-03-01')
+    app.job_queue.run_pending()
+    bajo_demanda = crear_orden(institucion='Hospital Exportación', fecha='2024-03-02')
+    crear_orden(institucion='Clínica Ajena', fecha='2024-03-01')
+    
+    zf = leer_zip(client.get('/export?institucion=Hospital Exportación'))
+    
+    assert zf.testzip() is None
+    assert sorted(zf.namelist()) == sorted([f'orden_trabajo_{renderizada}.pdf', f'orden_trabajo_{bajo_demanda}.pdf', 'indice.csv'])
+    assert zf.read(f'orden_trabajo_{renderizada}.pdf') == app.pdf_store.read(backend.get_informe(renderizada)['pdf_path'])
+    assert zf.read(f'orden_trabajo_{bajo_demanda}.pdf').startswith(b'%PDF-')
+    
+    indice = list(csv.DictReader(io.StringIO(zf.read('indice.csv').decode('utf-8-sig'))))
+    assert [(int(r['id']), r['archivo']) for r in indice] == [
+        (renderizada, f'orden_trabajo_{renderizada}.pdf'), (bajo_demanda, f'orden_trabajo_{bajo_demanda}.pdf'),
+    ]
+
+def test_zip_por_rango_de_fechas(client, backend, crear_orden):
+    dentro = crear_orden(institucion='Hospital Rango', fecha='2023-07-15')
+    crear_orden(institucion='Hospital Rango', fecha='2023-08-01')
+    
+    zf = leer_zip(client.get('/export?institucion=Hospital Rango&desde=2023-07-01&hasta=2023-07-31'))
+    
+    assert sorted(zf.namelist()) == ['indice.csv', f'orden_trabajo_{dentro}.pdf']
+
+def test_el_zip_se_envia_por_partes(app, client, crear_orden, monkeypatch):
+    monkeypatch.setattr(app.config, 'EXPORT_BATCH_SIZE', 1)
+    for _ in range(3):
+        crear_orden(institucion='Hospital Partes')
+    
+    response = client.get('/export?institucion=Hospital Partes', buffered=False)
+    
+    assert response.is_streamed
+    partes = [parte for parte in response.response if parte]
+    response.close()
+    assert len(partes) > 3
+    assert len(zipfile.ZipFile(io.BytesIO(b''.join(partes))).namelist()) == 4
+
+def test_exportar_sin_filtros_o_con_fecha_invalida(client):
+    assert client.get('/export').status_code == 302
+    assert client.get('/export?desde=01-07-2023').status_code == 302
@@ -0,0 +1,48 @@
+"""Formulario declarativo (FORM_FIELDS): controles, validación y columnas"""
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+@pytest.mark.parametrize('campos, error', [
+    ({'institucion': ''}, 'El campo Institución/Cliente es requerido'),
+    ({'fecha': '10/05/2024'}, 'La fecha debe tener el formato AAAA-MM-DD'),
+    ({'comuna': 'x' * 201}, 'El campo Comuna admite hasta 200 caracteres'),
+    ({'encuesta_nota': '11'}, 'Valor no válido en ¿Qué nota le colocaría al servicio realizado? (de 1 a 10)'),
+])
+def test_validar_formulario(app, campos, error):
+    form = MultiDict({'institucion': 'Hospital Formulario', 'fecha': '2024-05-10', **campos})
+    
+    assert app.validar_formulario(form) == [error]
+
+def test_formulario_valido_y_opcionales_vacios(app):
+    form = MultiDict({'institucion': '  Hospital Formulario ', 'fecha': '2024-05-10', 'encuesta_nota': '10',
+                      'detalles_servicio': 'x' * 10000})
+    
+    assert app.validar_formulario(form) == []
+    datos = app.datos_del_formulario(form)
+    assert set(datos) == {field.name for field in app.FORM_FIELDS}
+    assert datos['institucion'] == 'Hospital Formulario'
+    assert datos['encargado'] == ''
+
+def test_create_rechaza_un_campo_demasiado_largo(app, client, backend):
+    antes = backend.list_informes(limit=1)
+    
+    response = client.post('/create', data={'institucion': 'Hospital Largo', 'fecha': '2024-05-10',
+                                             'numero_serie': 'S' * 201}, follow_redirects=True)
+    
+    assert 'El campo Número de Serie admite hasta 200 caracteres' in response.get_data(as_text=True)
+    assert backend.list_informes(limit=1) == antes
+
+def test_campos_guardados_en_su_columna(app, backend, crear_orden):
+    informe_id = crear_orden(institucion='Hospital Columnas', marca_modelo='Philips MX40', encuesta_nota='9')
+    
+    row = backend.get_informe(informe_id)
+    
+    assert (row['marca_modelo'], row['encuesta_nota'], row['comuna']) == ('Philips MX40', '9', '')
+
+def test_el_formulario_sale_de_form_fields(client):
+    html = client.get('/').get_data(as_text=True)
+    
+    assert '<input name="institucion" value="" maxlength="200" required' in html
+    assert '<textarea name="detalles_servicio" placeholder="Describa detalles adicionales del servicio..." maxlength="10000">' in html
+    assert '<select name="encuesta_nota"' in html and '<option value="10"' in html
@@ -0,0 +1,84 @@
+"""Lista de órdenes: paginación por cursor (keyset) y búsqueda"""
+
+import re
+
+def recorrer(client, limit):
+    """Ids de todas las páginas de /api/informes siguiendo next_before"""
+    ids, before, paginas = [], None, 0
+    while True:
+        url = f'/api/informes?limit={limit}' + (f'&before={before}' if before else '')
+        page = client.get(url).json
+        assert len(page['items']) <= limit
+        ids.extend(item['id'] for item in page['items'])
+        paginas += 1
+        before = page['next_before']
+        if before is None:
+            return ids, paginas
+
+def test_paginacion_cruza_paginas_sin_repetir_ni_saltar(app, client, backend, crear_orden):
+    nuevas = [crear_orden(institucion=f'Hospital Página {n}') for n in range(5)]
+    total = len(backend.export_informes({}, limit=100000))
+    
+    ids, paginas = recorrer(client, limit=2)
+    
+    assert ids == sorted(ids, reverse=True)
+    assert len(ids) == len(set(ids)) == total
+    assert set(nuevas) <= set(ids)
+    assert paginas == -(-total // 2)
+
+def test_cursor_es_el_ultimo_id_de_la_pagina(client, backend, crear_orden):
+    crear_orden(institucion='Hospital Cursor A')
+    crear_orden(institucion='Hospital Cursor B')
+    crear_orden(institucion='Hospital Cursor C')
+    
+    primera = client.get('/api/informes?limit=2').json
+    segunda = client.get(f"/api/informes?limit=2&before={primera['next_before']}").json
+    
+    assert primera['next_before'] == primera['items'][-1]['id']
+    assert segunda['items'][0]['id'] < primera['next_before']
+
+def test_fragmento_enlaza_la_pagina_siguiente(client, backend, crear_orden):
+    crear_orden(institucion='Hospital Fragmento A')
+    ultima = crear_orden(institucion='Hospital Fragmento B')
+    
+    html = client.get('/ordenes?page_size=1').get_data(as_text=True)
+    
+    assert re.search(rf'OT-{ultima}\b', html)
+    before = int(re.search(r'before=(\d+)', html).group(1))
+    assert before == ultima
+    siguiente = client.get(f'/ordenes?page_size=1&before={before}').get_data(as_text=True)
+    assert not re.search(rf'OT-{ultima}\b', siguiente)
+    assert 'Más recientes' in siguiente
+
+def test_busqueda_ignora_tildes_en_ambos_sentidos(client, backend, crear_orden):
+    con_tilde = crear_orden(institucion='Clínica Tildeñosa', problema_cliente='Falla la válvula de presión')
+    sin_tilde = crear_orden(institucion='Clinica Sintilde', equipo='Esterilizador')
+    
+    ids = {item['id'] for item in client.get('/api/informes/search?q=clinica').json['items']}
+    assert {con_tilde, sin_tilde} <= ids
+    
+    ids = {item['id'] for item in client.get('/api/informes/search?q=Clínica').json['items']}
+    assert {con_tilde, sin_tilde} <= ids
+    
+    [item] = client.get('/api/informes/search?q=VALVULA tildeñ').json['items']
+    assert item['id'] == con_tilde
+    assert '[válvula]' in item['fragmento']
+
+def test_busqueda_por_prefijo_y_todos_los_terminos(client, backend, crear_orden):
+    informe_id = crear_orden(institucion='Hospital Prefijo', numero_serie='SN-778899', equipo='Autoclave')
+    
+    assert [i['id'] for i in client.get('/api/informes/search?q=prefi autocl').json['items']] == [informe_id]
+    assert client.get('/api/informes/search?q=prefijo inexistente').json['items'] == []
+
+def test_busqueda_sin_terminos(client):
+    response = client.get('/api/informes/search?q=%20¿?')
+    
+    assert response.status_code == 400
+
+def test_la_lista_busca_con_q(client, backend, crear_orden):
+    informe_id = crear_orden(institucion='Policlínico Buscable')
+    
+    html = client.get('/ordenes?q=policlinico buscable').get_data(as_text=True)
+    
+    assert re.search(rf'OT-{informe_id}\b', html)
+    assert 'Más antiguas' not in html
@@ -0,0 +1,140 @@
+"""Envío de la bandeja de salida contra un servidor SMTP local (aiosmtpd)"""
+
+import json
+import socket
+import time
+
+import pytest
+
+aiosmtpd_controller = pytest.importorskip('aiosmtpd.controller')
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class Buzon:
+    def __init__(self):
+        self.mensajes = []
+        self.sesiones = set()
+    
+    async def handle_DATA(self, server, session, envelope):
+        self.mensajes.append(envelope)
+        self.sesiones.add(id(session))
+        return '250 OK'
+
+@pytest.fixture
+def smtp_config(app, monkeypatch):
+    """La app apuntando a 127.0.0.1 (puerto sin servidor), con la bandeja vacía"""
+    monkeypatch.setattr(app.config, 'SMTP_HOST', '127.0.0.1')
+    monkeypatch.setattr(app.config, 'SMTP_PORT', puerto_libre())
+    monkeypatch.setattr(app.config, 'SMTP_USE_TLS', False)
+    monkeypatch.setattr(app.config, 'EMAIL_SENDER', 'ot@novamedical.cl')
+    with app.db_connection() as conn:
+        conn.execute('DELETE FROM outbox')
+    yield app.config
+    app.smtp_pool.close_all()
+
+@pytest.fixture
+def smtp(smtp_config):
+    """Servidor SMTP local que guarda los mensajes recibidos"""
+    buzon = Buzon()
+    controller = aiosmtpd_controller.Controller(buzon, hostname='127.0.0.1', port=smtp_config.SMTP_PORT)
+    controller.start()
+    yield buzon
+    controller.stop()
+
+def bandeja(app):
+    with app.db_connection() as conn:
+        return [dict(r) for r in conn.execute('SELECT * FROM outbox ORDER BY id')]
+
+def entregar(app, timeout=10):
+    """Procesar trabajos y correos hasta que no quede nada en envío"""
+    app.job_queue.run_pending()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        app.mail_delivery.run_pending()
+        if not any(item['estado'] == 'sending' for item in bandeja(app)):
+            return bandeja(app)
+        time.sleep(0.05)
+    raise AssertionError('la bandeja de salida no terminó de enviarse')
+
+def test_lote_por_una_sola_sesion(app, smtp, crear_orden):
+    abiertas = app.delivery_stats.snapshot()['connections_opened']
+    ids = [crear_orden(contacto=f'biomedica{i}@example.com') for i in range(5)]
+    
+    items = entregar(app)
+    
+    assert [item['estado'] for item in items] == ['sent'] * 5
+    assert len(smtp.mensajes) == 5
+    assert sorted(m.rcpt_tos[0] for m in smtp.mensajes) == [f'biomedica{i}@example.com' for i in range(5)]
+    assert b'application/pdf' in smtp.mensajes[0].content
+    assert app.delivery_stats.snapshot()['connections_opened'] - abiertas == 1
+    assert all(app.storage.get_informe(i)['estado'] == 'sent' for i in ids)
+
+def test_reconecta_si_la_sesion_se_cayo(app, smtp, crear_orden):
+    crear_orden(contacto='biomedica@example.com')
+    app.job_queue.run_pending()
+    # Sesión del pool cerrada por el servidor mientras estaba ociosa
+    server = app.smtp_pool.acquire()
+    server.close()
+    app.smtp_pool.release(server)
+    
+    items = entregar(app)
+    
+    assert [item['estado'] for item in items] == ['sent']
+    assert len(smtp.mensajes) == 1
+
+def test_reintenta_con_backoff_y_descarta(app, smtp_config, crear_orden, monkeypatch):
+    monkeypatch.setattr(app.config, 'SMTP_MAX_RETRIES', 2)
+    informe_id = crear_orden(contacto='biomedica@example.com')
+    
+    antes = time.time()
+    [item] = entregar(app)
+    assert item['estado'] == 'queued'
+    assert item['intentos'] == 1
+    assert item['next_attempt_at'] >= antes + app.config.SMTP_RETRY_BASE
+    
+    # El reintento no se toma antes de tiempo
+    assert app.mail_delivery.run_pending() == 0
+    
+    with app.db_connection() as conn:
+        conn.execute('UPDATE outbox SET next_attempt_at = 0')
+    [item] = entregar(app)
+    assert item['estado'] == 'failed'
+    assert item['intentos'] == 2
+    assert app.storage.get_informe(informe_id)['estado'] == 'failed'
+
+class SpansEnMemoria:
+    def __init__(self):
+        self.spans = []
+    
+    def export(self, body):
+        for resource in json.loads(body)['resourceSpans']:
+            for scope in resource['scopeSpans']:
+                self.spans += scope['spans']
+
+def test_el_correo_sigue_la_traza_de_la_orden(app, smtp, crear_orden, monkeypatch):
+    exportador = SpansEnMemoria()
+    monkeypatch.setattr(app.tracer, 'exporter', exportador)
+    monkeypatch.setattr(app.tracer, 'sample_rate', 1.0)
+    app.tracer.flush()
+    
+    crear_orden(contacto='biomedica@example.com')
+    entregar(app)
+    app.tracer.flush()
+    
+    spans = {span['name']: span for span in exportador.spans}
+    por_id = {span['spanId']: span for span in exportador.spans}
+    
+    def ancestros(span):
+        nombres = []
+        while span.get('parentSpanId') in por_id:
+            span = por_id[span['parentSpanId']]
+            nombres.append(span['name'])
+        return nombres
+    
+    assert spans['smtp send']['traceId'] == spans['POST /create']['traceId']
+    assert ancestros(spans['smtp send'])[0] == 'enviar correo'
+    assert 'job render' in ancestros(spans['enviar correo'])
+    assert ancestros(spans['enviar correo'])[-1] == 'POST /create'
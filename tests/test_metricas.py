@@ -0,0 +1,60 @@
+"""Métricas del proceso en /metrics (formato de texto de Prometheus)"""
+
+def leer_metricas(client):
+    """{'nombre{etiquetas}': valor} de las muestras expuestas"""
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    muestras = {}
+    for linea in response.get_data(as_text=True).splitlines():
+        if linea and not linea.startswith('#'):
+            serie, valor = linea.rsplit(' ', 1)
+            muestras[serie] = float(valor)
+    return muestras
+
+def test_create_y_render_suman_en_los_contadores(app, client, crear_orden):
+    antes = leer_metricas(client)
+    
+    crear_orden(institucion='Hospital Métricas')
+    app.job_queue.run_pending()
+    
+    despues = leer_metricas(client)
+    def delta(serie):
+        return despues.get(serie, 0) - antes.get(serie, 0)
+    assert delta('novamedical_orders_created_total{via="formulario"}') == 1
+    assert delta('novamedical_pdfs_rendered_total{result="ok"}') == 1
+    assert delta('novamedical_http_request_duration_seconds_count{method="POST",route="/create",status="302"}') == 1
+    assert delta('novamedical_stage_duration_seconds_count{stage="generate_pdf"}') == 1
+
+def test_la_ruta_y_no_la_url_en_las_etiquetas(app, client, crear_orden):
+    informe_id = crear_orden()
+    client.get(f'/download/{informe_id}')
+    
+    series = leer_metricas(client)
+    
+    assert any('route="/download/<int:id>"' in serie for serie in series)
+    assert not any(f'/download/{informe_id}' in serie for serie in series)
+
+def test_histograma_acumula_los_buckets(app):
+    histograma = app.Histogram('prueba_seconds', 'Prueba', ('etapa',), buckets=(0.1, 1))
+    for valor in (0.05, 0.5, 0.7, 3):
+        histograma.observe(valor, etapa='a"b')
+    
+    lineas = histograma.expose()
+    
+    assert lineas[2:] == [
+        'prueba_seconds_bucket{etapa="a\\"b",le="0.1"} 1',
+        'prueba_seconds_bucket{etapa="a\\"b",le="1"} 3',
+        'prueba_seconds_bucket{etapa="a\\"b",le="+Inf"} 4',
+        'prueba_seconds_sum{etapa="a\\"b"} 4.25',
+        'prueba_seconds_count{etapa="a\\"b"} 4',
+    ]
+
+def test_profundidad_de_la_cola(app, client, backend, crear_orden):
+    crear_orden()
+    
+    series = leer_metricas(client)
+    
+    assert series['novamedical_queue_depth{queue="jobs",estado="queued"}'] >= 1
+    app.job_queue.run_pending()
+    assert leer_metricas(client).get('novamedical_queue_depth{queue="jobs",estado="queued"}', 0) == 0
@@ -0,0 +1,56 @@
+"""Migraciones versionadas del esquema SQLite (schema_version)"""
+
+import sqlite3
+
+import pytest
+
+@pytest.fixture
+def base_nueva(app, tmp_path, monkeypatch):
+    """La app apuntando a un archivo SQLite vacío, con su propio pool"""
+    db_file = str(tmp_path / 'nueva.db')
+    monkeypatch.setattr(app.config, 'DB_FILE', db_file)
+    monkeypatch.setattr(app, 'db_pool', app.ConnectionPool(2))
+    yield db_file
+    app.db_pool.close_all()
+
+def versiones(db_file):
+    with sqlite3.connect(db_file) as conn:
+        return [row[0] for row in conn.execute('SELECT version FROM schema_version ORDER BY version')]
+
+def test_base_vacia_queda_en_la_ultima_version(app, base_nueva):
+    app.init_db()
+    
+    assert versiones(base_nueva) == [version for version, _, _ in app.MIGRATIONS]
+    with app.db_connection() as conn:
+        assert app.get_schema_version(conn) == app.SCHEMA_VERSION
+    assert app.verify_database_structure() == app.SCHEMA_VERSION
+
+def test_reiniciar_no_borra_datos_ni_repite_migraciones(app, base_nueva):
+    app.init_db()
+    with app.db_connection() as conn:
+        conn.execute("INSERT INTO informes (institucion, fecha) VALUES ('Hospital Persistente', '2024-05-10')")
+    
+    app.init_db()
+    
+    assert versiones(base_nueva) == [version for version, _, _ in app.MIGRATIONS]
+    with app.db_connection() as conn:
+        assert conn.execute('SELECT institucion FROM informes').fetchall()[0][0] == 'Hospital Persistente'
+
+def test_base_antigua_aplica_solo_las_pendientes(app, base_nueva):
+    # Una base que quedó en la versión 8, con datos
+    with sqlite3.connect(base_nueva) as conn:
+        conn.execute('CREATE TABLE schema_version (version INTEGER PRIMARY KEY, nombre TEXT NOT NULL, applied_at TEXT NOT NULL)')
+        for version, nombre, migrate in app.MIGRATIONS[:8]:
+            migrate(conn)
+            conn.execute('INSERT INTO schema_version VALUES (?, ?, ?)', (version, nombre, '2024-01-01'))
+        conn.execute("INSERT INTO informes (institucion, fecha) VALUES ('Hospital Antiguo', '2024-01-01')")
+        conn.execute("INSERT INTO jobs (informe_id, tipo) VALUES (1, 'render')")
+    
+    app.init_db()
+    
+    assert versiones(base_nueva) == [version for version, _, _ in app.MIGRATIONS]
+    with app.db_connection() as conn:
+        assert conn.execute('SELECT applied_at FROM schema_version WHERE version = 8').fetchone()[0] == '2024-01-01'
+        job = conn.execute('SELECT next_attempt_at, traceparent FROM jobs').fetchone()
+        assert (job['next_attempt_at'], job['traceparent']) == (0, None)
+        assert conn.execute('SELECT institucion FROM informes').fetchone()[0] == 'Hospital Antiguo'
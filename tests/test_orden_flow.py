@@ -0,0 +1,157 @@
+"""Recorrido de una orden: /create -> trabajo de render -> /download"""
+
+import base64
+import io
+import os
+
+import pytest
+from PIL import Image, ImageDraw
+
+def firma_png():
+    img = Image.new('RGBA', (300, 100), (0, 0, 0, 0))
+    ImageDraw.Draw(img).line([(10, 50), (290, 60)], fill='black', width=3)
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buf.getvalue()).decode()
+
+def test_create_render_y_download(app, client, backend, crear_orden):
+    item = app.CHECKLIST_ITEMS[0]
+    informe_id = crear_orden(
+        institucion='Hospital Regional Flujo', sig_tech=firma_png(),
+        **{item.key: 'si', 'pieza_descripcion': ['Resistencia 2000W'], 'pieza_cantidad': ['1']},
+    )
+    row = backend.get_informe(informe_id)
+    assert row['estado'] == 'pending'
+    assert row['tecnico_firma']
+    assert [tuple(p) for p in row['piezas']] == [('Resistencia 2000W', '1')]
+    
+    assert app.job_queue.run_pending() >= 1
+    row = backend.get_informe(informe_id)
+    assert row['estado'] == 'rendered'
+    assert app.pdf_store.exists(row['pdf_path'])
+    
+    response = client.get(f'/download/{informe_id}')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/pdf'
+    assert response.data.startswith(b'%PDF-')
+    assert f'orden_trabajo_{informe_id}.pdf' in response.headers['Content-Disposition']
+    
+    revalidacion = client.get(f'/download/{informe_id}', headers={'If-None-Match': response.headers['ETag']})
+    assert revalidacion.status_code == 304
+
+def test_la_lista_enlaza_la_descarga(app, client, backend, crear_orden):
+    informe_id = crear_orden(institucion='Hospital Lista')
+    app.job_queue.run_pending()
+    
+    items = client.get('/api/informes?limit=5').json['items']
+    
+    [item] = [item for item in items if item['id'] == informe_id]
+    assert item['estado'] == 'rendered'
+    assert item['download_url'].startswith(f'/download/{informe_id}?v=')
+
+def test_formulario_invalido_no_crea_orden(app, client, backend):
+    antes = backend.list_informes(limit=1)
+    
+    response = client.post('/create', data={'institucion': '', 'fecha': 'no-es-fecha'})
+    
+    assert response.status_code == 302
+    assert backend.list_informes(limit=1) == antes
+
+def test_descarga_inexistente(client, backend):
+    response = client.get('/download/999999')
+    assert response.status_code == 302
+
+def test_pdf_bajo_demanda_calcula_el_etag_una_vez(app, client, backend, crear_orden, monkeypatch):
+    monkeypatch.setattr(app.config, 'PDF_LAZY', True)
+    informe_id = crear_orden(institucion='Hospital Bajo Demanda')
+    assert backend.get_informe(informe_id)['estado'] == 'registered'
+    
+    hashes = []
+    sha256_file = app.sha256_file
+    monkeypatch.setattr(app, 'sha256_file', lambda path: hashes.append(path) or sha256_file(path))
+    
+    primera = client.get(f'/download/{informe_id}')
+    segunda = client.get(f'/download/{informe_id}')
+    
+    assert primera.status_code == segunda.status_code == 200
+    assert primera.data.startswith(b'%PDF-')
+    assert primera.headers['ETag'] == segunda.headers['ETag']
+    assert len(hashes) == 1
+
+@pytest.fixture
+def orden_con_pdf(app, crear_orden):
+    """(id, fila) de una orden con su PDF ya generado en PDF_DIR"""
+    informe_id = crear_orden(institucion='Hospital Descargas')
+    app.job_queue.run_pending()
+    return informe_id, app.storage.get_informe(informe_id)
+
+def test_descarga_por_rango(client, orden_con_pdf):
+    informe_id, row = orden_con_pdf
+    size = os.path.getsize(row['pdf_path'])
+    
+    response = client.get(f'/download/{informe_id}', headers={'Range': 'bytes=0-99'})
+    
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 0-99/{size}'
+    assert response.data == open(row['pdf_path'], 'rb').read()[:100]
+
+def test_rango_fuera_del_archivo(client, orden_con_pdf):
+    informe_id, row = orden_con_pdf
+    size = os.path.getsize(row['pdf_path'])
+    
+    response = client.get(f'/download/{informe_id}', headers={'Range': f'bytes={size + 10}-'})
+    
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{size}'
+
+def test_descarga_delegada_con_x_accel_redirect(app, client, orden_con_pdf, monkeypatch):
+    monkeypatch.setattr(app.config, 'DOWNLOAD_ACCEL', 'x-accel-redirect')
+    informe_id, row = orden_con_pdf
+    
+    response = client.get(f'/download/{informe_id}')
+    
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['X-Accel-Redirect'] == f'/pdfs-internos/orden_trabajo_{informe_id}.pdf'
+    assert f'orden_trabajo_{informe_id}.pdf' in response.headers['Content-Disposition']
+    assert response.headers['ETag'] == f'"{row["pdf_sha256"]}"'
+    
+    revalidacion = client.get(f'/download/{informe_id}', headers={'If-None-Match': response.headers['ETag']})
+    assert revalidacion.status_code == 304
+    assert 'X-Accel-Redirect' not in revalidacion.headers
+
+def test_descarga_delegada_con_x_sendfile(app, client, orden_con_pdf, monkeypatch):
+    monkeypatch.setattr(app.config, 'DOWNLOAD_ACCEL', 'x-sendfile')
+    monkeypatch.setitem(app.app.config, 'USE_X_SENDFILE', True)
+    informe_id, row = orden_con_pdf
+    
+    response = client.get(f'/download/{informe_id}')
+    
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['X-Sendfile'] == os.path.abspath(row['pdf_path'])
+
+def test_url_versionada_se_cachea_como_inmutable(client, orden_con_pdf):
+    informe_id, row = orden_con_pdf
+    
+    response = client.get(f'/download/{informe_id}?v={row["pdf_sha256"][:16]}')
+    
+    assert response.status_code == 200
+    assert response.cache_control.immutable
+    assert response.cache_control.private
+
+def test_recursos_con_huella_son_inmutables(app, client):
+    asset = next(iter(app.STATIC_ASSETS.values()))
+    
+    response = client.get(f'/assets/{asset.filename}', headers={'Accept-Encoding': 'gzip'})
+    
+    assert response.status_code == 200
+    assert response.cache_control.immutable
+    assert response.cache_control.public
+    assert response.cache_control.max_age == app.ASSET_MAX_AGE
+    assert 'Accept-Encoding' in response.headers['Vary']
+    
+    revalidacion = client.get(f'/assets/{asset.filename}', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag'],
+    })
+    assert revalidacion.status_code == 304
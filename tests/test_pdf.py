@@ -0,0 +1,149 @@
+"""Maquetación del PDF: secciones precompiladas, saltos de página y encabezado"""
+
+import base64
+import hashlib
+import io
+import re
+import zlib
+
+import pytest
+from reportlab.pdfgen import canvas as rcanvas
+
+def datos(app, **campos):
+    row = {field.name: '' for field in app.FORM_FIELDS}
+    row.update({'id': 1, 'institucion': 'Hospital PDF', 'fecha': '2024-05-10', 'checklist': {}, 'piezas': []})
+    row.update(campos)
+    return app.informe_a_datos_pdf(row)
+
+@pytest.fixture
+def renderizar(app):
+    """Render de una orden que registra cada texto como (página, y, texto)"""
+    class Grabador(app.PdfRenderer):
+        def __init__(self, c, data):
+            super().__init__(c, data)
+            self.page = 1
+            self.strings = []
+        
+        def draw_string(self, font, size, x, y, value):
+            self.strings.append((self.page, y, value))
+            super().draw_string(font, size, x, y, value)
+        
+        def new_page(self):
+            super().new_page()
+            self.page += 1
+    
+    def renderizar(data):
+        c = rcanvas.Canvas(io.BytesIO(), pagesize=app.A4)
+        renderer = Grabador(c, data)
+        renderer.render(app.PDF_HEADER_OPS, app.PDF_HEADER_HEIGHT, app.PDF_LAYOUT)
+        # Sin el pie de página, que va siempre en y=30
+        return renderer.page, [s for s in renderer.strings if not s[2].startswith('Documento generado')]
+    return renderizar
+
+def test_orden_corta_en_una_pagina(app, renderizar):
+    paginas, strings = renderizar(datos(app, problema_cliente='No enciende'))
+    
+    assert paginas == 1
+    textos = [texto for _, _, texto in strings]
+    assert 'PROBLEMA REPORTADO' in textos and 'No enciende' in textos
+    # Secciones opcionales sin contenido no dejan título
+    assert 'DETALLES Y OBSERVACIONES' not in textos
+
+def test_texto_largo_continua_en_otra_pagina_con_cont(app, renderizar):
+    lineas = [f'Observación número {n:03d}' for n in range(150)]
+    paginas, strings = renderizar(datos(app, detalles_servicio=' '.join(lineas)))
+    
+    assert paginas > 1
+    textos = [texto for _, _, texto in strings]
+    assert textos.count('DETALLES Y OBSERVACIONES') == 1
+    assert textos.count('DETALLES Y OBSERVACIONES (cont.)') == paginas - 1
+    # Todo el texto aparece, en orden y sobre el margen inferior
+    assert re.findall(r'(?<![.\d])\d{3}(?![.\d])', ' '.join(textos)) == [f'{n:03d}' for n in range(150)]
+    assert all(y >= app.PDF_BOTTOM for _, y, _ in strings)
+
+def test_titulo_nunca_queda_solo_al_pie(app, renderizar):
+    piezas = [(f'Repuesto {n}', '1') for n in range(60)]
+    paginas, strings = renderizar(datos(app, piezas=piezas, detalles_servicio='Fin del servicio'))
+    
+    assert paginas > 1
+    titulos = {'PIEZAS DE REEMPLAZO', 'DETALLES Y OBSERVACIONES', 'RESOLUCIÓN FINAL'}
+    for page in range(1, paginas + 1):
+        en_pagina = [texto for p, _, texto in strings if p == page]
+        assert en_pagina[-1] not in titulos
+    assert [t for _, _, t in strings if 'Repuesto' in t] == [f'• Repuesto {n} - Cant: 1' for n in range(60)]
+
+def test_generate_pdf_escribe_un_pdf_valido(app, tmp_path):
+    path = tmp_path / 'orden.pdf'
+    
+    app.generate_pdf(str(path), datos(app, detalles_servicio='x ' * 5000))
+    
+    contenido = path.read_bytes()
+    assert contenido.startswith(b'%PDF-') and contenido.rstrip().endswith(b'%%EOF')
+
+def contenido_pdf(path):
+    """El PDF con sus flujos Flate (y ASCII85) descomprimidos a continuación"""
+    data = path.read_bytes()
+    partes = [data]
+    for stream in re.findall(rb'stream\r?\n(.*?)\s*endstream', data, re.S):
+        try:
+            if stream.endswith(b'~>'):
+                stream = base64.a85decode(stream, adobe=True)
+            partes.append(zlib.decompress(stream))
+        except (ValueError, zlib.error):
+            pass
+    return b'\n'.join(partes)
+
+def test_membrete_como_form_xobject(app, tmp_path):
+    path = tmp_path / 'membrete.pdf'
+    
+    app.generate_pdf(str(path), datos(app))
+    
+    contenido = contenido_pdf(path)
+    assert contenido.count(b'/FormXob.membrete Do') == 1
+    assert b'/FormXob.membrete_logo Do' in contenido
+    assert b'(NOVAMEDICAL CHILE LTDA) Tj' in contenido
+    assert b'/Subtype /Image' in contenido
+
+def test_membrete_se_codifica_una_vez_por_proceso(app, tmp_path):
+    letterhead = app.PdfLetterhead(app.PDF_LETTERHEAD_OPS)
+    
+    for n in range(3):
+        c = app.rcanvas.Canvas(str(tmp_path / f'orden_{n}.pdf'), pagesize=app.A4)
+        app.PdfRenderer(c, datos(app)).render(app.PDF_HEADER_OPS, app.PDF_HEADER_HEIGHT, app.PDF_LAYOUT, letterhead)
+        c.save()
+    
+    logo, fonts, stream = letterhead.compile()
+    assert letterhead.compile()[2] is stream
+    assert [name for name, _ in fonts] == ['Helvetica-Bold', 'Helvetica']
+    assert all(b'/FormXob.membrete Do' in contenido_pdf(tmp_path / f'orden_{n}.pdf') for n in range(3))
+
+def test_membrete_a_mano_si_las_fuentes_no_coinciden(app, tmp_path):
+    path = tmp_path / 'a_mano.pdf'
+    c = app.rcanvas.Canvas(str(path), pagesize=app.A4)
+    # Otra fuente registrada antes cambia los nombres internos (/F1, /F2...)
+    c.setFont('Courier', 10)
+    
+    assert app.pdf_letterhead.draw(c) is False
+    app.PdfRenderer(c, datos(app)).render(app.PDF_HEADER_OPS, app.PDF_HEADER_HEIGHT, app.PDF_LAYOUT)
+    c.save()
+    
+    contenido = contenido_pdf(path)
+    assert b'/FormXob.membrete ' not in contenido
+    assert b'(NOVAMEDICAL CHILE LTDA) Tj' in contenido
+
+def test_firmas_incrustadas_en_la_pagina(app, tmp_path):
+    from test_signature_store import firma_bytes, trazos
+    path = tmp_path / 'firmas.pdf'
+    png = app.signature_store.put(firma_bytes())
+    vectorial = app.signature_store.put_strokes(trazos([(10, 10), (200, 80)]))
+    
+    app.generate_pdf(str(path), datos(app, tecnico_firma=png, cliente_firma=vectorial))
+    
+    contenido = contenido_pdf(path)
+    nombre = 'FormXob.firma_' + hashlib.sha1(png.encode()).hexdigest()[:16]
+    # La imagen queda en los recursos de la página y se dibuja una vez
+    assert contenido.count(f'/{nombre} Do'.encode()) == 1
+    assert re.search(rf'/XObject <<\s*/{nombre} \d+ 0 R'.encode(), contenido)
+    # Los trazos van como trazados en el flujo de la página
+    assert b'1 J 1 j 3 w' in contenido
+    assert b'[Firma del' not in contenido
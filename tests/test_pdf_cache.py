@@ -0,0 +1,71 @@
+"""Caché de PDF generados al descargarlos (PdfCache)"""
+
+import os
+import threading
+import time
+
+import pytest
+
+@pytest.fixture
+def filas(app, backend, crear_orden, monkeypatch):
+    """Filas de órdenes sin PDF (PDF_LAZY), listas para la caché"""
+    monkeypatch.setattr(app.config, 'PDF_LAZY', True)
+    def filas(n):
+        return [backend.get_informe(crear_orden(institucion=f'Hospital Caché {i}')) for i in range(n)]
+    return filas
+
+@pytest.fixture
+def renders(app, monkeypatch):
+    """Rutas generadas, en orden; cada render tarda un poco para solapar peticiones"""
+    rutas = []
+    generate_pdf_atomic = app.generate_pdf_atomic
+    def lento(path, data):
+        rutas.append(path)
+        time.sleep(0.05)
+        generate_pdf_atomic(path, data)
+    monkeypatch.setattr(app, 'generate_pdf_atomic', lento)
+    return rutas
+
+def test_peticiones_simultaneas_generan_un_solo_pdf(app, tmp_path, filas, renders):
+    cache = app.PdfCache(str(tmp_path), 10 * 1024 * 1024)
+    row, = filas(1)
+    rutas = []
+    
+    hilos = [threading.Thread(target=lambda: rutas.append(cache.get(row))) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    
+    assert len(renders) == 1
+    assert set(rutas) == {renders[0]}
+    assert cache.get(row) == renders[0] and len(renders) == 1
+
+def test_fila_modificada_genera_otro_pdf(app, tmp_path, filas, renders):
+    cache = app.PdfCache(str(tmp_path), 10 * 1024 * 1024)
+    row, = filas(1)
+    
+    original = cache.get(row)
+    modificada = cache.get({**row, 'detalles_servicio': 'Se cambió el fusible'})
+    
+    assert original != modificada
+    assert os.path.basename(modificada).startswith(f"orden_trabajo_{row['id']}-")
+    # El estado y la ruta del PDF no cambian el contenido
+    assert cache.path_for({**row, 'estado': 'rendered', 'pdf_path': 'x.pdf'}) == original
+    assert len(renders) == 2
+
+def test_desaloja_los_menos_usados(app, tmp_path, filas, renders):
+    a, b, c = filas(3)
+    cache = app.PdfCache(str(tmp_path), 10 * 1024 * 1024)
+    ruta_a, ruta_b = cache.get(a), cache.get(b)
+    cache.max_bytes = int((os.path.getsize(ruta_a) + os.path.getsize(ruta_b)) * 1.4)
+    os.utime(ruta_b, (time.time() - 60, time.time() - 60))
+    os.utime(ruta_a, (time.time() - 120, time.time() - 120))
+    assert cache.get(a) == ruta_a  # el acceso lo marca como reciente
+    
+    ruta_c = cache.get(c)
+    
+    assert os.path.exists(ruta_a) and os.path.exists(ruta_c)
+    assert not os.path.exists(ruta_b)
+    # El desalojado se vuelve a generar si se pide otra vez
+    assert cache.get(b) == ruta_b and len(renders) == 4
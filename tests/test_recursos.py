@@ -0,0 +1,79 @@
+"""Recursos estáticos con huella y app instalable (PWA)"""
+
+import gzip
+import json
+import re
+
+import pytest
+
+def test_la_pagina_enlaza_los_recursos_con_huella(app, client):
+    html = client.get('/').get_data(as_text=True)
+    
+    for name in ('app.css', 'app.js', 'cola.js'):
+        filename = app.STATIC_ASSETS[name].filename
+        stem, ext = name.rsplit('.', 1)
+        assert re.fullmatch(rf'{stem}\.[0-9a-f]{{12}}\.{ext}', filename)
+        assert f'/assets/{filename}' in html
+    # Nada de CSS ni JS de la app en línea: la página queda pequeña
+    assert '<style>' not in html
+
+def test_huella_cambia_con_el_contenido(app):
+    antes = app.build_asset('app.css', 'body { color: red }', 'text/css')
+    despues = app.build_asset('app.css', 'body { color: blue }', 'text/css')
+    
+    assert antes.filename != despues.filename
+    assert antes.filename == app.build_asset('app.css', 'body { color: red }', 'text/css').filename
+
+@pytest.mark.parametrize('aceptadas, encoding', [
+    ('gzip, deflate', 'gzip'),
+    ('gzip, deflate, br', 'br'),
+    ('', 'identity'),
+])
+def test_negocia_la_compresion(app, client, aceptadas, encoding):
+    if encoding == 'br':
+        brotli = pytest.importorskip('brotli')
+    asset = app.STATIC_ASSETS['app.js']
+    
+    response = client.get(f'/assets/{asset.filename}', headers={'Accept-Encoding': aceptadas})
+    
+    assert response.status_code == 200
+    assert response.headers.get('Content-Encoding') == (None if encoding == 'identity' else encoding)
+    assert response.mimetype == 'text/javascript'
+    body = response.get_data()
+    if encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif encoding == 'br':
+        body = brotli.decompress(body)
+    assert body == asset.bodies['identity']
+
+def test_cada_compresion_tiene_su_etag(app, client):
+    asset = app.STATIC_ASSETS['app.css']
+    
+    gz = client.get(f'/assets/{asset.filename}', headers={'Accept-Encoding': 'gzip'})
+    plano = client.get(f'/assets/{asset.filename}', headers={'Accept-Encoding': ''})
+    
+    assert gz.headers['ETag'] != plano.headers['ETag']
+
+def test_recurso_inexistente(client):
+    assert client.get('/assets/app.000000000000.css').status_code == 404
+
+def test_manifest_de_la_app_instalable(app, client):
+    response = client.get('/manifest.webmanifest')
+    
+    assert response.mimetype == 'application/manifest+json'
+    manifest = json.loads(response.get_data(as_text=True))
+    assert (manifest['start_url'], manifest['display']) == ('/', 'standalone')
+    for icon in manifest['icons']:
+        assert client.get(icon['src']).mimetype == 'image/png'
+
+def test_service_worker_guarda_la_pagina_y_sus_recursos(app, client):
+    response = client.get('/sw.js')
+    
+    assert response.mimetype == 'text/javascript'
+    assert response.cache_control.no_cache
+    js = response.get_data(as_text=True)
+    assert f'importScripts("/assets/{app.STATIC_ASSETS["cola.js"].filename}")' in js
+    for asset in app.STATIC_ASSETS.values():
+        assert f'/assets/{asset.filename}' in js
+    # La versión de la caché cambia con cada despliegue que cambie un recurso
+    assert re.search(r"'ot-shell-[0-9a-f]{12}'", js)
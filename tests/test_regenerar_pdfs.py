@@ -0,0 +1,15 @@
+"""Regeneración masiva de PDF (regenerar_pdfs)"""
+
+def test_regenerar_deja_las_ordenes_rendered(app, crear_orden):
+    fallida = crear_orden(institucion='Regeneración A')
+    enviada = crear_orden(institucion='Regeneración A')
+    app.storage.update_informe(fallida, estado='failed')
+    app.storage.update_informe(enviada, estado='sent')
+    
+    app.regenerar_pdfs({'institucion': 'Regeneración A'}, workers=1, chunk_size=10)
+    
+    row = app.storage.get_informe(fallida)
+    assert row['estado'] == 'rendered'
+    assert app.pdf_store.exists(row['pdf_path'])
+    assert row['pdf_sha256']
+    assert app.storage.get_informe(enviada)['estado'] == 'sent'
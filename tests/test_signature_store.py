@@ -0,0 +1,234 @@
+"""Firmas: escritura en segundo plano con reintentos y su uso en el PDF"""
+
+import base64
+import io
+import json
+import os
+import time
+
+import pytest
+from PIL import Image, ImageDraw
+
+from test_orden_flow import firma_png
+
+class AlmacenIntermitente:
+    """LocalBlobStore cuyo put falla las primeras `fallos` veces"""
+    
+    def __init__(self, app, root, fallos):
+        self.inner = app.LocalBlobStore(str(root))
+        self.fallos = fallos
+        self.intentos = 0
+    
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+    
+    def put(self, key, data):
+        self.intentos += 1
+        if self.intentos <= self.fallos:
+            raise OSError('almacén no disponible')
+        return self.inner.put(key, data)
+
+def firma_bytes():
+    return base64.b64decode(firma_png().split(',', 1)[1])
+
+@pytest.fixture
+def sin_espera(app, monkeypatch):
+    monkeypatch.setattr(app.config, 'SIGNATURE_RETRY_BASE', 0)
+
+def test_reintenta_la_escritura_hasta_guardarla(app, tmp_path, sin_espera):
+    blobs = AlmacenIntermitente(app, tmp_path, fallos=2)
+    store = app.SignatureStore(blobs)
+    
+    ref = store.put(firma_bytes())
+    assert store.flush() == 0
+    
+    assert blobs.intentos == 3
+    assert os.path.exists(ref)
+    assert not store._pending
+
+def test_flush_guarda_lo_que_el_hilo_no_pudo(app, tmp_path, sin_espera, monkeypatch):
+    monkeypatch.setattr(app.config, 'SIGNATURE_WRITE_RETRIES', 2)
+    blobs = AlmacenIntermitente(app, tmp_path, fallos=2)
+    store = app.SignatureStore(blobs)
+    
+    ref = store.put(firma_bytes())
+    store._queue.join()
+    assert not os.path.exists(ref)
+    # Mientras tanto se sigue sirviendo desde memoria
+    assert store.get(ref)
+    
+    assert store.flush() == 0
+    assert os.path.exists(ref)
+    assert not store._pending and not store._failed
+
+def test_firma_perdida_hace_fallar_el_render(app, backend, crear_orden, monkeypatch):
+    monkeypatch.setattr(app.config, 'SIGNATURE_WRITE_WAIT', 0)
+    monkeypatch.setattr(app.config, 'JOB_RETRY_BASE', 0.2)
+    informe_id = crear_orden(institucion='Hospital Firma Perdida', sig_tech=firma_png())
+    app.signature_store.flush()
+    ref = backend.get_informe(informe_id)['tecnico_firma']
+    os.remove(ref)
+    app.signature_image.cache_clear()
+    
+    app.job_queue.run_pending()
+    
+    # El trabajo vuelve a la cola en vez de emitir el PDF sin la firma
+    assert backend.get_informe(informe_id)['estado'] == 'pending'
+    assert backend.queue_depth()[('jobs', 'queued')] >= 1
+    
+    # Con la firma de vuelta en el almacén, el reintento genera el PDF
+    assert app.signature_store.put(firma_bytes()) == ref
+    app.signature_store.flush()
+    time.sleep(0.25)
+    app.job_queue.run_pending()
+    assert backend.get_informe(informe_id)['estado'] == 'rendered'
+
+def test_campo_sin_firma_usa_el_recuadro(app, tmp_path):
+    data = {'id': 1, 'tecnico_firma': '', 'cliente_firma': ''}
+    app.generate_pdf(str(tmp_path / 'sin_firma.pdf'), data)
+    
+    assert (tmp_path / 'sin_firma.pdf').read_bytes().startswith(b'%PDF-')
+
+def png(img, **opciones):
+    buf = io.BytesIO()
+    img.save(buf, 'PNG', **opciones)
+    return buf.getvalue()
+
+def test_misma_firma_se_guarda_una_vez(app, tmp_path):
+    store = app.SignatureStore(app.LocalBlobStore(str(tmp_path)))
+    
+    refs = {store.put(firma_bytes()) for _ in range(3)}
+    store.flush()
+    
+    assert len(refs) == 1
+    assert [p.name for p in tmp_path.rglob('*.png')] == [os.path.basename(refs.pop())]
+
+def test_distinta_compresion_comparte_archivo(app, tmp_path):
+    store = app.SignatureStore(app.LocalBlobStore(str(tmp_path)))
+    with Image.open(io.BytesIO(firma_bytes())) as img:
+        rapida, maxima = png(img, compress_level=0), png(img, compress_level=9, optimize=True)
+    assert rapida != maxima
+    
+    assert store.put(rapida) == store.put(maxima)
+
+def test_firma_en_blanco_no_se_guarda(app, tmp_path):
+    store = app.SignatureStore(app.LocalBlobStore(str(tmp_path)))
+    
+    assert store.put(png(Image.new('RGBA', (300, 100), (0, 0, 0, 0)))) is None
+    assert store.flush() == 0
+    assert not list(tmp_path.rglob('*.png'))
+
+def test_formato_distinto_de_png_se_rechaza(app, tmp_path):
+    store = app.SignatureStore(app.LocalBlobStore(str(tmp_path)))
+    buf = io.BytesIO()
+    Image.new('RGB', (300, 100), 'white').save(buf, 'JPEG')
+    
+    with pytest.raises(ValueError):
+        store.put(buf.getvalue())
+
+def test_normalizar_recorta_a_la_tinta(app):
+    img = Image.new('RGBA', (800, 400), (0, 0, 0, 0))
+    ImageDraw.Draw(img).rectangle([(300, 150), (339, 169)], fill='black')
+    
+    firma = app.normalize_signature(img)
+    
+    # Sólo el trazo más el margen de 4 px por lado, en escala de grises
+    assert firma.size == (40 + 8, 20 + 8)
+    assert firma.mode == 'L'
+    assert firma.getpixel((0, 0)) == 255 and firma.getpixel((24, 14)) == 0
+
+def test_normalizar_reduce_a_la_caja_del_pdf(app, monkeypatch):
+    monkeypatch.setattr(app.config, 'SIGNATURE_DPI', 144)
+    img = Image.new('RGBA', (2000, 1000), (0, 0, 0, 0))
+    ImageDraw.Draw(img).line([(0, 0), (1999, 999)], fill='black', width=20)
+    
+    firma = app.normalize_signature(img)
+    
+    # SIGNATURE_BOX en puntos a 144 dpi, sin deformar la firma
+    max_w, max_h = (side * 2 for side in app.SIGNATURE_BOX)
+    assert firma.width <= max_w and firma.height <= max_h
+    assert max_w in firma.size or max_h in firma.size
+    assert abs(firma.width / firma.height - 2) < 0.05
+
+def test_normalizar_en_blanco_y_bilevel(app, monkeypatch):
+    assert app.normalize_signature(Image.new('RGBA', (300, 100), (0, 0, 0, 0))) is None
+    assert app.normalize_signature(Image.new('RGB', (300, 100), 'white')) is None
+    
+    monkeypatch.setattr(app.config, 'SIGNATURE_BILEVEL', True)
+    with Image.open(io.BytesIO(firma_bytes())) as img:
+        firma = app.normalize_signature(img)
+    assert firma.mode == '1'
+
+def test_firma_normalizada_pesa_menos(app):
+    with Image.open(io.BytesIO(firma_bytes())) as img:
+        grande = img.resize((3000, 1000))
+    original = png(grande)
+    
+    _, guardada = app.SignatureStore.prepare(original)
+    
+    assert len(guardada) < len(original)
+    with Image.open(io.BytesIO(guardada)) as img:
+        assert img.mode == 'L'
+        assert img.width <= round(app.SIGNATURE_BOX[0] * app.config.SIGNATURE_DPI / 72)
+
+def trazos(*strokes, w=600, h=200):
+    """JSON del formulario: cada trazo con su primer punto absoluto y el resto como diferencias"""
+    s = []
+    for points in strokes:
+        deltas, px, py = [], 0, 0
+        for x, y in points:
+            deltas += [x - px, y - py]
+            px, py = x, y
+        s.append(deltas)
+    return json.dumps({'w': w, 'h': h, 's': s})
+
+def test_simplificar_quita_puntos_alineados(app):
+    recta = [(x, 2 * x) for x in range(50)]
+    codo = recta + [(49 + x, 98 - x) for x in range(1, 30)]
+    
+    assert app.simplify_stroke(recta, 0.5) == [(0, 0), (49, 98)]
+    assert app.simplify_stroke(codo, 0.5) == [(0, 0), (49, 98), (78, 69)]
+    assert app.simplify_stroke([(3, 3)], 0.5) == [(3, 3)]
+
+def test_trazos_canonicos_no_dependen_de_la_posicion(app):
+    firma = [[(10, 10), (20, 15), (30, 20), (40, 40)], [(15, 30)]]
+    movida = [[(x + 200, y + 50) for x, y in stroke] for stroke in firma]
+    
+    canonico = app.parse_signature_strokes(trazos(*firma))
+    
+    assert canonico == app.parse_signature_strokes(trazos(*movida))
+    assert json.loads(canonico) == {'w': 30, 'h': 30, 's': [[0, 0, 20, 10, 10, 20], [5, 20]]}
+
+@pytest.mark.parametrize('texto', [
+    'no es json',
+    '{"w": 600, "h": 200}',
+    '{"w": 0, "h": 200, "s": [[1, 1]]}',
+    '{"w": 600, "h": 200, "s": [[1, 1, 2]]}',
+    '{"w": 600, "h": 200, "s": [[1.5, 1]]}',
+    '{"w": 600, "h": 200, "s": [[590, 10, 20, 0]]}',
+])
+def test_trazos_invalidos_se_rechazan(app, texto):
+    with pytest.raises(ValueError):
+        app.parse_signature_strokes(texto)
+
+def test_trazos_vacios_no_son_firma(app):
+    assert app.parse_signature_strokes(trazos()) is None
+    assert app.guardar_firma(trazos()) is None
+
+def test_firma_vectorial_dibuja_trazados(app):
+    firma = app.VectorSignature(app.parse_signature_strokes(trazos([(10, 10), (40, 40)], [(15, 30)])))
+    
+    # Eje y invertido respecto al canvas; un toque aislado es un segmento de largo cero
+    assert firma.ops.splitlines()[1:] == ['0 30 m', '30 0 l', 'S', '5 10 m', '5 10 l', 'S']
+
+def test_orden_con_firma_vectorial(app, backend, crear_orden):
+    informe_id = crear_orden(institucion='Hospital Trazos', sig_tech=trazos([(10, 10), (200, 80), (400, 20)]))
+    app.signature_store.flush()
+    row = backend.get_informe(informe_id)
+    assert row['tecnico_firma'].endswith('.json')
+    
+    app.job_queue.run_pending()
+    
+    row = backend.get_informe(informe_id)
+    assert row['estado'] == 'rendered'
+    assert isinstance(app.signature_image(row['tecnico_firma']), app.VectorSignature)
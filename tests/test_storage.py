@@ -0,0 +1,178 @@
+"""Interfaz StorageBackend, igual con SQLite y con PostgreSQL"""
+
+import threading
+
+import pytest
+
+def orden(app, **campos):
+    values = {
+        'institucion': 'Hospital de Prueba', 'fecha': '2024-05-10', 'equipo': 'Autoclave',
+        'marca_modelo': 'Tuttnauer 3870', 'tecnico_nombre': 'Juan Pérez', 'pdf_path': '',
+        'estado': 'pending', 'created_at': '2024-05-10T10:00:00',
+    }
+    values.update(campos)
+    return values
+
+def test_insert_y_get_con_checklist_y_piezas(app, backend):
+    item = app.CHECKLIST_ITEMS[0]
+    informe_id = backend.insert_informe(
+        orden(app, institucion='Clínica Interfaz'),
+        checklist=[(item.code, app.CHECK_SI)],
+        piezas=[('Resistencia 2000W', '1'), ('Filtro', '2')],
+    )
+    
+    row = backend.get_informe(informe_id)
+    assert row['institucion'] == 'Clínica Interfaz'
+    assert row['checklist'] == {item.code: app.CHECK_SI}
+    assert [tuple(p) for p in row['piezas']] == [('Resistencia 2000W', '1'), ('Filtro', '2')]
+    assert backend.get_informe(informe_id + 10 ** 6) is None
+
+def test_insert_informes_devuelve_ids_en_orden(app, backend):
+    ordenes = [(orden(app, numero_serie=f'SN-{i}'), [], [(f'Pieza {i}', '1')]) for i in range(5)]
+    
+    ids = backend.insert_informes(ordenes)
+    
+    assert len(set(ids)) == 5
+    assert [backend.get_informe(i)['numero_serie'] for i in ids] == [f'SN-{i}' for i in range(5)]
+    detalles = backend.get_detalles(ids)
+    assert [tuple(p) for p in detalles[ids[3]]['piezas']] == [('Pieza 3', '1')]
+
+def test_ids_por_idempotency_key(app, backend):
+    key = f'clave-{backend.__class__.__name__}'
+    informe_id = backend.insert_informe(orden(app, idempotency_key=key))
+    
+    assert backend.ids_por_idempotency_key([key, 'otra-clave']) == {key: informe_id}
+
+def test_list_informes_pagina_por_cursor(app, backend):
+    ids = backend.insert_informes([(orden(app), [], []) for _ in range(3)])
+    
+    primera = backend.list_informes(limit=2)
+    assert [row['id'] for row in primera] == ids[:0:-1]
+    siguiente = backend.list_informes(before_id=primera[-1]['id'], limit=1)
+    assert [row['id'] for row in siguiente] == [ids[0]]
+
+def test_export_y_count_con_filtros(app, backend):
+    institucion = f'Exportación {backend.__class__.__name__}'
+    ids = backend.insert_informes([
+        (orden(app, institucion=institucion, fecha=fecha), [], [])
+        for fecha in ('2024-01-10', '2024-02-10', '2024-03-10')
+    ])
+    filtros = {'institucion': institucion, 'desde': '2024-02-01'}
+    
+    assert backend.count_informes(filtros) == 2
+    assert [row['id'] for row in backend.export_informes(filtros)] == ids[1:]
+    assert [row['id'] for row in backend.export_informes(filtros, after_id=ids[1])] == ids[2:]
+
+def test_search_informes_por_prefijo_sin_tildes(app, backend):
+    informe_id = backend.insert_informe(orden(
+        app, detalles_servicio='Se calibró la válvula de presión del autoclave esterilizador'
+    ))
+    
+    rows = backend.search_informes(app.terminos_busqueda('VALVULA presi'))
+    
+    assert informe_id in [row['id'] for row in rows]
+    assert backend.search_informes(app.terminos_busqueda('valvula inexistentisimo')) == []
+
+def test_update_informe(app, backend):
+    informe_id = backend.insert_informe(orden(app))
+    
+    backend.update_informe(informe_id, estado='rendered', pdf_path='pdfs/x.pdf', pdf_sha256='abc')
+    
+    row = backend.get_informe(informe_id)
+    assert (row['estado'], row['pdf_path'], row['pdf_sha256']) == ('rendered', 'pdfs/x.pdf', 'abc')
+
+def test_conteo_checklist_por_modelo(app, backend):
+    item = app.CHECKLIST_ITEMS[1]
+    modelo = f'Modelo {backend.__class__.__name__}'
+    backend.insert_informes([
+        (orden(app, marca_modelo=modelo), [(item.code, app.CHECK_SI)], []) for _ in range(2)
+    ])
+    
+    assert (modelo, 2) in [tuple(row) for row in backend.conteo_checklist(item.code)]
+
+def test_ping(backend):
+    backend.ping()
+
+def test_postgres_reutiliza_sentencias_preparadas(app, pg_storage):
+    informe_id = pg_storage.insert_informe(orden(app))
+    pg_storage.get_informe(informe_id)
+    pg_storage.get_informe(informe_id)
+    
+    # El pool entrega la última conexión devuelta: la misma de las consultas
+    with pg_storage.connection() as conn, conn.cursor() as cur:
+        cur.execute('SELECT name FROM pg_prepared_statements')
+        en_servidor = {row[0] for row in cur.fetchall()}
+        assert conn.prepared
+        assert conn.prepared <= en_servidor
+
+def test_postgres_migraciones_concurrentes(app, pg_dsn):
+    import psycopg2
+    
+    nombre = 'novamedical_test_migraciones'
+    admin = psycopg2.connect(pg_dsn)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS {nombre}')
+        cur.execute(f'CREATE DATABASE {nombre}')
+    dsn = psycopg2.extensions.make_dsn(pg_dsn, dbname=nombre)
+    storages = [app.PostgresStorage(dsn, 1, 2) for _ in range(4)]
+    errores = []
+    
+    def migrar(storage):
+        try:
+            storage.migrate()
+        except Exception as e:
+            errores.append(e)
+    
+    hilos = [threading.Thread(target=migrar, args=(storage,)) for storage in storages]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    
+    try:
+        assert errores == []
+        with storages[0].connection() as conn, conn.cursor() as cur:
+            cur.execute('SELECT version FROM schema_version ORDER BY version')
+            assert [row[0] for row in cur.fetchall()] == [version for version, _, _ in app.PG_MIGRATIONS]
+    finally:
+        for storage in storages:
+            storage._pool.closeall()
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS {nombre} WITH (FORCE)')
+        admin.close()
+
+def test_orden_y_su_render_en_la_misma_transaccion(app, client, backend, monkeypatch):
+    antes = backend.list_informes(limit=1)
+    encolados = backend.queue_depth()[('jobs', 'queued')]
+    
+    def cola_caida(*args, **kwargs):
+        raise RuntimeError('cola no disponible')
+    
+    monkeypatch.setattr(backend, 'enqueue_jobs', cola_caida)
+    response = client.post('/create', data={
+        'institucion': 'Hospital Atómico', 'fecha': '2024-05-10', 'tecnico_nombre': 'Juan Pérez',
+    })
+    
+    # Si no se puede encolar el render tampoco queda la orden
+    assert response.status_code == 302
+    assert backend.list_informes(limit=1) == antes
+    assert backend.queue_depth()[('jobs', 'queued')] == encolados
+
+def test_bloque_anidado_revierte_sin_tocar_el_externo(app, backend):
+    with backend.transaction():
+        externo = backend.insert_informe(orden(app, institucion='Transacción Externa'))
+        with pytest.raises(RuntimeError):
+            with backend.transaction():
+                backend.update_informe(externo, institucion='Transacción Interna')
+                raise RuntimeError('revertir sólo el bloque interno')
+    
+    assert backend.get_informe(externo)['institucion'] == 'Transacción Externa'
+
+def test_backend_incompleto_falla_al_construirse(app):
+    class SoloMigra(app.StorageBackend):
+        def migrate(self):
+            pass
+    
+    with pytest.raises(TypeError, match='abstract'):
+        SoloMigra()
@@ -0,0 +1,87 @@
+"""Trazas: muestreo con TRACE_SAMPLE_RATE y propagación W3C traceparent"""
+
+import pytest
+
+from test_mail_delivery import SpansEnMemoria
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+@pytest.fixture
+def spans(app, monkeypatch):
+    """Spans exportados durante la prueba: spans(sample_rate) -> función que los devuelve"""
+    exportador = SpansEnMemoria()
+    monkeypatch.setattr(app.tracer, 'exporter', exportador)
+    app.tracer.flush()
+    def configurar(sample_rate):
+        monkeypatch.setattr(app.tracer, 'sample_rate', sample_rate)
+        def exportados():
+            app.tracer.flush()
+            return exportador.spans
+        return exportados
+    return configurar
+
+@pytest.mark.parametrize('header, esperado', [
+    (f'00-{TRACE_ID}-{PARENT_ID}-01', (TRACE_ID, PARENT_ID, True)),
+    (f'00-{TRACE_ID}-{PARENT_ID}-00', (TRACE_ID, PARENT_ID, False)),
+    (f'00-{TRACE_ID}-{PARENT_ID}-03', (TRACE_ID, PARENT_ID, True)),
+    (f'00-{"0" * 32}-{PARENT_ID}-01', None),
+    (f'ff-{TRACE_ID}-{PARENT_ID}-01', None),
+    (f'00-{TRACE_ID}-{PARENT_ID}', None),
+    ('00-xyz-abc-01', None),
+    (None, None),
+])
+def test_parse_traceparent(app, header, esperado):
+    assert app.parse_traceparent(header) == esperado
+
+def test_sin_muestra_no_se_crean_spans(client, spans):
+    exportados = spans(0.0)
+    
+    assert client.get('/health').status_code == 200
+    
+    assert exportados() == []
+
+def test_con_muestra_completa_se_registra_cada_peticion(client, crear_orden, spans):
+    exportados = spans(1.0)
+    
+    crear_orden()
+    
+    por_nombre = {span['name']: span for span in exportados()}
+    raiz = por_nombre['POST /create']
+    assert 'parentSpanId' not in raiz
+    assert por_nombre['validar_formulario']['traceId'] == raiz['traceId']
+    assert por_nombre['validar_formulario']['parentSpanId'] == raiz['spanId']
+
+def test_traceparent_muestreado_continua_la_traza(client, spans):
+    exportados = spans(0.0)
+    
+    client.get('/health', headers={'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-01'})
+    
+    raiz, = [span for span in exportados() if span['name'] == 'GET /health']
+    assert (raiz['traceId'], raiz['parentSpanId']) == (TRACE_ID, PARENT_ID)
+
+def test_traceparent_no_muestreado_se_respeta(client, spans):
+    exportados = spans(1.0)
+    
+    client.get('/health', headers={'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-00'})
+    
+    assert exportados() == []
+
+def test_traceparent_invalido_empieza_otra_traza(client, spans):
+    exportados = spans(1.0)
+    
+    client.get('/health', headers={'traceparent': 'basura'})
+    
+    raiz, = [span for span in exportados() if span['name'] == 'GET /health']
+    assert raiz['traceId'] != TRACE_ID and 'parentSpanId' not in raiz
+
+def test_el_render_sigue_la_traza_del_create(app, crear_orden, spans):
+    exportados = spans(1.0)
+    crear_orden()
+    spans(0.0)
+    
+    app.job_queue.run_pending()
+    
+    # La decisión de muestreo viaja con el trabajo aunque la tasa haya cambiado
+    por_nombre = {span['name']: span for span in exportados()}
+    assert por_nombre['job render']['traceId'] == por_nombre['POST /create']['traceId']